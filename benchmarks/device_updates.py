@@ -0,0 +1,97 @@
+"""
+Count the sendto system calls needed to drive 50 robots receiving inputs at
+100 Hz when moves and fires are sent separately and when the state is
+applied in one update.
+
+Every input changes both the move and the fire state (worst case). The
+robots are UDP sockets on localhost.
+
+Run from the root of the repository:
+    python -m benchmarks.device_updates
+"""
+import argparse
+import socket
+import time
+
+from orwell.proxy_robots.devices import HarpiDevice
+from orwell.proxy_robots.devices import MoveFireAdapter
+
+
+class CountingSocket(object):
+    def __init__(self, sock):
+        self._socket = sock
+        self.sendto_count = 0
+
+    def sendto(self, data, address):
+        self.sendto_count += 1
+        return self._socket.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+
+def _create_devices(robot_count, hello):
+    devices = []
+    sockets = []
+    robots = []
+    for _ in range(robot_count):
+        proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        proxy_socket.bind(("127.0.0.1", 0))
+        proxy_socket.setblocking(False)
+        robot_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        robot_socket.bind(("127.0.0.1", 0))
+        robot_socket.setblocking(False)
+        robot_socket.sendto(hello, proxy_socket.getsockname())
+        counting_socket = CountingSocket(proxy_socket)
+        device = HarpiDevice(counting_socket)
+        while not device.ready():
+            time.sleep(0.001)
+        devices.append(device)
+        sockets.append(counting_socket)
+        robots.append(robot_socket)
+    return devices, sockets, robots
+
+
+def measure(mode, robot_count, rate, duration):
+    hello = b"robot binary" if "binary" == mode else b"robot"
+    devices, sockets, robots = _create_devices(robot_count, hello)
+    if "move+fire" == mode:
+        devices = [MoveFireAdapter(device) for device in devices]
+    ticks = int(rate * duration)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        left = (tick % 2) * 0.5
+        fire = bool(tick % 2)
+        for device in devices:
+            device.apply_state(left, -left, fire, not fire)
+        # the robots drop what they receive
+        for robot in robots:
+            try:
+                while robot.recv(64):
+                    pass
+            except BlockingIOError:
+                pass
+    elapsed = time.perf_counter() - start
+    calls = sum(counting_socket.sendto_count for counting_socket in sockets)
+    for robot in robots:
+        robot.close()
+    return calls / duration, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--robots", default=50, type=int)
+    parser.add_argument("--rate", help="Inputs per second.", default=100, type=int)
+    parser.add_argument(
+        "--duration", help="Simulated seconds.", default=2.0, type=float)
+    arguments = parser.parse_args()
+    for mode in ("move+fire", "ascii", "binary"):
+        syscalls, elapsed = measure(
+            mode, arguments.robots, arguments.rate, arguments.duration)
+        print("{mode:>9}: {syscalls:8.0f} sendto/s "
+              "(sent in {elapsed:.3f} s)".format(
+                  mode=mode, syscalls=syscalls, elapsed=elapsed))
+
+
+if "__main__" == __name__:
+    main()
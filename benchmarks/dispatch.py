@@ -0,0 +1,91 @@
+"""
+Measure the cost of dispatching Input messages through the MessageHub when
+1, 10, 100 and 1000 robots listen to their own inputs.
+
+Run from the root of the repository:
+    python -m benchmarks.dispatch
+"""
+import argparse
+import time
+from unittest import mock
+
+from orwell.proxy_robots.message_hub import MessageHub
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+
+ROBOT_COUNTS = (1, 10, 100, 1000)
+
+
+class ListSubscriber(object):
+    def __init__(self, address, context):
+        self.messages = []
+
+    def read(self):
+        if self.messages:
+            return self.messages.pop()
+        return None
+
+
+class CountingListener(object):
+    def __init__(self):
+        self.count = 0
+
+    def notify(self, message_type, routing_id, message):
+        self.count += 1
+
+
+def _input_payload(routing_id):
+    message = REGISTRY[Messages.Input.name]()
+    message.move.left = 0.5
+    message.move.right = -0.5
+    payload = "{0} {1} ".format(routing_id, Messages.Input.name).encode()
+    return payload + message.SerializeToString()
+
+
+def measure(robot_count, message_count):
+    subscriber = ListSubscriber(None, None)
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        mock.MagicMock(),
+        mock.MagicMock(),
+        None)
+    listeners = []
+    payloads = []
+    for index in range(robot_count):
+        routing_id = str(index)
+        listener = CountingListener()
+        message_hub.register_listener(
+            listener, Messages.Input.name, routing_id)
+        listeners.append(listener)
+        payloads.append(_input_payload(routing_id))
+    subscriber.messages = [
+        payloads[index % robot_count] for index in range(message_count)]
+    start = time.perf_counter()
+    message_hub.step()
+    duration = time.perf_counter() - start
+    assert message_count == sum(listener.count for listener in listeners)
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--messages",
+        help="Number of Input messages dispatched for each robot count.",
+        default=100000, type=int)
+    arguments = parser.parse_args()
+    for robot_count in ROBOT_COUNTS:
+        duration = measure(robot_count, arguments.messages)
+        print("{robots:>5} robots: {per_message:.2f} us/message "
+              "({rate:.0f} messages/s)".format(
+                  robots=robot_count,
+                  per_message=duration / arguments.messages * 1e6,
+                  rate=arguments.messages / duration))
+
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,81 @@
+"""
+Measure the Engine with 10k concurrent actions: half of them wait for a
+notification (which arrives progressively) and the other half keep failing
+and are retried with a backoff.
+
+Run from the root of the repository:
+    python -m benchmarks.engine
+"""
+import argparse
+import time
+
+from orwell.proxy_robots.action import Action
+from orwell.proxy_robots.backoff import Backoff
+from orwell.proxy_robots.engine import Engine
+
+
+class NullProxy(object):
+    message_type = "Registered"
+    routing_id = ""
+
+    def register_listener(self, action):
+        pass
+
+    def unregister(self, action):
+        pass
+
+    def callback(self, message_type, routing_id, message):
+        pass
+
+
+def measure(action_count, notifications_per_step):
+    engine = Engine()
+    proxy = NullProxy()
+    pending = []
+    for index in range(action_count):
+        if index % 2:
+            action = Action(lambda: True, lambda: True, proxy, repeat=True)
+            pending.append(action)
+        else:
+            action = Action(
+                lambda: False,
+                lambda: True,
+                repeat=True,
+                backoff=Backoff(initial=0.001, maximum=0.05))
+        engine.add_action(action)
+    steps = 0
+    start = time.perf_counter()
+    engine.step()
+    steps += 1
+    while pending:
+        for action in pending[-notifications_per_step:]:
+            action.notify(NullProxy.message_type, "", None)
+        del pending[-notifications_per_step:]
+        engine.step()
+        steps += 1
+    duration = time.perf_counter() - start
+    return steps, duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--actions",
+        help="Number of concurrent actions.",
+        default=10000, type=int)
+    parser.add_argument(
+        "--notifications",
+        help="Number of pending actions notified between two steps.",
+        default=50, type=int)
+    arguments = parser.parse_args()
+    steps, duration = measure(arguments.actions, arguments.notifications)
+    print("{actions} actions: {steps} steps in {duration:.3f} s "
+          "({per_step:.1f} us/step)".format(
+              actions=arguments.actions,
+              steps=steps,
+              duration=duration,
+              per_step=duration / steps * 1e6))
+
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,158 @@
+"""
+Compare the single frame and the multipart wire modes for large Register
+messages (the image field can carry real image data).
+
+Messages are posted to a MessageHub, written by its Pusher and read back by
+its subscriber (a PULL socket on the same inproc endpoint) so that both
+the sending and the receiving paths are exercised.
+
+The copies are measured with tracemalloc: the peaks of the memory allocated
+by Python while posting (serialization), writing (framing) and reading
+(reception and parsing) a message are added up, in image sizes. The copies
+made inside libzmq are not traced.
+
+Run from the root of the repository:
+    python -m benchmarks.framing
+"""
+import argparse
+import time
+import tracemalloc
+import zmq
+
+from orwell.proxy_robots.connectors import Pusher
+from orwell.proxy_robots.message_hub import MessageHub
+from orwell.proxy_robots.message_hub import WireMode
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+
+ADDRESS = "inproc://benchmark_framing"
+IMAGE_SIZES = (1024, 64 * 1024, 1024 * 1024)
+# number of round trips traced to measure the memory allocated (tracing
+# slows everything down so it is not done while timing)
+TRACED_COUNT = 10
+
+
+class PullSubscriber(object):
+    def __init__(self, address, zmq_context):
+        self._socket = zmq_context.socket(zmq.PULL)
+        self._socket.bind(address)
+
+    def read(self):
+        try:
+            return self._socket.recv(flags=zmq.NOBLOCK)
+        except zmq.error.Again:
+            return None
+
+    def read_multipart(self):
+        try:
+            return self._socket.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+        except zmq.error.Again:
+            return None
+
+    def close(self):
+        self._socket.close()
+
+
+class ImageListener(object):
+    def __init__(self):
+        self.received = 0
+
+    def notify(self, message_type, routing_id, message):
+        self.received += len(message.image)
+
+
+class NoReplier(object):
+    def __init__(self, address, zmq_context):
+        pass
+
+
+def _traced_peak(function, *args):
+    """
+    Return the largest amount of memory (in bytes) allocated by Python while
+    calling #function (tracemalloc must be tracing).
+    """
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    return peak - current
+
+
+def measure(wire_mode, image_size, count):
+    """
+    Return the time (in seconds) taken by #count round trips and the largest
+    amount of memory (in bytes) allocated by Python during a round trip (see
+    the module documentation).
+    """
+    context = zmq.Context.instance()
+    subscribers = []
+
+    def subscriber_type(address, zmq_context):
+        subscriber = PullSubscriber(address, zmq_context)
+        subscribers.append(subscriber)
+        return subscriber
+
+    address = "{0}_{1}_{2}".format(ADDRESS, wire_mode.name, image_size)
+    message_hub = MessageHub(
+        context,
+        address,
+        address,
+        None,
+        subscriber_type,
+        Pusher,
+        NoReplier,
+        None,
+        wire_mode=wire_mode)
+    listener = ImageListener()
+    message_hub.register_listener(listener, Messages.Register.name, "")
+    message = REGISTRY[Messages.Register.name]()
+    message.temporary_robot_id = "951"
+    message.image = "x" * image_size
+    start = time.perf_counter()
+    for _ in range(count):
+        message_hub.post_message("951", Messages.Register.name, message)
+        # write the message
+        message_hub.step()
+        # read it back
+        message_hub.step()
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    peak_allocated = 0
+    for _ in range(TRACED_COUNT):
+        allocated = _traced_peak(
+            message_hub.post_message, "951", Messages.Register.name, message)
+        # write the message
+        allocated += _traced_peak(message_hub.step)
+        # read it back
+        allocated += _traced_peak(message_hub.step)
+        peak_allocated = max(peak_allocated, allocated)
+    tracemalloc.stop()
+    assert (count + TRACED_COUNT) * image_size == listener.received
+    for subscriber in subscribers:
+        subscriber.close()
+    return duration, peak_allocated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--count",
+        help="Number of Register messages exchanged for each image size.",
+        default=500, type=int)
+    arguments = parser.parse_args()
+    for image_size in IMAGE_SIZES:
+        for wire_mode in (WireMode.single, WireMode.multipart):
+            duration, allocated = measure(
+                wire_mode, image_size, arguments.count)
+            print("{mode:>9} image={size:>8} B: {rate:8.0f} messages/s "
+                  "{throughput:8.1f} MB/s {copies:4.1f} images allocated"
+                  "/message".format(
+                      mode=wire_mode.name,
+                      size=image_size,
+                      rate=arguments.count / duration,
+                      throughput=arguments.count * image_size / duration / 1e6,
+                      copies=allocated / image_size))
+
+
+if "__main__" == __name__:
+    main()
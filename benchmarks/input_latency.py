@@ -0,0 +1,168 @@
+"""
+Measure the latency between the game server publishing an Input message and
+the proxy calling `device.move`, with the historical sleep-based main loop
+and with the reactor (`--reactor`).
+
+Run from the root of the repository:
+    python -m benchmarks.input_latency
+"""
+import argparse
+import statistics
+import threading
+import time
+import zmq
+
+from orwell.proxy_robots.program import LOOP_SLEEP
+from orwell.proxy_robots.program import Program
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+
+ROBOT_ID = "951"
+REAL_ROBOT_ID = "real_951"
+
+
+class Arguments(object):
+    address = "127.0.0.1"
+    publisher_port = None
+    puller_port = None
+    replier_port = None
+    # let zmq pick the port
+    admin_port = "*"
+    no_server_broadcast = True
+    no_proxy_broadcast = True
+    subscription_filtering = False
+    wire_mode = "single"
+    max_reads_per_step = 64
+    writer_thread = False
+    input_coalescing = False
+    profile = False
+    tick_budget = 0.01
+    admin_stream_port = 0
+    capture = None
+
+
+class LatencyDevice(object):
+    def __init__(self):
+        self.moved = threading.Event()
+        self.move_time = None
+
+    @property
+    def address(self):
+        return "127.0.0.1"
+
+    def move(self, left, right):
+        self.move_time = time.perf_counter()
+        self.moved.set()
+
+    def fire(self, fire1, fire2):
+        pass
+
+    def ready(self):
+        return True
+
+    def get_socket(self):
+        return None
+
+
+def _encode(routing_id, message_type, message):
+    payload = "{0} {1} ".format(routing_id, message_type).encode()
+    return payload + message.SerializeToString()
+
+
+def _run_proxy(arguments, device, reactor, running, ready, programs):
+    program = Program(zmq.Context.instance(), arguments)
+    program.add_robot(ROBOT_ID, device)
+    program.start()
+    programs.append(program)
+    ready.set()
+    while running.is_set():
+        if reactor:
+            program.wait()
+            program.step()
+        else:
+            program.step()
+            time.sleep(LOOP_SLEEP)
+
+
+def measure(reactor, count):
+    context = zmq.Context.instance()
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.LINGER, 0)
+    puller = context.socket(zmq.PULL)
+    puller.setsockopt(zmq.LINGER, 0)
+    arguments = Arguments()
+    arguments.publisher_port = publisher.bind_to_random_port("tcp://127.0.0.1")
+    arguments.puller_port = puller.bind_to_random_port("tcp://127.0.0.1")
+    arguments.replier_port = arguments.puller_port + 1
+    device = LatencyDevice()
+    running = threading.Event()
+    running.set()
+    ready = threading.Event()
+    programs = []
+    proxy = threading.Thread(
+        target=_run_proxy,
+        args=(arguments, device, reactor, running, ready, programs))
+    proxy.start()
+    ready.wait()
+    robot = programs[0].robots[ROBOT_ID]
+    puller.recv()
+    registered = REGISTRY[Messages.Registered.name]()
+    registered.robot_id = REAL_ROBOT_ID
+    registered.team = "BLU"
+    payload = _encode(ROBOT_ID, Messages.Registered.name, registered)
+    # the first messages are lost until the subscription is up
+    while not robot.registered:
+        publisher.send(payload)
+        deadline = time.monotonic() + 0.2
+        while not robot.registered and time.monotonic() < deadline:
+            time.sleep(0.01)
+    # the first input moves the robot
+    warm_up = REGISTRY[Messages.Input.name]()
+    warm_up.move.left = 0.1
+    warm_up_payload = _encode(REAL_ROBOT_ID, Messages.Input.name, warm_up)
+    while not device.moved.wait(0.05):
+        publisher.send(warm_up_payload)
+    latencies = []
+    for index in range(count):
+        message = REGISTRY[Messages.Input.name]()
+        message.move.left = (index % 2) * 0.5
+        message.move.right = 1.0
+        payload = _encode(REAL_ROBOT_ID, Messages.Input.name, message)
+        device.moved.clear()
+        # do not always publish in phase with the loop
+        time.sleep(0.003)
+        start = time.perf_counter()
+        publisher.send(payload)
+        if device.moved.wait(1):
+            latencies.append(device.move_time - start)
+    running.clear()
+    proxy.join()
+    publisher.close()
+    puller.close()
+    return latencies
+
+
+def _report(name, latencies):
+    latencies = sorted(latencies)
+    print("{name:>8}: n={count} median={median:.3f} ms p99={p99:.3f} ms "
+          "max={maximum:.3f} ms".format(
+              name=name,
+              count=len(latencies),
+              median=statistics.median(latencies) * 1000,
+              p99=latencies[int(len(latencies) * 0.99) - 1] * 1000,
+              maximum=latencies[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--count",
+        help="Number of Input messages to send for each loop.",
+        default=200, type=int)
+    arguments = parser.parse_args()
+    _report("sleep", measure(False, arguments.count))
+    _report("reactor", measure(True, arguments.count))
+
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,108 @@
+"""
+Measure the cost of dispatching Input messages to robots through the
+MessageHub with logging at INFO, at DEBUG and at DEBUG sampled 1 in 100
+(see log_sampling). The records are formatted into an in-memory stream.
+
+Run from the root of the repository:
+    python -m benchmarks.logging_dispatch
+"""
+import argparse
+import io
+import logging
+import time
+from unittest import mock
+
+from orwell.proxy_robots.devices import FakeDevice
+from orwell.proxy_robots.log_sampling import HOT_PATH_LOGGERS
+from orwell.proxy_robots.log_sampling import SamplingFilter
+from orwell.proxy_robots.message_hub import MessageHub
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+from orwell.proxy_robots.robot import Robot
+
+ROBOT_COUNT = 10
+SAMPLING_RATE = 100
+
+
+class ListSubscriber(object):
+    def __init__(self, address, context):
+        self.messages = []
+
+    def read(self):
+        if self.messages:
+            return self.messages.pop()
+        return None
+
+
+def _input_payload(routing_id):
+    message = REGISTRY[Messages.Input.name]()
+    message.move.left = 0.5
+    message.move.right = -0.5
+    payload = "{0} {1} ".format(routing_id, Messages.Input.name).encode()
+    return payload + message.SerializeToString()
+
+
+def _configure_logging(level, sampling_rate):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(name)s %(levelname)s %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    for name in HOT_PATH_LOGGERS:
+        logger = logging.getLogger(name)
+        logger.filters[:] = []
+        if sampling_rate:
+            logger.addFilter(SamplingFilter(sampling_rate))
+    return stream
+
+
+def measure(level, sampling_rate, message_count):
+    stream = _configure_logging(level, sampling_rate)
+    subscriber = ListSubscriber(None, None)
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        mock.MagicMock(),
+        mock.MagicMock(),
+        None)
+    payloads = []
+    for index in range(ROBOT_COUNT):
+        robot_id = str(index)
+        robot = Robot(robot_id, mock.MagicMock(), mock.MagicMock(), FakeDevice())
+        message_hub.register_listener(robot, Messages.Input.name, robot_id)
+        payloads.append(_input_payload(robot_id))
+    subscriber.messages = [
+        payloads[index % ROBOT_COUNT] for index in range(message_count)]
+    start = time.perf_counter()
+    message_hub.step()
+    duration = time.perf_counter() - start
+    return duration, stream.getvalue().count("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--messages",
+        help="Number of Input messages dispatched for each logging setup.",
+        default=20000, type=int)
+    arguments = parser.parse_args()
+    for name, level, sampling_rate in (
+            ("INFO", logging.INFO, 0),
+            ("DEBUG", logging.DEBUG, 0),
+            ("DEBUG 1/{0}".format(SAMPLING_RATE), logging.DEBUG,
+             SAMPLING_RATE)):
+        duration, records = measure(level, sampling_rate, arguments.messages)
+        print("{name:>10}: {per_message:6.2f} us/message "
+              "({records} records)".format(
+                  name=name,
+                  per_message=duration / arguments.messages * 1e6,
+                  records=records))
+
+
+if "__main__" == __name__:
+    main()
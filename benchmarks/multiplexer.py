@@ -0,0 +1,101 @@
+"""
+Compare one UDP socket per robot with a single socket shared by all the
+robots (DeviceMultiplexer) for 1 to 500 simulated robots on localhost.
+
+Each tick, every simulated robot sends a status datagram and the proxy side
+reads them all.
+
+Run from the root of the repository:
+    python -m benchmarks.multiplexer
+"""
+import argparse
+import socket
+import time
+
+from orwell.proxy_robots.devices import DeviceMultiplexer
+from orwell.proxy_robots.devices import HarpiDevice
+
+ROBOT_COUNTS = (1, 10, 100, 500)
+
+
+def _udp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.setblocking(False)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    return sock
+
+
+def _wait_ready(devices):
+    deadline = time.monotonic() + 5
+    while not all(device.ready() for device in devices):
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def measure_per_socket(robots, ticks):
+    proxy_sockets = [_udp_socket() for _ in robots]
+    devices = [HarpiDevice(sock) for sock in proxy_sockets]
+    for robot, sock in zip(robots, proxy_sockets):
+        robot.sendto(b"robot", sock.getsockname())
+    _wait_ready(devices)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for robot, sock in zip(robots, proxy_sockets):
+            robot.sendto(b"status battery=50", sock.getsockname())
+        for device in devices:
+            device.ready()
+    duration = time.perf_counter() - start
+    # the sockets are closed with the devices (which stop the robots first)
+    return duration, len(proxy_sockets)
+
+
+def measure_shared(robots, ticks):
+    shared_socket = _udp_socket()
+    address = shared_socket.getsockname()
+    multiplexer = DeviceMultiplexer(shared_socket)
+    devices = []
+    for index, robot in enumerate(robots):
+        devices.append(multiplexer.create_device(str(index)))
+        robot.sendto("robot robot_id={0}".format(index).encode(), address)
+    deadline = time.monotonic() + 5
+    while not all(device.ready() for device in devices):
+        assert time.monotonic() < deadline
+        multiplexer.step()
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for robot in robots:
+            robot.sendto(b"status battery=50", address)
+        multiplexer.step()
+        for device in devices:
+            device.ready()
+    duration = time.perf_counter() - start
+    # stop the robots while the shared socket is still open
+    for index in range(len(robots)):
+        multiplexer.remove_device(str(index))
+    del devices[:]
+    return duration, 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", default=200, type=int)
+    arguments = parser.parse_args()
+    for robot_count in ROBOT_COUNTS:
+        robots = [_udp_socket() for _ in range(robot_count)]
+        for name, measure in (
+                ("per socket", measure_per_socket),
+                ("shared", measure_shared)):
+            duration, socket_count = measure(robots, arguments.ticks)
+            print("{robots:>4} robots {name:>10}: {sockets:>4} sockets "
+                  "{per_tick:8.1f} us/tick".format(
+                      robots=robot_count,
+                      name=name,
+                      sockets=socket_count,
+                      per_tick=duration / arguments.ticks * 1e6))
+        for robot in robots:
+            robot.close()
+
+
+if "__main__" == __name__:
+    main()
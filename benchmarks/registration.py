@@ -0,0 +1,142 @@
+"""
+Measure the time until all the robots of a configuration are registered for
+10, 100 and 1000 robots, against a local fake game server replying to each
+Register with a Registered. The robots either register in batches (see
+RegistrationQueue) or all at once.
+
+Run from the root of the repository:
+    python -m benchmarks.registration
+"""
+import argparse
+import threading
+import time
+import zmq
+
+from orwell.proxy_robots.program import Program
+from orwell.proxy_robots.provisioning import Configuration
+from orwell.proxy_robots.provisioning import DeviceType
+from orwell.proxy_robots.provisioning import REGISTRATION_BATCH_SIZE
+from orwell.proxy_robots.provisioning import REGISTRATION_INTERVAL
+from orwell.proxy_robots.provisioning import RobotDescription
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+
+ROBOT_COUNTS = (10, 100, 1000)
+# time given to the proxy to connect to the fake server before measuring
+CONNECTION_DELAY = 0.3
+
+
+class Arguments(object):
+    address = "127.0.0.1"
+    publisher_port = None
+    puller_port = None
+    replier_port = None
+    # let zmq pick the port
+    admin_port = "*"
+    no_server_broadcast = True
+    no_proxy_broadcast = True
+    subscription_filtering = False
+    wire_mode = "single"
+    max_reads_per_step = 64
+    writer_thread = False
+    input_coalescing = False
+    profile = False
+    tick_budget = 0.01
+    admin_stream_port = 0
+    capture = None
+
+
+def _serve(puller, publisher, running):
+    """
+    Reply to every Register with a Registered for the temporary id.
+    """
+    poller = zmq.Poller()
+    poller.register(puller, zmq.POLLIN)
+    while running.is_set():
+        if not poller.poll(50):
+            continue
+        while True:
+            try:
+                payload = puller.recv(zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            routing_id, message_type, raw_message = payload.split(b" ", 2)
+            if Messages.Register.name.encode() != message_type:
+                continue
+            message = REGISTRY[Messages.Register.name]()
+            message.ParseFromString(raw_message)
+            registered = REGISTRY[Messages.Registered.name]()
+            registered.robot_id = "real_" + message.temporary_robot_id
+            registered.team = "BLU"
+            publisher.send(
+                routing_id + b" " + Messages.Registered.name.encode() + b" " +
+                registered.SerializeToString())
+
+
+def measure(count, batch_size, interval):
+    """
+    Return the time (in seconds) until #count robots are registered.
+    """
+    context = zmq.Context.instance()
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.LINGER, 0)
+    puller = context.socket(zmq.PULL)
+    puller.setsockopt(zmq.LINGER, 0)
+    arguments = Arguments()
+    arguments.publisher_port = publisher.bind_to_random_port("tcp://127.0.0.1")
+    arguments.puller_port = puller.bind_to_random_port("tcp://127.0.0.1")
+    arguments.replier_port = arguments.puller_port + 1
+    running = threading.Event()
+    running.set()
+    server = threading.Thread(
+        target=_serve, args=(puller, publisher, running))
+    server.start()
+    program = Program(context, arguments)
+    program.start()
+    # the first messages are lost until the subscription is up
+    deadline = time.monotonic() + CONNECTION_DELAY
+    while time.monotonic() < deadline:
+        program.wait(0.01)
+        program.step()
+    configuration = Configuration(
+        [RobotDescription(str(index), DeviceType.fake)
+         for index in range(count)],
+        batch_size,
+        interval)
+    start = time.perf_counter()
+    program.load_configuration(configuration)
+    robots = list(program.robots.values())
+    while not all(robot.registered for robot in robots):
+        program.wait()
+        program.step()
+    duration = time.perf_counter() - start
+    for robot_id in list(program.robots):
+        program.remove_robot(robot_id)
+    running.clear()
+    server.join()
+    publisher.close()
+    puller.close()
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch-size",
+        help="Number of robots registering at once in batched mode.",
+        default=REGISTRATION_BATCH_SIZE, type=int)
+    parser.add_argument(
+        "--interval",
+        help="Time (in seconds) between two batches in batched mode.",
+        default=REGISTRATION_INTERVAL, type=float)
+    arguments = parser.parse_args()
+    for count in ROBOT_COUNTS:
+        for name, batch_size in (
+                ("batched", arguments.batch_size), ("all", 0)):
+            duration = measure(count, batch_size, arguments.interval)
+            print("{count:>5} robots {name:>8}: {duration:.3f} s".format(
+                count=count, name=name, duration=duration))
+
+
+if "__main__" == __name__:
+    main()
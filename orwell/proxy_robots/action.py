@@ -18,7 +18,10 @@ class Action(object):
             doer,
             success,
             proxy=None,
-            repeat=False):
+            repeat=False,
+            backoff=None,
+            timeout=None,
+            retry_on_timeout=True):
         """
         `doer`: the function that does something.
         `success`: the function to call to check if the action is successful
@@ -27,22 +30,60 @@ class Action(object):
             register to (if needed). If None, there is no registration.
         `repeat`: True if and only if the action is to be attempted again on
             failure. The function #doer is called again when this happens.
+        `backoff`: object giving the delays to wait before repeating the action
+            (see #Backoff). If None, the engine decides.
+        `timeout`: time (in seconds) to wait for the notification once the
+            function has been called. If None, wait forever.
+        `retry_on_timeout`: if True, an action to repeat is also repeated
+            when it times out or is cancelled, otherwise it is given up.
         """
         self._doer = doer
         self._success = success
         self._repeat = repeat
+        self._backoff = backoff
+        self._timeout = timeout
+        self._retry_on_timeout = retry_on_timeout
         self._proxy = proxy
         self._status = Status.created
+        self._observer = None
+        self._done_callbacks = []
+        # message hub the listener is registered to
+        self._message_hub = None
+        self._listening = False
         if self._proxy:
             self._proxy.register_listener(self)
+            self._listening = True
 
     def call(self):
         """
         Call the wrapped function.
         """
+        if self._proxy and not self._listening:
+            # the listener was unregistered by a timeout or a cancellation
+            self._proxy.register_listener(self)
+            self._listening = True
         sent = self._doer()
         self._update_status(sent)
 
+    def time_out(self):
+        """
+        Stop waiting for the notification as it did not come in time.
+        """
+        self._give_up(Status.timed_out)
+
+    def cancel(self):
+        """
+        Stop waiting for the notification (for instance because the message
+        hub it was to come from went away).
+        """
+        self._give_up(Status.cancelled)
+
+    def _give_up(self, status):
+        self._status = status
+        if self._listening:
+            self._proxy.unregister(self)
+            self._listening = False
+
     def reset(self):
         """
         To be called on failure to make it possible to repeat the action.
@@ -60,6 +101,55 @@ class Action(object):
     def repeat(self):
         return self._repeat
 
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def retry_on_timeout(self):
+        return self._retry_on_timeout
+
+    @property
+    def message_hub(self):
+        """
+        The message hub the action listens to for its notification (None if
+        not known).
+        """
+        return self._message_hub
+
+    def set_message_hub(self, message_hub):
+        self._message_hub = message_hub
+
+    def retry_delay(self):
+        """
+        Delay (in seconds) to wait before repeating the action, or None if the
+        action has no backoff.
+        """
+        if self._backoff is None:
+            return None
+        return self._backoff.next_delay()
+
+    def add_done_callback(self, callback):
+        """
+        `callback`: function called with the action as argument once the
+            engine is done with it (whatever the final status).
+        """
+        self._done_callbacks.append(callback)
+
+    def finish(self):
+        """
+        Called by the engine when the action will not be run again.
+        """
+        for callback in self._done_callbacks:
+            callback(self)
+
+    def set_observer(self, observer):
+        """
+        `observer`: function called with the action as argument once the
+            notification has been processed.
+        """
+        self._observer = observer
+
     def _update_status(self, sent=False):
         """
         Update the status of the action.
@@ -77,7 +167,11 @@ class Action(object):
         if not updated:
             if Status.pending == self._status:
                 self._status = Status.waiting
-            elif self._status in (Status.successful, Status.failed):
+            elif self._status in (
+                    Status.successful,
+                    Status.failed,
+                    Status.timed_out,
+                    Status.cancelled):
                 self._status = Status.created
         if Status.waiting == self._status:
             if not self._proxy:
@@ -95,10 +189,9 @@ class Action(object):
         May only be called if a proxy was provided to the constructor. Called
         when the message registered to is read.
         """
-        LOGGER.debug('Action.notify({0}, {1}, {2})'.format(
-            message_type,
-            routing_id,
-            repr(message)))
+        # the message is only formatted if the record is emitted
+        LOGGER.debug(
+            'Action.notify(%s, %s, %r)', message_type, routing_id, message)
         if self._proxy.message_type:
             if self._proxy.message_type != message_type:
                 raise Exception("Expected message type {0} but got {1}".format(
@@ -111,3 +204,6 @@ class Action(object):
         self._proxy.callback(message_type, routing_id, message)
         self._update_status()
         self._proxy.unregister(self)
+        self._listening = False
+        if self._observer:
+            self._observer(self)
@@ -2,44 +2,184 @@ import logging
 import json
 
 from orwell.proxy_robots.connectors import AdminSocket
+from orwell.proxy_robots.metrics import METRICS
+from orwell.proxy_robots.provisioning import DeviceType
+from orwell.proxy_robots.provisioning import RobotDescription
 
 LOGGER = logging.getLogger(__name__)
+# maximum number of admin requests handled in one step (so that a burst of
+# requests does not starve the robots)
+MAX_REQUESTS_PER_STEP = 16
+
+
+class RobotSnapshot(object):
+    """
+    The replies to the commands listing the robots, serialized once and
+    rebuilt only when the state version of the program changes.
+    """
+
+    def __init__(self, program):
+        self._program = program
+        self._state_version = None
+        # incremented each time the snapshot is rebuilt
+        self._version = 0
+        self._replies = {}  # command -> reply
+
+    @property
+    def version(self):
+        self._update()
+        return self._version
+
+    def get(self, command):
+        self._update()
+        return self._replies[command]
+
+    def _update(self):
+        state_version = self._program.state_version
+        if state_version == self._state_version:
+            return
+        robots = list(self._program.robots.values())
+        response = {}
+        for robot in robots:
+            response.update(robot.to_dict())
+        self._replies = {
+            Admin.LIST_ROBOT: str([robot.robot_id for robot in robots]),
+            Admin.JSON_LIST_ROBOT: json.dumps(response),
+        }
+        self._state_version = state_version
+        self._version += 1
 
 
 class Admin(object):
     LIST_ROBOT = "list robot"
     JSON_LIST_ROBOT = "json list robot"
+    JSON_ROBOT_STATE = "json robot state"
+    JSON_WRITER = "json writer"
+    METRICS = "metrics"
+    JSON_PROFILE = "json profile"
+    VERSION = "version"
+    # "add robot <id> [<device type> [<port>]]" (see DeviceType)
+    ADD_ROBOT = "add robot"
+    # "remove robot <id>" with the id the robot was added with
+    REMOVE_ROBOT = "remove robot"
+    ROBOT_ADDED = "robot added: {robot_id}"
+    ROBOT_REMOVED = "robot removed: {robot_id}"
+    COMMAND_FAILED = "error: {error}"
+    UNKNOWN_COMMAND = "unknown command: {command}"
 
     def __init__(
             self,
             zmq_context,
             program,
             admin_port=9082,
-            admin_socket_type=AdminSocket):
+            admin_socket_type=AdminSocket,
+            max_requests_per_step=MAX_REQUESTS_PER_STEP):
         """
         `admin_port`: port to bind to and receive connections from the admin GUI
+        `max_requests_per_step`: maximum number of requests handled in one
+            call to #step (None for no limit).
         """
         self._program = program
+        self._max_requests_per_step = max_requests_per_step
         self._admin_socket = admin_socket_type(admin_port, zmq_context)
+        self._snapshot = RobotSnapshot(program)
+
+    @property
+    def socket(self):
+        return getattr(self._admin_socket, "socket", None)
 
     def _handle_admin_message(self, admin_message):
-        if not admin_message:
-            return
-        LOGGER.info("received admin command: %s", admin_message)
-        if Admin.LIST_ROBOT == admin_message:
-            robot_ids = [robot.robot_id
-                         for robot in self._program.robots.values()]
-            robots = str(robot_ids)
-            LOGGER.info("admin send robots = %s", robots)
-            self._admin_socket.write(robots)
-        elif Admin.JSON_LIST_ROBOT == admin_message:
+        # clients poll constantly, so the commands are not logged at info
+        LOGGER.debug("received admin command: %s", admin_message)
+        if admin_message in (Admin.LIST_ROBOT, Admin.JSON_LIST_ROBOT):
+            reply = self._snapshot.get(admin_message)
+            LOGGER.debug("admin send %s", reply)
+            self._admin_socket.write(reply)
+        elif Admin.VERSION == admin_message:
+            # changes when the replies to the robot lists change
+            self._admin_socket.write(str(self._snapshot.version))
+        elif Admin.JSON_ROBOT_STATE == admin_message:
+            # the state is the one read by the devices, no socket is read here
             response = {}
             for robot in self._program.robots.values():
-                robot_dict = robot.to_dict()
-                response.update(robot_dict)
+                state = robot.device_state
+                response[robot.robot_id] = \
+                    state.to_dict() if state is not None else None
+            json_response = json.dumps(response)
+            LOGGER.debug("admin send json robot states = %s", json_response)
+            self._admin_socket.write(json_response)
+        elif Admin.JSON_WRITER == admin_message:
+            # null when the devices are written by the control loop
+            writer = self._program.writer
+            if writer is None:
+                response = None
+            else:
+                response = writer.statistics.to_dict(writer.queue_depth)
             json_response = json.dumps(response)
-            LOGGER.info("admin send json robots = %s", json_response)
+            LOGGER.debug("admin send json writer = %s", json_response)
             self._admin_socket.write(json_response)
+        elif Admin.METRICS == admin_message:
+            # Prometheus text format
+            self._admin_socket.write(METRICS.export())
+        elif Admin.JSON_PROFILE == admin_message:
+            # null when profiling is off
+            profiler = self._program.profiler
+            response = profiler.to_dict() if profiler is not None else None
+            self._admin_socket.write(json.dumps(response))
+        elif admin_message.startswith(Admin.ADD_ROBOT + " "):
+            self._admin_socket.write(self._add_robot(
+                admin_message[len(Admin.ADD_ROBOT):].split()))
+        elif admin_message.startswith(Admin.REMOVE_ROBOT + " "):
+            self._admin_socket.write(self._remove_robot(
+                admin_message[len(Admin.REMOVE_ROBOT):].strip()))
+        else:
+            # always reply so that REQ clients can send other commands
+            LOGGER.warning("unknown admin command: %r", admin_message)
+            self._admin_socket.write(
+                Admin.UNKNOWN_COMMAND.format(command=admin_message))
+
+    def _add_robot(self, arguments):
+        if not arguments:
+            return Admin.COMMAND_FAILED.format(error="missing robot id")
+        if len(arguments) > 3:
+            return Admin.COMMAND_FAILED.format(error="too many arguments")
+        robot_id = arguments[0]
+        try:
+            device_type = DeviceType[arguments[1]] \
+                if len(arguments) > 1 else DeviceType.harpi
+            port = int(arguments[2]) if len(arguments) > 2 else None
+        except (KeyError, ValueError) as error:
+            return Admin.COMMAND_FAILED.format(
+                error="invalid argument {0}".format(error))
+        try:
+            self._program.provision_robot(
+                RobotDescription(robot_id, device_type, port))
+        except (ValueError, OSError) as error:
+            LOGGER.warning("Failed to add robot %s: %s", robot_id, error)
+            return Admin.COMMAND_FAILED.format(error=error)
+        LOGGER.info("Robot %s added by the admin", robot_id)
+        return Admin.ROBOT_ADDED.format(robot_id=robot_id)
+
+    def _remove_robot(self, robot_id):
+        if not robot_id:
+            return Admin.COMMAND_FAILED.format(error="missing robot id")
+        if robot_id not in self._program.robots:
+            return Admin.COMMAND_FAILED.format(
+                error="unknown robot {0}".format(robot_id))
+        self._program.remove_robot(robot_id)
+        LOGGER.info("Robot %s removed by the admin", robot_id)
+        return Admin.ROBOT_REMOVED.format(robot_id=robot_id)
 
     def step(self):
-        self._handle_admin_message(self._admin_socket.read())
+        """
+        Handle the requests received since the previous step (at most
+        `max_requests_per_step`, the others are left for the next steps).
+        """
+        requests = 0
+        while self._max_requests_per_step is None or \
+                requests < self._max_requests_per_step:
+            requests += 1
+            admin_message = self._admin_socket.read()
+            if admin_message is None:
+                break
+            self._handle_admin_message(admin_message)
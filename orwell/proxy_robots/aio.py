@@ -0,0 +1,179 @@
+"""
+Run a #Program on an asyncio event loop.
+
+The message hub, the engine and the admin keep their synchronous #step API:
+they are stepped when one of their sockets is readable or an engine action is
+due. Each robot is stepped by its own task, woken up when it receives an
+input or when its device receives a datagram.
+"""
+import asyncio
+import logging
+import zmq
+import zmq.asyncio
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DeviceProtocol(asyncio.DatagramProtocol):
+    """
+    Give the datagrams received on the socket of a device to the device and
+    wake the robot up.
+    """
+
+    def __init__(self, device, wake_up):
+        self._device = device
+        self._wake_up = wake_up
+
+    def datagram_received(self, data, address):
+        self._device.receive(data, address)
+        self._wake_up()
+
+    def error_received(self, exception):
+        LOGGER.warning("Error on device socket: %s", exception)
+
+
+async def wait_for_action(engine, action, timeout=None):
+    """
+    Give #action to #engine and return its status once the engine is done
+    with it. asyncio.TimeoutError is raised if it takes more than `timeout`
+    seconds (the action is not cancelled, use the timeout of the action for
+    that).
+    """
+    future = asyncio.get_running_loop().create_future()
+
+    def done(action):
+        if not future.done():
+            future.set_result(action.status)
+
+    action.add_done_callback(done)
+    engine.add_action(action)
+    return await asyncio.wait_for(future, timeout)
+
+
+class AsyncProgram(object):
+    def __init__(self, program, max_wait):
+        """
+        `program`: the #Program to run.
+        `max_wait`: longest time (in seconds) without stepping the services
+            of the program.
+        """
+        self._program = program
+        self._max_wait = max_wait
+        self._poller = None
+        self._polled_sockets = ()
+        self._tasks = {}  # robot id -> task
+        self._events = {}  # robot id -> event waking the task up
+        self._transports = {}  # robot id -> transport
+        # ids of the robots stepped when a socket read by someone else is
+        # readable
+        self._robots_by_socket = {}
+
+    async def run(self):
+        self._program.start()
+        try:
+            while True:
+                self._attach_robots()
+                timeout = self._program.idle_timeout()
+                if timeout is None or timeout > self._max_wait:
+                    timeout = self._max_wait
+                poller = self._get_poller()
+                if self._polled_sockets:
+                    events = await poller.poll(int(timeout * 1000))
+                else:
+                    await asyncio.sleep(timeout)
+                    events = ()
+                self._program.step_services()
+                for socket, _ in events:
+                    for robot_id in self._robots_by_socket.get(socket, ()):
+                        self._wake_up(robot_id)
+        finally:
+            for robot_id in list(self._tasks):
+                self._detach_robot(robot_id)
+
+    def _attach_robots(self):
+        """
+        Start the tasks of the robots added to the program and stop the ones
+        of the robots removed.
+        """
+        robots = self._program.robots
+        for robot_id in [
+                robot_id for robot_id in self._tasks
+                if robot_id not in robots]:
+            self._detach_robot(robot_id)
+        for robot_id, robot in robots.items():
+            if robot_id not in self._tasks:
+                self._attach_robot(robot_id, robot)
+
+    def _attach_robot(self, robot_id, robot):
+        """
+        `robot_id`: the id the robot was added with (it changes once the
+            robot is registered).
+        """
+        event = asyncio.Event()
+        robot.set_input_callback(event.set)
+        self._events[robot_id] = event
+        self._tasks[robot_id] = asyncio.ensure_future(
+            self._step_robot(robot, event))
+        device = robot.device
+        socket = device.get_socket()
+        if socket is None:
+            return
+        if (hasattr(device, "stop_reading") and
+                getattr(device, "multiplexer", None) is None):
+            device.stop_reading()
+            self._transports[robot_id] = None
+            asyncio.ensure_future(self._create_endpoint(robot_id, robot, event))
+        else:
+            self._robots_by_socket.setdefault(socket, []).append(robot_id)
+
+    async def _create_endpoint(self, robot_id, robot, event):
+        transport, _ = await asyncio.get_running_loop(
+            ).create_datagram_endpoint(
+                lambda: DeviceProtocol(robot.device, event.set),
+                # the transport closes its socket, the device keeps using
+                # (and eventually closes) the original one
+                sock=robot.device.get_socket().dup())
+        if robot_id in self._transports:
+            self._transports[robot_id] = transport
+        else:
+            # the robot was removed in the meantime
+            transport.close()
+
+    def _detach_robot(self, robot_id):
+        task = self._tasks.pop(robot_id)
+        task.cancel()
+        del self._events[robot_id]
+        transport = self._transports.pop(robot_id, None)
+        if transport is not None:
+            transport.close()
+        for robot_ids in self._robots_by_socket.values():
+            if robot_id in robot_ids:
+                robot_ids.remove(robot_id)
+
+    def _wake_up(self, robot_id):
+        event = self._events.get(robot_id)
+        if event is not None:
+            event.set()
+
+    async def _step_robot(self, robot, event):
+        while True:
+            await event.wait()
+            event.clear()
+            robot.step()
+
+    def _get_poller(self):
+        """
+        Return a poller watching the sockets of the services and the device
+        sockets not read by an asyncio protocol.
+        """
+        sockets = self._program.service_sockets
+        for socket in self._robots_by_socket:
+            if self._robots_by_socket[socket] and socket not in sockets:
+                sockets.append(socket)
+        sockets = tuple(sockets)
+        if sockets != self._polled_sockets:
+            self._poller = zmq.asyncio.Poller()
+            for socket in sockets:
+                self._poller.register(socket, zmq.POLLIN)
+            self._polled_sockets = sockets
+        return self._poller
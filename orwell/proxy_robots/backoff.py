@@ -0,0 +1,47 @@
+import random
+
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter, giving the delays to wait between two
+    attempts of an action.
+    """
+
+    def __init__(
+            self,
+            initial=0.01,
+            factor=2.0,
+            maximum=5.0,
+            jitter=0.1,
+            random_function=random.random):
+        """
+        `initial`: delay (in seconds) before the first retry.
+        `factor`: the delay is multiplied by this after each retry.
+        `maximum`: the delay never grows beyond this.
+        `jitter`: fraction of the delay randomly added or removed so that
+            actions failing together are not retried together.
+        `random_function`: for testing purpose ; returns a number in [0, 1).
+        """
+        self._initial = initial
+        self._factor = factor
+        self._maximum = maximum
+        self._jitter = jitter
+        self._random_function = random_function
+        self._delay = initial
+
+    def next_delay(self):
+        """
+        Return the delay to wait before the next attempt and increase the one
+        after.
+        """
+        delay = self._delay
+        self._delay = min(self._delay * self._factor, self._maximum)
+        if self._jitter:
+            delay *= 1 + self._jitter * (2 * self._random_function() - 1)
+        return delay
+
+    def reset(self):
+        """
+        Start again from the initial delay (for instance after a success).
+        """
+        self._delay = self._initial
@@ -0,0 +1,308 @@
+"""
+Capture the traffic with the game server (the frames read by the Subscriber
+and written by the Pusher) to a log that can be replayed offline (see
+#ReplaySubscriber and the replay module).
+
+The log starts with MAGIC followed by records: a RECORD_HEADER (monotonic
+time in seconds, Direction, number of frames) and, for each frame, its
+FRAME_LENGTH then its bytes. The records go through a large write buffer so
+capturing a message costs a few buffer copies and no system call.
+"""
+import collections
+from enum import Enum
+import logging
+import mmap
+import os
+import struct
+import time
+
+from orwell.proxy_robots.profiler import RollingPercentiles
+
+LOGGER = logging.getLogger(__name__)
+MAGIC = b"ORWCAP1\n"
+# time, direction, number of frames
+RECORD_HEADER = struct.Struct("!dBB")
+FRAME_LENGTH = struct.Struct("!I")
+# size (in bytes) of the write buffer of the capture file
+BUFFER_SIZE = 1 << 20
+# longest time (in seconds) between two flushes of the capture file
+FLUSH_INTERVAL = 1.0
+
+
+class Direction(Enum):
+    # read from the subscriber
+    inbound = 0
+    # written to the pusher
+    outbound = 1
+
+
+class CaptureWriter(object):
+    """
+    Append the messages exchanged with the game server to a capture file.
+    Only to be used by one thread (the one stepping the message hub).
+    """
+
+    def __init__(
+            self,
+            path,
+            clock=time.monotonic,
+            buffer_size=BUFFER_SIZE,
+            flush_interval=FLUSH_INTERVAL):
+        self._path = path
+        self._clock = clock
+        self._file = open(path, "ab", buffering=buffer_size)
+        if 0 == self._file.tell():
+            self._file.write(MAGIC)
+        self._flush_interval = flush_interval
+        self._next_flush = clock() + flush_interval
+        self.records = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def wrap_subscriber_type(self, subscriber_type):
+        """
+        Return a factory (see #MessageHub) of subscribers whose reads are
+        captured.
+        """
+        def create_subscriber(address, zmq_context):
+            return CapturingSubscriber(
+                subscriber_type(address, zmq_context), self)
+        return create_subscriber
+
+    def wrap_pusher_type(self, pusher_type):
+        """
+        Return a factory (see #MessageHub) of pushers whose writes are
+        captured.
+        """
+        def create_pusher(address, zmq_context):
+            return CapturingPusher(pusher_type(address, zmq_context), self)
+        return create_pusher
+
+    def record(self, direction, frames):
+        """
+        `direction`: value of a #Direction.
+        `frames`: bytes-like objects.
+        """
+        write = self._file.write
+        write(RECORD_HEADER.pack(self._clock(), direction, len(frames)))
+        for frame in frames:
+            write(FRAME_LENGTH.pack(len(frame)))
+            write(frame)
+        self.records += 1
+
+    def step(self):
+        """
+        Flush the file if it has not been for a while (so that little is
+        lost if the process dies).
+        """
+        now = self._clock()
+        if now >= self._next_flush:
+            self._file.flush()
+            self._next_flush = now + self._flush_interval
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class CapturingSubscriber(object):
+    """
+    Give the messages read by a subscriber to a #CaptureWriter (everything
+    else is forwarded to the subscriber).
+    """
+
+    def __init__(self, subscriber, capture):
+        self._subscriber = subscriber
+        self._capture = capture
+
+    def __getattr__(self, name):
+        return getattr(self._subscriber, name)
+
+    def read(self):
+        message = self._subscriber.read()
+        if message is not None:
+            self._capture.record(Direction.inbound.value, (message,))
+        return message
+
+    def read_multipart(self):
+        frames = self._subscriber.read_multipart()
+        if frames is not None:
+            self._capture.record(
+                Direction.inbound.value, [frame.buffer for frame in frames])
+        return frames
+
+
+class CapturingPusher(object):
+    """
+    Give the messages written by a pusher to a #CaptureWriter.
+    """
+
+    def __init__(self, pusher, capture):
+        self._pusher = pusher
+        self._capture = capture
+
+    def write(self, message):
+        self._capture.record(Direction.outbound.value, (message,))
+        self._pusher.write(message)
+
+    def write_multipart(self, frames):
+        self._capture.record(Direction.outbound.value, frames)
+        self._pusher.write_multipart(frames)
+
+
+def read_capture(path):
+    """
+    Yield the (time, #Direction, list of frames as bytes) records of the
+    capture file #path. A record cut by the end of the file (the capturing
+    process died while writing it) is ignored.
+    """
+    with open(path, "rb") as capture_file:
+        if 0 == os.fstat(capture_file.fileno()).st_size:
+            raise ValueError("{0} is empty".format(path))
+        with mmap.mmap(
+                capture_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError("{0} is not a capture".format(path))
+            offset = len(MAGIC)
+            size = len(data)
+            while offset < size:
+                if offset + RECORD_HEADER.size > size:
+                    break
+                timestamp, direction, count = RECORD_HEADER.unpack_from(
+                    data, offset)
+                offset += RECORD_HEADER.size
+                frames = []
+                for _ in range(count):
+                    if offset + FRAME_LENGTH.size > size:
+                        break
+                    length, = FRAME_LENGTH.unpack_from(data, offset)
+                    offset += FRAME_LENGTH.size
+                    if offset + length > size:
+                        break
+                    frames.append(data[offset:offset + length])
+                    offset += length
+                if len(frames) != count:
+                    break
+                yield timestamp, Direction(direction), frames
+            if offset < size:
+                LOGGER.warning(
+                    "Truncated record at the end of %s ignored", path)
+
+
+class ReplayFrame(object):
+    """
+    Frame of a replayed multipart message (like a zmq.Frame).
+    """
+
+    def __init__(self, data):
+        self.bytes = data
+        self.buffer = memoryview(data)
+
+
+class ReplaySubscriber(object):
+    """
+    Subscriber (see connectors.Subscriber) giving the inbound messages of a
+    capture at the pace they were captured, #speed times faster, once
+    #start is called. The subscriptions are honoured like zmq does (prefix
+    of the first frame).
+    """
+
+    def __init__(self, records, speed=1.0, clock=time.monotonic):
+        """
+        `records`: (time, #Direction, frames) as given by #read_capture.
+        `speed`: 1 to replay in real time, N to go N times faster and 0 to
+            go as fast as possible.
+        """
+        self._messages = collections.deque(
+            (timestamp, frames)
+            for timestamp, direction, frames in records
+            if Direction.inbound == direction)
+        self._speed = speed
+        self._clock = clock
+        self._first = self._messages[0][0] if self._messages else 0.0
+        self._start = None
+        # subscription prefix -> count (everything is read by default)
+        self._prefixes = collections.Counter({b"": 1})
+        # how late (in seconds) the messages were read
+        self.lag = RollingPercentiles()
+        self.read_count = 0
+        self.filtered_count = 0
+
+    @property
+    def exhausted(self):
+        return not self._messages
+
+    def start(self):
+        """
+        Make the first message due now (nothing is read before).
+        """
+        self._start = self._clock()
+
+    def _due(self, timestamp):
+        if not self._speed:
+            return self._start
+        return self._start + (timestamp - self._first) / self._speed
+
+    def _subscribed(self, routing_frame):
+        if self._prefixes[b""]:
+            return True
+        return any(
+            routing_frame.startswith(prefix) for prefix in self._prefixes)
+
+    def _next(self):
+        """
+        Return the frames of the next message due and subscribed to, or None.
+        """
+        if self._start is None:
+            return None
+        now = self._clock()
+        messages = self._messages
+        while messages:
+            timestamp, frames = messages[0]
+            due = self._due(timestamp)
+            if due > now:
+                return None
+            messages.popleft()
+            if not self._subscribed(frames[0]):
+                self.filtered_count += 1
+                continue
+            self.lag.add(now - due)
+            self.read_count += 1
+            return frames
+        return None
+
+    def time_to_next(self):
+        """
+        Return how long (in seconds) before the next message is due, or None
+        if there is none left.
+        """
+        if not self._messages or self._start is None:
+            return None
+        return max(0, self._due(self._messages[0][0]) - self._clock())
+
+    def read(self):
+        frames = self._next()
+        if frames is None:
+            return None
+        if 1 == len(frames):
+            return frames[0]
+        return b" ".join(frames)
+
+    def read_multipart(self):
+        frames = self._next()
+        if frames is None:
+            return None
+        return [ReplayFrame(frame) for frame in frames]
+
+    def subscribe(self, prefix):
+        self._prefixes[prefix] += 1
+
+    def unsubscribe(self, prefix):
+        self._prefixes[prefix] -= 1
+        if self._prefixes[prefix] <= 0:
+            del self._prefixes[prefix]
+
+    def has_pending(self):
+        return 0 == self.time_to_next()
@@ -1,8 +1,15 @@
+import concurrent.futures
+import heapq
+import itertools
 import logging
+import struct
+import time
 import zmq
 
 
 LOGGER = logging.getLogger(__name__)
+# id of a request sent by the Replier (echoed in the envelope of the reply)
+REQUEST_ID = struct.Struct("!Q")
 
 
 class Subscriber(object):
@@ -13,12 +20,46 @@ class Subscriber(object):
         LOGGER.info("Connect to {address} sub".format(address=address))
         self._socket.connect(address)
 
+    @property
+    def socket(self):
+        return self._socket
+
     def read(self):
         try:
             return self._socket.recv(flags=zmq.NOBLOCK)
         except zmq.error.Again:
             return None
 
+    def read_multipart(self):
+        """
+        Read all the frames of a message without copying them (the frames
+        give access to memoryviews on the data received).
+        """
+        try:
+            return self._socket.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+        except zmq.error.Again:
+            return None
+
+    def subscribe(self, prefix):
+        """
+        Receive the messages starting with `prefix` (bytes).
+        """
+        LOGGER.debug("Subscriber.subscribe: %r", prefix)
+        self._socket.setsockopt(zmq.SUBSCRIBE, prefix)
+
+    def unsubscribe(self, prefix):
+        """
+        Revert the effects of #subscribe.
+        """
+        LOGGER.debug("Subscriber.unsubscribe: %r", prefix)
+        self._socket.setsockopt(zmq.UNSUBSCRIBE, prefix)
+
+    def has_pending(self):
+        """
+        True if a message can be read without blocking.
+        """
+        return bool(self._socket.getsockopt(zmq.EVENTS) & zmq.POLLIN)
+
 
 class Pusher(object):
     def __init__(self, address, zmq_context):
@@ -29,48 +70,172 @@ class Pusher(object):
         self._socket.connect(address)
 
     def write(self, message):
-        LOGGER.debug("Pusher.write: " + repr(message))
+        LOGGER.debug("Pusher.write: %r", message)
         self._socket.send(message)
 
+    def write_multipart(self, frames):
+        """
+        Write a message made of several frames without copying them.
+        """
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            # the message itself is not logged
+            LOGGER.debug("Pusher.write_multipart: %r", frames[:2])
+        self._socket.send_multipart(frames, copy=False)
+
 
 class Replier(object):
-    def __init__(self, address, zmq_context):
-        self._socket = zmq_context.socket(zmq.REQ)
-        self._socket.setsockopt(zmq.LINGER, -1)
-        LOGGER.info("Connect to {address} req".format(address=address))
+    """
+    DEALER socket sending requests to the replier of the game server (a REP
+    or ROUTER socket) without waiting for the replies: many requests can be
+    in flight. Each request gets an id sent as the envelope of the message,
+    which the server echoes, so that the reply is given to the callback of
+    the request. The replies are read by #step.
+    """
+
+    def __init__(self, address, zmq_context, clock=time.monotonic):
+        self._socket = zmq_context.socket(zmq.DEALER)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        LOGGER.info("Connect to {address} dealer".format(address=address))
         self._socket.connect(address)
-
-    def exchange(self, query):
-        self.write(query)
-        return self.read()
-
-    def write(self, message):
-        LOGGER.debug("Replier.write: " + repr(message))
-        self._socket.send(message)
-
-    def read(self):
-        return self._socket.recv(flags=zmq.NOBLOCK)
+        self._clock = clock
+        self._request_ids = itertools.count(1)
+        # request id -> callback
+        self._callbacks = {}
+        # (deadline, request id) of the requests with a timeout
+        self._deadlines = []
+
+    @property
+    def socket(self):
+        return self._socket
+
+    @property
+    def pending_count(self):
+        return len(self._callbacks)
+
+    def request(self, message, callback, timeout=None):
+        """
+        Send #message (bytes) and return the id of the request.
+        `callback`: function called with the reply (bytes) by #step, or with
+            None if there is no reply after `timeout` seconds.
+        """
+        request_id = next(self._request_ids)
+        LOGGER.debug("Replier.request %s: %r", request_id, message)
+        self._socket.send_multipart(
+            (REQUEST_ID.pack(request_id), b"", message))
+        self._callbacks[request_id] = callback
+        if timeout is not None:
+            heapq.heappush(
+                self._deadlines, (self._clock() + timeout, request_id))
+        return request_id
+
+    def request_future(self, message, timeout=None):
+        """
+        Same as #request but return a concurrent.futures.Future set to the
+        reply (or None on timeout) by #step.
+        """
+        future = concurrent.futures.Future()
+        self.request(message, future.set_result, timeout)
+        return future
+
+    def cancel(self, request_id):
+        """
+        Forget about a request (its reply is dropped if it comes).
+        """
+        self._callbacks.pop(request_id, None)
+
+    def step(self):
+        """
+        Give the replies received to their callbacks and time out the
+        requests whose deadline is reached.
+        """
+        while True:
+            try:
+                frames = self._socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            if 3 != len(frames) or REQUEST_ID.size != len(frames[0]):
+                LOGGER.warning("Replier dropped malformed reply: %r", frames)
+                continue
+            request_id, = REQUEST_ID.unpack(frames[0])
+            callback = self._callbacks.pop(request_id, None)
+            if callback is None:
+                LOGGER.debug("Replier dropped late reply %s", request_id)
+                continue
+            callback(frames[2])
+        now = self._clock()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, request_id = heapq.heappop(self._deadlines)
+            callback = self._callbacks.pop(request_id, None)
+            if callback is not None:
+                LOGGER.debug("Replier request %s timed out", request_id)
+                callback(None)
 
 
 class AdminSocket(object):
+    """
+    ROUTER socket serving several admin clients (REQ or DEALER) at once.
+    Each request read is answered by the next #write.
+    """
+
     def __init__(self, admin_port, zmq_context):
         self._zmq_context = zmq_context
-        self._socket = self._zmq_context.socket(zmq.REP)
+        self._socket = self._zmq_context.socket(zmq.ROUTER)
         self._socket.bind("tcp://*:{port}".format(port=admin_port))
+        # frames identifying the client of the request being handled
+        self._envelope = None
+
+    @property
+    def socket(self):
+        return self._socket
 
     def read(self):
+        """
+        Return the next request (None if there is none).
+        """
         try:
-            return self._socket.recv_string(zmq.NOBLOCK)
+            frames = self._socket.recv_multipart(zmq.NOBLOCK)
         except zmq.error.Again:
-            pass
+            return None
         except zmq.ZMQError as e:
             LOGGER.warning("AdminSocket could not read: %s %s", e.errno, e)
             return None
+        # identity (and empty delimiter for REQ clients) then the request
+        self._envelope = frames[:-1]
+        return frames[-1].decode("utf-8", "replace")
 
     def write(self, message):
+        """
+        Reply to the last request read (the reply is dropped if the client
+        is gone).
+        """
+        if self._envelope is None:
+            LOGGER.warning("AdminSocket has no request to reply to")
+            return None
+        envelope = self._envelope
+        self._envelope = None
         try:
-            return self._socket.send_string(message)
+            return self._socket.send_multipart(
+                envelope + [message.encode("utf-8")])
         except zmq.ZMQError as e:
             LOGGER.warning("AdminSocket could not send reply! %s %s", e.errno, e)
             return None
 
+
+class AdminPublisher(object):
+    """
+    PUB socket streaming the state of the robots to admin clients.
+    """
+
+    def __init__(self, port, zmq_context):
+        self._socket = zmq_context.socket(zmq.PUB)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.bind("tcp://*:{port}".format(port=port))
+
+    def publish(self, topic, payload):
+        """
+        Send a message made of a topic frame and a payload frame (bytes).
+        """
+        try:
+            self._socket.send_multipart((topic, payload), zmq.NOBLOCK)
+        except zmq.error.Again:
+            LOGGER.debug("AdminPublisher dropped a %r message", topic)
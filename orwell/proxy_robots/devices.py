@@ -1,12 +1,106 @@
+from enum import Enum
 import logging
 import socket
+import struct
+import time
+
+from orwell.proxy_robots.metrics import METRICS
 
 LOGGER = logging.getLogger(__name__)
+DATAGRAMS_SENT = METRICS.counter(
+    "proxy_device_datagrams_sent_total", "Datagrams sent to the robots.")
+DATAGRAMS_RECEIVED = METRICS.counter(
+    "proxy_device_datagrams_received_total",
+    "Datagrams received from the robots.")
+
+
+class Protocol(Enum):
+    # one text datagram per command ("move 255 -255", "fire 1 0")
+    ascii = 0
+    # one fixed size datagram with the whole state (see #BINARY_COMMAND)
+    binary = 1
+
+
+# token of the first datagram of a robot telling it understands binary commands
+BINARY_CAPABILITY = b"binary"
+# magic, sequence number, left (-127..127), right (-127..127), fire bitmask
+BINARY_COMMAND = struct.Struct("!2sHbbB")
+BINARY_MAGIC = b"OB"
+FIRE1_BIT = 0x01
+FIRE2_BIT = 0x02
+# first token of the status datagrams sent by robots, followed by
+# key=value fields (for instance "status battery=87 front=12.5")
+STATUS_PREFIX = b"status"
+BATTERY_KEY = "battery"
+# largest datagram read from a robot
+MAX_DATAGRAM_SIZE = 4096
+# maximum number of datagrams read by one call to HarpiDevice.ready
+MAX_DATAGRAMS_PER_READY = 64
+# python does not provide recvmmsg, so do not block on each read instead
+RECV_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
+# key of the field of the first datagram of a robot giving its id (for
+# instance "robot robot_id=951 binary"), used when robots share a socket
+ROBOT_ID_KEY = b"robot_id"
+
+
+def _binary_speed(value):
+    """
+    Convert a speed (-1..1) to the signed byte of BINARY_COMMAND (values
+    out of range sent by the server are clamped).
+    """
+    return max(-127, min(127, int(value * 127)))
+
+
+class DeviceState(object):
+    """
+    What a robot last told about itself.
+    """
+
+    def __init__(self):
+        self.battery = None
+        # sensor name -> last value
+        self.sensors = {}
+        # time.time() of the last datagram received
+        self.last_seen = None
+        self.datagrams = 0
+
+    def update(self, message, now):
+        """
+        Record a datagram received at time #now and parse it if this is a
+        status message.
+        """
+        self.datagrams += 1
+        self.last_seen = now
+        fields = message.split()
+        if not fields or STATUS_PREFIX != fields[0]:
+            return
+        for field in fields[1:]:
+            key, separator, value = field.partition(b"=")
+            if not separator:
+                continue
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+            key = key.decode("ascii", "replace")
+            if BATTERY_KEY == key:
+                self.battery = value
+            else:
+                self.sensors[key] = value
+
+    def to_dict(self):
+        return {
+            "battery": self.battery,
+            "sensors": dict(self.sensors),
+            "last_seen": self.last_seen,
+            "datagrams": self.datagrams,
+        }
 
 
 class FakeDevice(object):
     def __init__(self):
         self._address = "1.2.3.4"
+        self._state = DeviceState()
 
     def __del__(self):
         """
@@ -18,19 +112,33 @@ class FakeDevice(object):
     def address(self):
         return self._address
 
+    @property
+    def state(self):
+        return self._state
+
     def move(self, left, right):
         """
         `left`: -1..1
         `right`: -1..1
         """
-        LOGGER.debug("move({left}, {right})".format(left=left, right=right))
+        LOGGER.debug("move(%s, %s)", left, right)
 
     def fire(self, fire1, fire2):
         """
         `fire1`: 0/1
         `fire2`: 0/1
         """
-        LOGGER.debug("fire({fire1}, {fire2})".format(fire1=fire1, fire2=fire2))
+        LOGGER.debug("fire(%s, %s)", fire1, fire2)
+
+    def apply_state(self, left, right, fire1, fire2):
+        """
+        `left`: -1..1
+        `right`: -1..1
+        `fire1`: 0/1
+        `fire2`: 0/1
+        """
+        LOGGER.debug(
+            "apply_state(%s, %s, %s, %s)", left, right, fire1, fire2)
 
     def stop(self):
         LOGGER.debug("stop()")
@@ -42,10 +150,56 @@ class FakeDevice(object):
         return None
 
 
+class MoveFireAdapter(object):
+    """
+    Provide #apply_state for devices that only know how to #move and #fire
+    (everything else is forwarded to the device).
+    """
+
+    def __init__(self, device):
+        self._device = device
+        self._move = (0.0, 0.0)
+        self._fire = (False, False)
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def apply_state(self, left, right, fire1, fire2):
+        """
+        Call #move and #fire on the device for what changed.
+        """
+        if (left, right) != self._move:
+            self._device.move(left, right)
+            self._move = (left, right)
+        if (fire1, fire2) != self._fire:
+            self._device.fire(fire1, fire2)
+            self._fire = (fire1, fire2)
+
+
 class HarpiDevice(object):
-    def __init__(self, sock):
+    def __init__(self, sock, multiplexer=None):
+        """
+        `sock`: UDP socket used to talk to the robot.
+        `multiplexer`: #DeviceMultiplexer reading `sock` for all the devices
+            sharing it. If None, the device reads the socket itself.
+        """
         self._socket = sock
+        self._multiplexer = multiplexer
+        self._reads_socket = True
         self._address = None
+        self._protocol = Protocol.ascii
+        # state sent in binary commands
+        self._left = 0
+        self._right = 0
+        self._fire_bits = 0
+        self._sequence = 0
+        self._command = bytearray(BINARY_COMMAND.size)
+        # last state given to #apply_state
+        self._applied_move = (0.0, 0.0)
+        self._applied_fire = (False, False)
+        self._state = DeviceState()
+        self._buffer = bytearray(MAX_DATAGRAM_SIZE)
+        self._view = memoryview(self._buffer)
 
     def __del__(self):
         """
@@ -57,17 +211,38 @@ class HarpiDevice(object):
     def address(self):
         return self._address
 
+    @property
+    def protocol(self):
+        return self._protocol
+
+    @property
+    def multiplexer(self):
+        return self._multiplexer
+
+    @property
+    def state(self):
+        """
+        What the robot last told about itself (updated by #ready).
+        """
+        return self._state
+
     def move(self, left, right):
         """
         `left`: -1..1
         `right`: -1..1
         """
         if self._address:
-            left = int(left * 255)
-            right = int(right * 255)
-            command = "move {left} {right}".format(left=left, right=right)
-            LOGGER.debug("harpi::" + command)
-            self._socket.sendto(bytearray(command, "ascii"), self._address)
+            if Protocol.binary == self._protocol:
+                self._left = _binary_speed(left)
+                self._right = _binary_speed(right)
+                self._send_binary()
+            else:
+                left = int(left * 255)
+                right = int(right * 255)
+                command = "move {left} {right}".format(left=left, right=right)
+                LOGGER.debug("harpi::%s", command)
+                self._socket.sendto(bytearray(command, "ascii"), self._address)
+                DATAGRAMS_SENT.inc()
         else:
             LOGGER.debug("harpi::move device not ready to send command")
 
@@ -79,44 +254,212 @@ class HarpiDevice(object):
         if self._address:
             fire1 = 1 if fire1 else 0
             fire2 = 1 if fire2 else 0
-            command = "fire {fire1} {fire2})".format(fire1=fire1, fire2=fire2)
-            LOGGER.debug("harpi::" + command)
-            self._socket.sendto(bytearray(command, "ascii"), self._address)
+            if Protocol.binary == self._protocol:
+                self._fire_bits = fire1 * FIRE1_BIT | fire2 * FIRE2_BIT
+                self._send_binary()
+            else:
+                command = "fire {fire1} {fire2}".format(fire1=fire1, fire2=fire2)
+                LOGGER.debug("harpi::%s", command)
+                self._socket.sendto(bytearray(command, "ascii"), self._address)
+                DATAGRAMS_SENT.inc()
         else:
             LOGGER.debug("harpi::fire device not ready to send command")
 
+    def apply_state(self, left, right, fire1, fire2):
+        """
+        Send the whole state at once: one datagram with the binary protocol,
+        only the commands for what changed with the text protocol.
+        `left`: -1..1
+        `right`: -1..1
+        `fire1`: 0/1
+        `fire2`: 0/1
+        """
+        if not self._address:
+            LOGGER.debug("harpi::apply_state device not ready to send command")
+            return
+        if Protocol.binary == self._protocol:
+            self._left = _binary_speed(left)
+            self._right = _binary_speed(right)
+            self._fire_bits = \
+                (FIRE1_BIT if fire1 else 0) | (FIRE2_BIT if fire2 else 0)
+            self._send_binary()
+        else:
+            if (left, right) != self._applied_move:
+                self.move(left, right)
+            if (fire1, fire2) != self._applied_fire:
+                self.fire(fire1, fire2)
+        self._applied_move = (left, right)
+        self._applied_fire = (fire1, fire2)
+
+    def _send_binary(self):
+        """
+        Send the whole state in one datagram (the buffer is reused).
+        """
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        BINARY_COMMAND.pack_into(
+            self._command,
+            0,
+            BINARY_MAGIC,
+            self._sequence,
+            self._left,
+            self._right,
+            self._fire_bits)
+        self._socket.sendto(self._command, self._address)
+        DATAGRAMS_SENT.inc()
+
     def stop(self):
         LOGGER.debug("stop()")
         self.move(0, 0)
 
+    def close(self):
+        """
+        Stop the robot and close the socket (a socket shared by several
+        devices is left to the multiplexer). Nothing is sent afterwards.
+        """
+        self.stop()
+        self._address = None
+        if self._multiplexer is None:
+            self._socket.close()
+
     def get_socket(self):
         return self._socket
 
+    def _negotiate(self, message):
+        """
+        Choose the protocol from the first message of the robot. Robots that
+        understand binary commands list the capability in it, the others
+        keep getting text commands.
+        """
+        if BINARY_CAPABILITY in message.split():
+            self._protocol = Protocol.binary
+        else:
+            self._protocol = Protocol.ascii
+        LOGGER.info("Robot at {address} uses the {protocol} protocol".format(
+            address=self._address, protocol=self._protocol.name))
+
+    def stop_reading(self):
+        """
+        Do not read the socket in #ready, the caller reads it and gives the
+        datagrams to #receive (for instance an asyncio protocol).
+        """
+        self._reads_socket = False
+
     def ready(self):
+        """
+        Read all the datagrams received from the robot (up to
+        MAX_DATAGRAMS_PER_READY) and tell if the robot is known.
+        When the socket is shared, the multiplexer reads it instead.
+        When #stop_reading has been called, the datagrams are given to
+        #receive by someone else.
+        """
+        if self._multiplexer is None and self._reads_socket:
+            for _ in range(MAX_DATAGRAMS_PER_READY):
+                try:
+                    size, address = self._socket.recvfrom_into(
+                        self._buffer, MAX_DATAGRAM_SIZE, RECV_FLAGS)
+                except socket.timeout:
+                    LOGGER.debug(
+                        "Failed to receive message from robot - socket.timeout")
+                    break
+                except BlockingIOError:
+                    # no message (left)
+                    break
+                if size:
+                    self.receive(bytes(self._view[:size]), address)
+        return self._address is not None
+
+    def receive(self, message, address):
+        """
+        Process a datagram received from #address.
+        """
+        DATAGRAMS_RECEIVED.inc()
         if not self._address:
+            LOGGER.info(
+                "First message from robot: {message}".format(
+                    message=message))
+            self._address = address
+            self._negotiate(message)
+        elif address != self._address:
+            LOGGER.debug("Ignore message from unknown address: %s", address)
+            return
+        self._state.update(message, time.time())
+
+
+class DeviceMultiplexer(object):
+    """
+    Read a UDP socket shared by several robots and give each datagram to the
+    device of the robot that sent it. Robots are told apart by their
+    address, learnt from their first datagram which names the robot id
+    (see ROBOT_ID_KEY). A first datagram without a robot id goes to the
+    first device without a robot.
+    """
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._buffer = bytearray(MAX_DATAGRAM_SIZE)
+        self._view = memoryview(self._buffer)
+        # robot id -> device
+        self._devices = {}
+        # address -> device
+        self._devices_by_address = {}
+
+    def get_socket(self):
+        return self._socket
+
+    def create_device(self, robot_id):
+        """
+        Create a device using the shared socket for robot #robot_id.
+        """
+        device = HarpiDevice(self._socket, self)
+        self._devices[robot_id] = device
+        return device
+
+    def remove_device(self, robot_id):
+        device = self._devices.pop(robot_id)
+        if device.address is not None:
+            self._devices_by_address.pop(device.address, None)
+
+    def step(self):
+        """
+        Read all the datagrams received (up to MAX_DATAGRAMS_PER_READY for
+        each device) and dispatch them.
+        """
+        for _ in range(MAX_DATAGRAMS_PER_READY * max(1, len(self._devices))):
             try:
-                message, address = self._socket.recvfrom(4096)
-                if message:
-                    LOGGER.info(
-                        "First message from robot: {message}".format(
-                            message=message))
-                    self._address = address
-            except socket.timeout:
-                LOGGER.debug(
-                    "Failed to receive message from robot - socket.timeout")
-                pass
-            except BlockingIOError:
-                # no message yet?
-                pass
-        else:
-            try:
-                message, address = self._socket.recvfrom(4096)
-                # if (message):
-                # LOGGER.info(
-                #         "Message from robot: {message}".format(
-                #             message=message))
-            except socket.timeout:
-                pass
-            except BlockingIOError:
-                pass
-        return self._address is not None
+                size, address = self._socket.recvfrom_into(
+                    self._buffer, MAX_DATAGRAM_SIZE, RECV_FLAGS)
+            except (socket.timeout, BlockingIOError):
+                break
+            if not size:
+                continue
+            message = bytes(self._view[:size])
+            device = self._devices_by_address.get(address)
+            if device is None:
+                device = self._find_new_device(message)
+                if device is None:
+                    LOGGER.debug(
+                        "No robot for message from %s: %r", address, message)
+                    continue
+                self._devices_by_address[address] = device
+            device.receive(message, address)
+
+    def _find_new_device(self, message):
+        """
+        Return the device without a robot yet the first message of a robot is
+        for (or None).
+        """
+        robot_id = None
+        for field in message.split():
+            key, separator, value = field.partition(b"=")
+            if separator and ROBOT_ID_KEY == key:
+                robot_id = value.decode("ascii", "replace")
+                break
+        if robot_id is not None:
+            device = self._devices.get(robot_id)
+            if device is not None and device.address is None:
+                return device
+            return None
+        for device in self._devices.values():
+            if device.address is None:
+                return device
+        return None
@@ -1,48 +1,219 @@
+import collections
+import heapq
+import itertools
+import time
+
+from orwell.proxy_robots.metrics import METRICS
 from orwell.proxy_robots.status import Status
 
+ACTIONS_CALLED = METRICS.counter(
+    "proxy_engine_actions_called_total", "Actions called by the engine.")
+PENDING_ACTIONS = METRICS.gauge(
+    "proxy_engine_pending_actions",
+    "Actions waiting for a notification after the last engine step.")
+RETRIES = METRICS.gauge(
+    "proxy_engine_retries",
+    "Actions waiting to be repeated after the last engine step.")
+
 
 class Engine(object):
     """
     Engine that makes the actions run.
     """
 
-    def __init__(self):
-        self._created_actions = []
-        self._pending_actions = []
+    # delay to wait before calling again a failed action that is to be
+    # repeated and has no backoff
+    RETRY_INTERVAL = 0.01
+
+    def __init__(self, clock=time.monotonic):
+        """
+        `clock`: for testing purpose ; function returning the current time in
+            seconds.
+        """
+        self._clock = clock
+        # actions to call in the next call to #step
+        self._created_actions = collections.deque()
+        # actions waiting for a notification -> sequence number of their
+        # timeout (or None if the action waits forever)
+        self._pending_actions = {}
+        # pending actions notified since the last call to #step
+        self._notified_actions = []
+        # heap of (deadline, sequence number, action) for the actions to call
+        # again once the deadline is reached
+        self._retries = []
+        # heap of (deadline, sequence number, action) for the pending actions
+        # that time out if not notified before the deadline ; entries whose
+        # sequence number no longer matches the pending action are obsolete
+        self._timeouts = []
+        self._sequence = itertools.count()
 
     def add_action(self, action):
         """
         Simply add an action to be run in the next call to #step.
         """
+        action.set_observer(self._notify_action)
         self._created_actions.append(action)
 
+    def _notify_action(self, action):
+        """
+        Called by a pending action once its notification has been received.
+        """
+        self._notified_actions.append(action)
+
+    @property
+    def pending_count(self):
+        return len(self._pending_actions)
+
+    @property
+    def retry_count(self):
+        return len(self._retries)
+
+    def idle_timeout(self):
+        """
+        Return how long (in seconds) the caller can wait before #step has
+        something to do, or None if only a notification can make progress.
+        """
+        if self._created_actions or self._notified_actions:
+            return 0
+        deadlines = []
+        if self._retries:
+            deadlines.append(self._retries[0][0])
+        self._drop_obsolete_timeouts()
+        if self._timeouts:
+            deadlines.append(self._timeouts[0][0])
+        if deadlines:
+            return max(0, min(deadlines) - self._clock())
+        return None
+
+    def _drop_obsolete_timeouts(self):
+        """
+        Remove the timeouts of the actions no longer pending (notified,
+        cancelled or removed) from the top of the heap so that their
+        deadline does not wake the caller up for nothing.
+        """
+        timeouts = self._timeouts
+        pending_actions = self._pending_actions
+        while timeouts and \
+                timeouts[0][1] != pending_actions.get(timeouts[0][2]):
+            heapq.heappop(timeouts)
+
+    def notify_message_hub(self, message_hub):
+        """
+        Nothing to do, the actions register themselves when called.
+        """
+        pass
+
+    def notify_message_hub_dropped(self, message_hub):
+        """
+        The replies expected from #message_hub will never come.
+        """
+        self.cancel_actions(message_hub)
+
+    def cancel_actions(self, message_hub):
+        """
+        Cancel all the pending actions waiting for a notification from
+        #message_hub. They are retried according to their policy.
+        """
+        now = self._clock()
+        cancelled = [
+            action for action in self._pending_actions
+            if action.message_hub is message_hub]
+        for action in cancelled:
+            del self._pending_actions[action]
+            action.cancel()
+            self._retry_given_up(action, now)
+
+    def remove_action(self, action):
+        """
+        Stop running #action whatever its state (for instance because its
+        robot is removed): it is cancelled and never repeated.
+        """
+        # the timeout entry of a pending action is obsolete once it is popped
+        found = self._pending_actions.pop(action, False) is not False
+        if action in self._created_actions:
+            self._created_actions.remove(action)
+            found = True
+        retries = [entry for entry in self._retries if entry[2] is not action]
+        if len(retries) != len(self._retries):
+            heapq.heapify(retries)
+            self._retries = retries
+            found = True
+        if found:
+            action.cancel()
+            action.finish()
+
+    def _retry_given_up(self, action, now):
+        """
+        Repeat (later) an action that timed out or was cancelled if its
+        policy allows it.
+        """
+        if action.repeat and action.retry_on_timeout:
+            action.reset()
+            self._schedule_retry(action, now)
+        else:
+            action.finish()
+
+    def _add_pending(self, action, now):
+        if action.timeout is None:
+            self._pending_actions[action] = None
+        else:
+            sequence = next(self._sequence)
+            self._pending_actions[action] = sequence
+            heapq.heappush(
+                self._timeouts,
+                (now + action.timeout, sequence, action))
+
+    def _schedule_retry(self, action, now):
+        delay = action.retry_delay()
+        if delay is None:
+            delay = Engine.RETRY_INTERVAL
+        heapq.heappush(
+            self._retries,
+            (now + delay, next(self._sequence), action))
+
     def step(self):
         """
-        Check all pending actions to see if a notification has been received.
-        Run all the actions that are in the created state.
+        Process the pending actions that have received a notification or
+        whose deadline is reached.
+        Run all the actions that are in the created state (including the ones
+        that failed and whose retry deadline is reached).
         """
-        to_remove = []
-        new_actions = []
-        for action in self._pending_actions:
+        now = self._clock()
+        while self._retries and self._retries[0][0] <= now:
+            _, _, action = heapq.heappop(self._retries)
+            self._created_actions.append(action)
+        notified_actions = self._notified_actions
+        self._notified_actions = []
+        for action in notified_actions:
+            if action not in self._pending_actions:
+                continue
             if Status.waiting == action.status:
+                del self._pending_actions[action]
                 action.reset()
-                to_remove.append(action)
-                if Status.successful == action.status:
-                    pass
-                elif Status.failed == action.status:
-                    if action.repeat:
-                        action.reset()
-                        new_actions.append(action)
-        for action in to_remove:
-            self._pending_actions.remove(action)
-        for action in self._created_actions:
+                if Status.failed == action.status and action.repeat:
+                    action.reset()
+                    self._schedule_retry(action, now)
+                else:
+                    action.finish()
+        while self._timeouts and self._timeouts[0][0] <= now:
+            _, sequence, action = heapq.heappop(self._timeouts)
+            if sequence == self._pending_actions.get(action):
+                del self._pending_actions[action]
+                action.time_out()
+                self._retry_given_up(action, now)
+        ACTIONS_CALLED.inc(len(self._created_actions))
+        for _ in range(len(self._created_actions)):
+            action = self._created_actions.popleft()
             action.call()
             if Status.pending == action.status:
-                self._pending_actions.append(action)
+                self._add_pending(action, now)
             elif Status.successful == action.status:
-                pass
+                action.finish()
             elif Status.failed == action.status:
                 if action.repeat:
                     action.reset()
-                    new_actions.append(action)
-        self._created_actions = new_actions
+                    self._schedule_retry(action, now)
+                else:
+                    action.finish()
+        PENDING_ACTIONS.set(len(self._pending_actions))
+        RETRIES.set(len(self._retries))
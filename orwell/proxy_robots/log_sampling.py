@@ -0,0 +1,46 @@
+"""
+Sampled debug logs of the hot paths (one record in N for each log call) to
+debug production traffic without logging every message.
+"""
+import logging
+
+# loggers of the code run for each message or input
+HOT_PATH_LOGGERS = (
+    "orwell.proxy_robots.action",
+    "orwell.proxy_robots.connectors",
+    "orwell.proxy_robots.devices",
+    "orwell.proxy_robots.message_hub",
+    "orwell.proxy_robots.robot",
+)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let one record in #rate through for each log call (told apart by its
+    location and format string). Records above DEBUG always go through.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self._rate = rate
+        self._counts = {}  # (path, line, format) -> number of records
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.pathname, record.lineno, record.msg)
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        return 0 == count % self._rate
+
+
+def enable_sampled_debug(rate, names=HOT_PATH_LOGGERS):
+    """
+    Log one debug record in #rate for the loggers called #names.
+    """
+    sampling_filter = SamplingFilter(rate)
+    for name in names:
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.DEBUG)
+        logger.addFilter(sampling_filter)
+    return sampling_filter
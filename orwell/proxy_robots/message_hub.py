@@ -1,13 +1,92 @@
 import collections
 import logging
+from enum import Enum
 
 from orwell.proxy_robots.connectors import Pusher
 from orwell.proxy_robots.connectors import Replier
 from orwell.proxy_robots.connectors import Subscriber
-from orwell.proxy_robots.registry import REGISTRY
+from orwell.proxy_robots.metrics import METRICS
+from orwell.proxy_robots.registry import MESSAGE_TYPES
 
 
 LOGGER = logging.getLogger(__name__)
+MESSAGES_RECEIVED = METRICS.counter(
+    "proxy_messages_received_total", "Messages read from the game server.")
+MESSAGES_DISPATCHED = METRICS.counter(
+    "proxy_messages_dispatched_total",
+    "Messages decoded and given to listeners.",
+    "message_type")
+MESSAGES_SENT = METRICS.counter(
+    "proxy_messages_sent_total", "Messages written to the game server.")
+MESSAGES_COALESCED = METRICS.counter(
+    "proxy_messages_coalesced_total",
+    "Messages dropped because a newer one of the same type for the same "
+    "routing id was read in the same step.")
+STEP_READS = METRICS.histogram(
+    "proxy_message_hub_step_reads",
+    "Messages read from the game server in one step of the message hub.",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+SATURATED_STEPS = METRICS.counter(
+    "proxy_message_hub_saturated_steps_total",
+    "Steps of the message hub that stopped on the read limit with messages "
+    "left.")
+BACKLOG_STEPS = METRICS.gauge(
+    "proxy_message_hub_backlog_steps",
+    "Consecutive saturated steps of the message hub (0 once drained).")
+
+
+class WireMode(Enum):
+    # routing id, message type and message in one frame separated by spaces
+    single = 0
+    # routing id, message type and message in three frames (no copy)
+    multipart = 1
+    # read both, write single frames until the server sends multipart frames
+    auto = 2
+
+
+class MessageHubStatistics(object):
+    """
+    Counters telling how much work the message hub does and whether it keeps
+    up with the game server.
+    """
+
+    def __init__(self):
+        # number of calls to MessageHub.step
+        self.steps = 0
+        # total number of messages read from the subscriber
+        self.messages_read = 0
+        # number of messages read during the last step
+        self.last_step_reads = 0
+        # largest number of messages read during one step
+        self.max_step_reads = 0
+        # number of steps that stopped on the read limit with messages left
+        self.saturated_steps = 0
+        # number of consecutive saturated steps up to the last one (0 means
+        # the queue was drained)
+        self.backlog_steps = 0
+        # message type -> number of messages decoded
+        self.decoded = collections.Counter()
+        # message type -> number of messages dropped without being decoded
+        # (unknown type or nobody listening)
+        self.skipped = collections.Counter()
+        # number of messages dropped because a newer message of the same
+        # type for the same routing id was read in the same step
+        self.coalesced = 0
+
+    def record_step(self, reads, saturated):
+        self.steps += 1
+        self.messages_read += reads
+        self.last_step_reads = reads
+        if reads > self.max_step_reads:
+            self.max_step_reads = reads
+        if saturated:
+            self.saturated_steps += 1
+            self.backlog_steps += 1
+            SATURATED_STEPS.inc()
+        else:
+            self.backlog_steps = 0
+        STEP_READS.observe(reads)
+        BACKLOG_STEPS.set(self.backlog_steps)
 
 
 class MessageHub(object):
@@ -25,7 +104,11 @@ class MessageHub(object):
             replier_address,
             subscriber_type=Subscriber,
             pusher_type=Pusher,
-            replier_type=Replier):
+            replier_type=Replier,
+            max_reads_per_step=1,
+            filter_subscriptions=False,
+            wire_mode=WireMode.single,
+            coalesced_types=()):
         """
         `publisher_address`: address to read from.
         `pusher_address`: address to write to.
@@ -36,6 +119,17 @@ class MessageHub(object):
           writes to the puller address.
         `replier_type`: for testing purpose ; class to use as replier which
           writes to and reads from the replier address.
+        `max_reads_per_step`: maximum number of messages read from the
+          subscriber in one call to #step (so that the rest of the program is
+          not starved). None means read until there is nothing left.
+        `filter_subscriptions`: if True, only subscribe to the routing ids
+          listeners are registered for instead of every message (the
+          filtering is then done by zmq and not in python).
+        `wire_mode`: how messages are split into frames (see #WireMode).
+        `coalesced_types`: names of the message types for which only the
+          newest message of a routing id read in one step is dispatched (the
+          older ones are dropped before being decoded). Only for messages
+          that carry a whole state, like Input.
         """
         # print("MessageHub ; pusher_address =", pusher_address)
         self._context = zmq_context
@@ -48,8 +142,48 @@ class MessageHub(object):
         self._replier = replier_type(
             replier_address,
             self._context)
-        self._listeners = collections.defaultdict(list)
+        # test doubles may not read replies
+        self._step_replier = getattr(self._replier, "step", None)
+        # (message type, routing id) -> listeners ; an empty message type or
+        # routing id is a wildcard
+        # the listeners are kept as the keys of a dict which is an ordered set
+        self._listeners = {}
         self._outgoing = []
+        self._max_reads_per_step = max_reads_per_step
+        self._wire_mode = wire_mode
+        self._send_multipart = (WireMode.multipart == wire_mode)
+        self._statistics = MessageHubStatistics()
+        self._coalesced_types = frozenset(
+            message_type.encode() for message_type in coalesced_types)
+        # subscription prefix -> number of listeners needing it
+        self._subscriptions = None
+        if filter_subscriptions:
+            self._subscriptions = collections.Counter()
+            self._subscriber.unsubscribe(b"")
+
+    @property
+    def statistics(self):
+        return self._statistics
+
+    @property
+    def replier(self):
+        """
+        The connector sending requests to the game server (see Replier).
+        """
+        return self._replier
+
+    @property
+    def sockets(self):
+        """
+        Sockets that may become readable (used to wait for activity instead
+        of polling). Test doubles without a socket are skipped.
+        """
+        sockets = []
+        for connector in (self._subscriber, self._replier):
+            socket = getattr(connector, "socket", None)
+            if socket is not None:
+                sockets.append(socket)
+        return sockets
 
     def register_listener(self, listener, message_type, routing_id):
         """
@@ -62,59 +196,231 @@ class MessageHub(object):
         Tell that #listener wants to be notified of messages read for type
         #message_type and routing id #routing_id.
         """
-        LOGGER.debug('MessageHub.register_listener({0}, {1}, {2}'.format(
-            listener, message_type, routing_id))
-        if (listener, routing_id) not in self._listeners[message_type]:
-            self._listeners[message_type].append((routing_id, listener))
+        LOGGER.debug(
+            'MessageHub.register_listener(%s, %s, %s)',
+            listener, message_type, routing_id)
+        key = (message_type or "", routing_id or "")
+        listeners = self._listeners.get(key)
+        if listeners is None:
+            listeners = self._listeners[key] = {}
+        if listener not in listeners:
+            listeners[listener] = None
+            self._add_subscription(routing_id)
 
     def unregister_listener(self, listener, message_type, routing_id):
         """
         Reverts the effects of #register_listener (the parameters must be the same).
         """
-        if (listener, routing_id) in self._listeners[message_type]:
-            self._listeners[message_type].remove((listener, routing_id))
+        key = (message_type or "", routing_id or "")
+        listeners = self._listeners.get(key)
+        if listeners is not None and listener in listeners:
+            del listeners[listener]
+            if not listeners:
+                del self._listeners[key]
+            self._remove_subscription(routing_id)
+
+    def _get_prefixes(self, routing_id):
+        """
+        Messages start with the routing id followed by a space in single
+        frame mode and with a frame holding only the routing id in multipart
+        mode (the message type cannot be filtered on as it comes second).
+        """
+        if not routing_id:
+            return (b"",)
+        routing_id = routing_id.encode()
+        if WireMode.single == self._wire_mode:
+            return (routing_id + b" ",)
+        if WireMode.multipart == self._wire_mode:
+            return (routing_id,)
+        # the server may send either
+        return (routing_id + b" ", routing_id)
+
+    def _add_subscription(self, routing_id):
+        if self._subscriptions is None:
+            return
+        for prefix in self._get_prefixes(routing_id):
+            self._subscriptions[prefix] += 1
+            if 1 == self._subscriptions[prefix]:
+                self._subscriber.subscribe(prefix)
+
+    def _remove_subscription(self, routing_id):
+        if self._subscriptions is None:
+            return
+        for prefix in self._get_prefixes(routing_id):
+            self._subscriptions[prefix] -= 1
+            if 0 == self._subscriptions[prefix]:
+                del self._subscriptions[prefix]
+                self._subscriber.unsubscribe(prefix)
+
+    def _find_listeners(self, message_type, routing_id):
+        """
+        Return the listeners interested in messages of type #message_type
+        for routing id #routing_id (including the ones registered with a
+        wildcard).
+        """
+        found = []
+        for key in (
+                (message_type, routing_id),
+                (message_type, ""),
+                ("", routing_id),
+                ("", "")):
+            listeners = self._listeners.get(key)
+            if listeners:
+                found.extend(listeners)
+        return found
+
+    @property
+    def has_outgoing(self):
+        """
+        True if messages are waiting to be written by the next #step.
+        """
+        return bool(self._outgoing)
+
+    @property
+    def sends_multipart(self):
+        """
+        True if messages are written as multipart messages.
+        """
+        return self._send_multipart
 
     def post(self, payload):
         """
         Put a message (type + routing id + encode protobuf message) in the list
         of messages to write to the pusher.
         """
-        self._outgoing.append(payload)
+        self._outgoing.append((payload,))
+
+    def post_message(self, routing_id, message_type, message):
+        """
+        Put a protobuf message in the list of messages to write to the pusher.
+        The message is framed according to the wire mode when written.
+        """
+        self._outgoing.append((
+            routing_id.encode(),
+            message_type.encode(),
+            message.SerializeToString()))
 
     def step(self):
         """
-        Process one incoming message (if any) and process all outgoing
-        messages (if any).
+        Process incoming messages (at most `max_reads_per_step`) and process
+        all outgoing messages (if any).
         """
         # LOGGER.debug('MessageHub.step()')
         # LOGGER.debug('_listeners = ' + str(self._listeners))
-        string = self._subscriber.read()
-        # LOGGER.debug('string = ' + repr(string))
-        if string is not None:
-            routing_id, message_type, raw_message = string.split(b' ', 2)
-            message_type = message_type.decode('ascii')
-            routing_id = routing_id.decode('ascii')
-            if message_type in REGISTRY:
-                LOGGER.debug('message known = ' + repr(message_type))
-                message = REGISTRY[message_type]()
-                message.ParseFromString(raw_message)
-                for expected_routing_id, listener in \
-                        self._listeners[message_type]:
-                    LOGGER.debug('listener = ' + str(listener))
-                    LOGGER.debug(
-                        'expected_routing_id = ' +
-                        str(expected_routing_id))
-                    if expected_routing_id:
-                        is_expected = True
-                    else:
-                        is_expected = (expected_routing_id == routing_id)
-                    if is_expected:
-                        listener.notify(message_type, routing_id, message)
+        reads = 0
+        saturated = False
+        if self._coalesced_types:
+            # messages read, dispatched once the reads are done
+            read_parts = []
+            # routing id -> index in read_parts of the newest message to
+            # coalesce
+            latest = {}
+        while True:
+            if self._max_reads_per_step is not None and \
+                    reads >= self._max_reads_per_step:
+                saturated = self._has_pending()
+                break
+            parts = self._read()
+            if parts is None:
+                break
+            reads += 1
+            if self._coalesced_types:
+                self._coalesce(parts, read_parts, latest)
             else:
-                LOGGER.debug('message NOT known = ' + repr(message_type))
-        for payload in self._outgoing:
-            self._pusher.write(payload)
+                self._dispatch(*parts)
+        if self._coalesced_types:
+            for parts in read_parts:
+                if parts is not None:
+                    self._dispatch(*parts)
+        self._statistics.record_step(reads, saturated)
+        MESSAGES_RECEIVED.inc(reads)
+        MESSAGES_SENT.inc(len(self._outgoing))
+        for frames in self._outgoing:
+            if 1 == len(frames):
+                self._pusher.write(frames[0])
+            elif self._send_multipart:
+                self._pusher.write_multipart(frames)
+            else:
+                self._pusher.write(b' '.join(frames))
         del self._outgoing[:]
+        if self._step_replier is not None:
+            self._step_replier()
+
+    def _read(self):
+        """
+        Read one message and return its routing id, message type and encoded
+        protobuf message (or None if there is nothing to read).
+        """
+        if WireMode.single == self._wire_mode:
+            string = self._subscriber.read()
+            # LOGGER.debug('string = ' + repr(string))
+            if string is None:
+                return None
+            return string.split(b' ', 2)
+        frames = self._subscriber.read_multipart()
+        if frames is None:
+            return None
+        if 1 == len(frames):
+            return frames[0].bytes.split(b' ', 2)
+        if not self._send_multipart:
+            LOGGER.info("The server sends multipart messages, do the same")
+            self._send_multipart = True
+        routing_id, message_type, raw_message = frames
+        # the message is not copied and is parsed from the frame buffer
+        return routing_id.bytes, message_type.bytes, raw_message.buffer
+
+    def _coalesce(self, parts, read_parts, latest):
+        """
+        Add #parts to #read_parts replacing (by None) the previous message of
+        the same routing id if it is of a type to coalesce.
+        """
+        if 3 == len(parts) and parts[1] in self._coalesced_types:
+            key = (parts[0], parts[1])
+            index = latest.get(key)
+            if index is not None:
+                read_parts[index] = None
+                self._statistics.coalesced += 1
+                MESSAGES_COALESCED.inc()
+            latest[key] = len(read_parts)
+        read_parts.append(parts)
+
+    def _has_pending(self):
+        """
+        True if the subscriber tells there are messages left to read.
+        """
+        has_pending = getattr(self._subscriber, "has_pending", None)
+        if has_pending is None:
+            return False
+        return has_pending()
+
+    def _dispatch(self, routing_id, message_type, raw_message):
+        """
+        Decode one message read from the subscriber and notify the listeners.
+        """
+        # the type is looked up from the bytes read (no decoding)
+        known_type = MESSAGE_TYPES.get(message_type)
+        if known_type is not None:
+            message_type = known_type.name
+            routing_id = routing_id.decode('ascii')
+            # the listeners found are a copy as notified listeners may
+            # unregister themselves
+            listeners = self._find_listeners(message_type, routing_id)
+            if not listeners:
+                # most messages are for robots handled by other proxies
+                self._statistics.skipped[message_type] += 1
+                return
+            LOGGER.debug('message known = %r', message_type)
+            # pooled messages are reused once the listeners are notified
+            message = known_type.acquire()
+            message.ParseFromString(raw_message)
+            self._statistics.decoded[message_type] += 1
+            MESSAGES_DISPATCHED.labels(message_type).inc()
+            for listener in listeners:
+                listener.notify(message_type, routing_id, message)
+        else:
+            message_type = bytes(message_type).decode('ascii', 'replace')
+            LOGGER.debug('message NOT known = %r', message_type)
+            self._statistics.skipped[message_type] += 1
 
 
 class DumbMessageHubWrapper(object):
@@ -132,6 +438,18 @@ class DumbMessageHubWrapper(object):
     def is_valid(self):
         return self._message_hub is not None
 
+    @property
+    def sockets(self):
+        if self._message_hub is not None:
+            return self._message_hub.sockets
+        return []
+
+    @property
+    def has_outgoing(self):
+        return (
+            self._message_hub is not None and
+            self._message_hub.has_outgoing)
+
     def step(self):
         if self._message_hub is not None:
             self._message_hub.step()
@@ -139,10 +457,22 @@ class DumbMessageHubWrapper(object):
     def register_waiter(self, waiter):
         self._waiters.append(waiter)
 
+    def unregister_waiter(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+
     def notify_waiters(self):
         for waiter in self._waiters:
             waiter.notify_message_hub(self._message_hub)
 
+    def notify_waiters_dropped(self, message_hub):
+        """
+        Tell the waiters that #message_hub is no longer used (nothing it was
+        expected to read will come).
+        """
+        for waiter in self._waiters:
+            waiter.notify_message_hub_dropped(message_hub)
+
 
 class BroadcasterMessageHubWrapper(DumbMessageHubWrapper):
     """
@@ -158,15 +488,27 @@ class BroadcasterMessageHubWrapper(DumbMessageHubWrapper):
             broadcast_message_queue,
             subscriber_type=Subscriber,
             pusher_type=Pusher,
-            replier_type=Replier):
+            replier_type=Replier,
+            max_reads_per_step=1,
+            filter_subscriptions=False,
+            wire_mode=WireMode.single,
+            coalesced_types=()):
         """
         `delta_check`: interval between two checks (test presence of game server).
+        `max_reads_per_step`: see #MessageHub
+        `filter_subscriptions`: see #MessageHub
+        `wire_mode`: see #MessageHub
+        `coalesced_types`: see #MessageHub
         """
         super().__init__()
         self._zmq_context = zmq_context
         self._subscriber_type = subscriber_type
         self._pusher_type = pusher_type
         self._replier_type = replier_type
+        self._max_reads_per_step = max_reads_per_step
+        self._filter_subscriptions = filter_subscriptions
+        self._wire_mode = wire_mode
+        self._coalesced_types = coalesced_types
         self._broadcast_message_queue = broadcast_message_queue
 
     def _check_message_hub(self):
@@ -178,7 +520,7 @@ class BroadcasterMessageHubWrapper(DumbMessageHubWrapper):
         self._broadcast_message_queue.task_done()
         if message is None:
             if self._message_hub:
-                self._message_hub = None
+                self._drop_message_hub()
         else:
             # We assume this is still the same instance of server game
             # or at least with the same properties.
@@ -189,6 +531,8 @@ class BroadcasterMessageHubWrapper(DumbMessageHubWrapper):
                 "push: " + push_address +
                 " / subscribe: " + subscribe_address +
                 " / reply: " + replier_address)
+            if self._message_hub:
+                self._drop_message_hub()
             self._message_hub = MessageHub(
                 self._zmq_context,
                 subscribe_address,
@@ -196,9 +540,18 @@ class BroadcasterMessageHubWrapper(DumbMessageHubWrapper):
                 replier_address,
                 self._subscriber_type,
                 self._pusher_type,
-                self._replier_type)
+                self._replier_type,
+                self._max_reads_per_step,
+                self._filter_subscriptions,
+                self._wire_mode,
+                self._coalesced_types)
             self.notify_waiters()
 
+    def _drop_message_hub(self):
+        message_hub = self._message_hub
+        self._message_hub = None
+        self.notify_waiters_dropped(message_hub)
+
     def step(self):
         self._check_message_hub()
         super().step()
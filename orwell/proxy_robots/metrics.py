@@ -0,0 +1,187 @@
+"""
+Counters, gauges and histograms updated on the hot path and exported in the
+Prometheus text format (see Admin.METRICS).
+
+Updating a metric is an attribute increment or a bisect into preallocated
+buckets: there are no locks and no allocations. Labelled metrics are looked
+up once (see #LabelledMetric.labels) and the child kept by the caller.
+"""
+import bisect
+import enum
+
+# buckets (in seconds) of the duration histograms
+DURATION_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0)
+
+
+class MetricType(enum.Enum):
+    counter = 1
+    gauge = 2
+    histogram = 3
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{0}="{1}"'.format(
+            name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels) + "}"
+
+
+class Counter(object):
+    metric_type = MetricType.counter
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge(object):
+    metric_type = MetricType.gauge
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram(object):
+    metric_type = MetricType.histogram
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        """
+        `buckets`: sorted upper bounds of the buckets (an implicit +Inf
+            bucket is added).
+        """
+        self._buckets = tuple(buckets)
+        # not cumulative, the last one is +Inf
+        self.counts = [0] * (len(self._buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self._buckets, self.counts):
+            cumulative += count
+            yield (name + "_bucket",
+                   labels + (("le", _format_value(float(bound))),),
+                   cumulative)
+        yield name + "_bucket", labels + (("le", "+Inf"),), self.count
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, self.count
+
+
+class LabelledMetric(object):
+    """
+    Metrics of the same name told apart by the value of a label.
+    """
+
+    def __init__(self, metric_factory, label_name):
+        self._metric_factory = metric_factory
+        self._label_name = label_name
+        self._children = {}  # label value -> metric
+
+    @property
+    def metric_type(self):
+        return self._metric_factory().metric_type
+
+    def labels(self, value):
+        """
+        Return the metric for the label #value (created on first use).
+        """
+        child = self._children.get(value)
+        if child is None:
+            child = self._children[value] = self._metric_factory()
+        return child
+
+    def remove(self, value):
+        self._children.pop(value, None)
+
+    def samples(self, name, labels):
+        for value, child in list(self._children.items()):
+            yield from child.samples(
+                name, labels + ((self._label_name, value),))
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._metrics = {}  # name -> (help, metric)
+
+    def _get(self, name, documentation, metric_factory, label_name):
+        entry = self._metrics.get(name)
+        if entry is None:
+            if label_name:
+                metric = LabelledMetric(metric_factory, label_name)
+            else:
+                metric = metric_factory()
+            entry = self._metrics[name] = (documentation, metric)
+        return entry[1]
+
+    def counter(self, name, documentation, label_name=None):
+        """
+        Return the counter called #name (created on first use). If
+        #label_name is given, a #LabelledMetric is returned.
+        """
+        return self._get(name, documentation, Counter, label_name)
+
+    def gauge(self, name, documentation, label_name=None):
+        return self._get(name, documentation, Gauge, label_name)
+
+    def histogram(
+            self,
+            name,
+            documentation,
+            label_name=None,
+            buckets=DURATION_BUCKETS):
+        return self._get(
+            name, documentation, lambda: Histogram(buckets), label_name)
+
+    def export(self):
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        lines = []
+        for name, (documentation, metric) in sorted(self._metrics.items()):
+            lines.append("# HELP {0} {1}".format(name, documentation))
+            lines.append("# TYPE {0} {1}".format(
+                name, metric.metric_type.name))
+            for sample_name, labels, value in metric.samples(name, ()):
+                lines.append("{0}{1} {2}".format(
+                    sample_name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+# metrics of the process
+METRICS = MetricsRegistry()
@@ -0,0 +1,125 @@
+import collections
+import json
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+# number of durations kept per phase to compute the percentiles
+WINDOW = 1000
+# number of slow ticks kept in memory
+SLOW_TICKS = 20
+PERCENTILES = (50, 90, 99)
+
+
+class RollingPercentiles(object):
+    """
+    The last `size` durations of a phase (in a preallocated ring).
+    """
+
+    def __init__(self, size=WINDOW):
+        self._values = [0.0] * size
+        self._index = 0
+        self._count = 0
+
+    def add(self, value):
+        self._values[self._index] = value
+        self._index = (self._index + 1) % len(self._values)
+        if self._count < len(self._values):
+            self._count += 1
+
+    def to_dict(self):
+        """
+        Return the percentiles (in seconds) and the maximum of the durations
+        kept (sorting is only done here, not when adding).
+        """
+        if not self._count:
+            return {}
+        values = sorted(self._values[:self._count])
+        result = {
+            "p{0}".format(percentile): values[
+                min(self._count - 1, self._count * percentile // 100)]
+            for percentile in PERCENTILES}
+        result["max"] = values[-1]
+        result["count"] = self._count
+        return result
+
+
+class LoopProfiler(object):
+    """
+    Time the phases of the steps of the program (message hub, engine, admin,
+    each robot...) and log a trace of the ticks that go over the budget.
+    """
+
+    def __init__(self, budget, clock=time.perf_counter):
+        """
+        `budget`: duration (in seconds) a tick should not exceed.
+        """
+        self._budget = budget
+        self._clock = clock
+        self._phases = {}  # phase name -> RollingPercentiles
+        self._ticks = RollingPercentiles()
+        self._tick = 0
+        self._tick_start = 0.0
+        self._lap_start = 0.0
+        # (phase name, duration) of the current tick
+        self._laps = []
+        self._slow_ticks = collections.deque(maxlen=SLOW_TICKS)
+        self._slow_tick_count = 0
+
+    @property
+    def slow_ticks(self):
+        """
+        Traces of the last ticks over the budget (oldest first).
+        """
+        return list(self._slow_ticks)
+
+    def start_tick(self):
+        self._tick += 1
+        del self._laps[:]
+        self._tick_start = self._lap_start = self._clock()
+
+    def lap(self, phase):
+        """
+        Record the time since the previous lap (or the start of the tick) as
+        the duration of #phase.
+        """
+        now = self._clock()
+        duration = now - self._lap_start
+        self._lap_start = now
+        self._laps.append((phase, duration))
+        rolling = self._phases.get(phase)
+        if rolling is None:
+            rolling = self._phases[phase] = RollingPercentiles()
+        rolling.add(duration)
+
+    def end_tick(self):
+        duration = self._clock() - self._tick_start
+        self._ticks.add(duration)
+        if duration > self._budget:
+            trace = {
+                "tick": self._tick,
+                "duration": duration,
+                "budget": self._budget,
+                "slowest": max(self._laps, key=lambda lap: lap[1])[0]
+                if self._laps else None,
+                "phases": [
+                    {"phase": phase, "duration": phase_duration}
+                    for phase, phase_duration in self._laps],
+            }
+            self._slow_ticks.append(trace)
+            self._slow_tick_count += 1
+            LOGGER.warning("slow tick: %s", json.dumps(trace))
+
+    def to_dict(self):
+        """
+        Percentiles of the ticks and of each phase.
+        """
+        return {
+            "budget": self._budget,
+            "ticks": self._ticks.to_dict(),
+            "slow_ticks": self._slow_tick_count,
+            "last_slow_ticks": self.slow_ticks,
+            "phases": {
+                phase: rolling.to_dict()
+                for phase, rolling in self._phases.items()},
+        }
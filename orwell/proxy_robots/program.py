@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import datetime
 import logging
 import time
@@ -13,19 +14,43 @@ import orwell_common.broadcast_listener
 import orwell_common.logging
 
 from orwell.proxy_robots.admin import Admin
+from orwell.proxy_robots.aio import AsyncProgram
+from orwell.proxy_robots.capture import CaptureWriter
+from orwell.proxy_robots.connectors import AdminPublisher
 from orwell.proxy_robots.connectors import Pusher
 from orwell.proxy_robots.connectors import Replier
 from orwell.proxy_robots.connectors import Subscriber
+from orwell.proxy_robots.devices import DeviceMultiplexer
 from orwell.proxy_robots.devices import FakeDevice
 from orwell.proxy_robots.devices import HarpiDevice
 from orwell.proxy_robots.engine import Engine
+from orwell.proxy_robots.log_sampling import enable_sampled_debug
 from orwell.proxy_robots.message_hub import BroadcasterMessageHubWrapper
 from orwell.proxy_robots.message_hub import DumbMessageHubWrapper
 from orwell.proxy_robots.message_hub import MessageHub
+from orwell.proxy_robots.message_hub import WireMode
+from orwell.proxy_robots.metrics import METRICS
+from orwell.proxy_robots.profiler import LoopProfiler
+from orwell.proxy_robots.provisioning import DeviceFactory
+from orwell.proxy_robots.provisioning import DeviceType
+from orwell.proxy_robots.provisioning import RegistrationQueue
+from orwell.proxy_robots.provisioning import load_config
+from orwell.proxy_robots.registry import Messages
 from orwell.proxy_robots.robot import Robot
+from orwell.proxy_robots.state_stream import StateStream
+from orwell.proxy_robots.supervisor import Supervisor
+from orwell.proxy_robots.writer import DeviceWriter
 
 ZMQ_CONTEXT = zmq.Context.instance(1)
 LOGGER = logging.getLogger("orwell.proxy_robots")
+# period of the historical main loop (sleep between two steps)
+LOOP_SLEEP = 0.01
+# longest time the reactor waits without a step (the broadcast messages
+# telling that the game server appeared are not received on a socket)
+REACTOR_MAX_WAIT = 0.5
+STEP_DURATION = METRICS.histogram(
+    "proxy_step_duration_seconds", "Duration of the steps of the program.")
+ROBOTS = METRICS.gauge("proxy_robots", "Robots handled by the program.")
 
 
 class Program(object):
@@ -40,11 +65,50 @@ class Program(object):
         """
         `arguments`: object that must at least contain publisher_port,
             puller_port, address. (not any longer with the broadcast)
+            max_reads_per_step is the maximum number of messages read by the
+            message hub in one step (0 for no limit).
+            subscription_filtering tells if the message hub only subscribes
+            to the messages of the robots it handles.
+            wire_mode is the name of the #WireMode used with the server.
+            input_coalescing tells if only the newest Input of a robot read
+            in one step of the message hub is used.
+            profile tells if the phases of the steps are timed (see
+            #LoopProfiler), tick_budget is the duration (in seconds) over
+            which the trace of a step is logged.
+            admin_stream_port is the port the changes of the robots are
+            published on (see #StateStream, 0 for none), stream_rate the
+            maximum number of updates per second for a robot and
+            keyframe_interval the time (in seconds) between two full states.
+            writer_thread tells if the devices and the game server are
+            written by a #DeviceWriter thread.
+            capture is the path of the file the messages exchanged with the
+            game server are appended to (see #CaptureWriter, None for none).
         `subscriber_type`: see #MessageHub
         `pusher_type`: see #MessageHub
         `replier_type`: see #MessageHub
         """
         self._zmq_context = zmq_context
+        max_reads_per_step = arguments.max_reads_per_step or None
+        filter_subscriptions = arguments.subscription_filtering
+        wire_mode = WireMode[arguments.wire_mode]
+        if arguments.input_coalescing:
+            # Registered and the other replies must all be seen
+            coalesced_types = (Messages.Input.name,)
+        else:
+            coalesced_types = ()
+        if arguments.writer_thread:
+            self._writer = DeviceWriter()
+            pusher_type = self._writer.wrap_pusher_type(pusher_type)
+        else:
+            self._writer = None
+        if arguments.capture:
+            # the writes are captured when posted to the writer thread
+            self._capture = CaptureWriter(arguments.capture)
+            subscriber_type = self._capture.wrap_subscriber_type(
+                subscriber_type)
+            pusher_type = self._capture.wrap_pusher_type(pusher_type)
+        else:
+            self._capture = None
         if arguments.no_server_broadcast:
             ip = arguments.address
             push_address = "tcp://{ip}:{port}".format(
@@ -61,7 +125,11 @@ class Program(object):
                     replier_address,
                     subscriber_type,
                     pusher_type,
-                    replier_type))
+                    replier_type,
+                    max_reads_per_step,
+                    filter_subscriptions,
+                    wire_mode,
+                    coalesced_types))
             self._broadcast_pinger = None
         else:
             broadcast_message_queue = queue.Queue()
@@ -70,49 +138,274 @@ class Program(object):
                 broadcast_message_queue,
                 subscriber_type,
                 pusher_type,
-                replier_type)
+                replier_type,
+                max_reads_per_step,
+                filter_subscriptions,
+                wire_mode,
+                coalesced_types)
             self._broadcast_pinger = BroadcastPinger(
                 broadcast_message_queue, sleep_duration=5, timeout=1)
+        if arguments.profile:
+            self._profiler = LoopProfiler(arguments.tick_budget)
+        else:
+            self._profiler = None
         self._admin = admin_type(self._zmq_context, self, arguments.admin_port)
+        if arguments.admin_stream_port:
+            self._state_stream = StateStream(
+                AdminPublisher(arguments.admin_stream_port, self._zmq_context),
+                self,
+                1.0 / arguments.stream_rate,
+                arguments.keyframe_interval)
+        else:
+            self._state_stream = None
         self._engine = Engine()
+        # the actions waiting for replies from a message hub that goes away
+        # are cancelled
+        self._message_hub_wrapper.register_waiter(self._engine)
         self._robots = {}  # id -> Robot
+        # incremented when robots are added, removed or change (see
+        # Robot.version)
+        self._robots_version = 0
         if not arguments.no_proxy_broadcast:
             self._broadcast_listener = BroadcastListener(
                 arguments.proxy_broadcast_port,
                 arguments.admin_port)
         else:
             self._broadcast_listener = None
+        self._poller = None
+        self._polled_sockets = ()
+        # multiplexers reading the sockets shared by several devices
+        self._multiplexers = []
+        # ports given to the broadcast listener
+        self._ports = set()
+        # robots added in bulk waiting for their turn to register
+        self._registrations = RegistrationQueue()
+        # creates the devices of the robots added by #provision_robot
+        self._device_factory = DeviceFactory()
+
+    def set_device_factory(self, device_factory):
+        self._device_factory = device_factory
 
-    def add_robot(self, robot_id, device=None):
+    def add_robot(self, robot_id, device=None, batched=False):
         """
         Create a robot and ask it to register into the server.
+        `batched`: True to register the robot with the next batch (see
+            #RegistrationQueue) instead of right away.
         """
+        if robot_id in self._robots:
+            raise ValueError("Robot {0} already exists".format(robot_id))
+        if self._writer is not None:
+            device = self._writer.wrap_device(device)
         robot = Robot(robot_id, self._message_hub_wrapper, self._engine, device)
+        robot.set_change_callback(self._robot_changed)
         self._robots[robot_id] = robot
+        self._robots_version += 1
+        ROBOTS.set(len(self._robots))
+        multiplexer = getattr(device, "multiplexer", None)
+        if multiplexer is not None and multiplexer not in self._multiplexers:
+            self._multiplexers.append(multiplexer)
         robot_socket = device.get_socket()
         if robot_socket:
             port = robot_socket.getsockname()[1]
             LOGGER.info(
                 "Robot {id} is using port {port}".format(
                     id=robot_id, port=port))
-            self._broadcast_listener.add_socket_port(port)
+            # robots sharing a socket share the port
+            if port not in self._ports:
+                self._ports.add(port)
+                if self._broadcast_listener:
+                    self._broadcast_listener.add_socket_port(port)
         else:
             LOGGER.info("Robot %s is not getting a port", robot_id)
-        robot.queue_register()
+        if batched:
+            self._registrations.add(robot)
+        else:
+            robot.queue_register()
+
+    def provision_robot(self, description):
+        """
+        Create the device of the robot of #description (see #DeviceFactory)
+        and add the robot (it registers with the next batch).
+        """
+        if description.robot_id in self._robots:
+            raise ValueError(
+                "Robot {0} already exists".format(description.robot_id))
+        device = self._device_factory.create(description)
+        self.add_robot(description.robot_id, device, batched=True)
+
+    def load_configuration(self, configuration):
+        """
+        Add the robots of #configuration: the sockets of all the robots are
+        allocated first, then the robots register in batches.
+        """
+        self._registrations.configure(
+            configuration.batch_size, configuration.registration_interval)
+        for description in configuration.robots:
+            if description.robot_id in self._robots:
+                raise ValueError(
+                    "Robot {0} already exists".format(description.robot_id))
+        devices = [
+            self._device_factory.create(description)
+            for description in configuration.robots]
+        for description, device in zip(configuration.robots, devices):
+            self.add_robot(description.robot_id, device, batched=True)
+        LOGGER.info("%s robots loaded", len(devices))
+
+    def remove_robot(self, robot_id):
+        """
+        Forget about a robot, stop listening to its messages and release its
+        device (the socket of the robot is closed).
+        """
+        robot = self._robots.pop(robot_id)
+        self._registrations.remove(robot)
+        robot.remove()
+        self._device_factory.release(robot_id, robot.device)
+        self._robots_version += 1
+        ROBOTS.set(len(self._robots))
 
     @property
     def robots(self):
         return self._robots
 
+    def _robot_changed(self):
+        self._robots_version += 1
+
+    @property
+    def state_version(self):
+        """
+        Value that changes when robots are added, removed, register or get
+        a new address (see Robot.to_dict).
+        """
+        return self._robots_version
+
     def step(self):
         """
         Run the engine and the message hub (only one call).
         """
+        start = time.perf_counter()
+        profiler = self._profiler
+        if profiler is None:
+            self._step_services(None)
+            for robot in self._robots.values():
+                robot.step()
+        else:
+            profiler.start_tick()
+            self._step_services(profiler)
+            for robot_id, robot in self._robots.items():
+                robot.step()
+                profiler.lap("robot {0}".format(robot_id))
+            profiler.end_tick()
+        STEP_DURATION.observe(time.perf_counter() - start)
+
+    def step_services(self):
+        """
+        Run everything but the robots (which can be stepped separately).
+        """
+        self._step_services(None)
+
+    def _step_services(self, profiler):
         self._message_hub_wrapper.step()
+        if profiler:
+            profiler.lap("message_hub")
+        # the registrations are sent by the engine step
+        self._registrations.step()
         self._engine.step()
+        if profiler:
+            profiler.lap("engine")
         self._admin.step()
+        if profiler:
+            profiler.lap("admin")
+        if self._state_stream is not None:
+            self._state_stream.step()
+            if profiler:
+                profiler.lap("state_stream")
+        if self._multiplexers:
+            for multiplexer in self._multiplexers:
+                multiplexer.step()
+            if profiler:
+                profiler.lap("multiplexers")
+        if self._capture is not None:
+            self._capture.step()
+
+    @property
+    def profiler(self):
+        """
+        The #LoopProfiler or None if profiling is off.
+        """
+        return self._profiler
+
+    @property
+    def writer(self):
+        """
+        The #DeviceWriter or None if the control loop does the writes.
+        """
+        return self._writer
+
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def service_sockets(self):
+        """
+        The sockets of the message hub and of the admin.
+        """
+        sockets = list(self._message_hub_wrapper.sockets)
+        admin_socket = self._admin.socket
+        if admin_socket is not None:
+            sockets.append(admin_socket)
+        return sockets
+
+    def _get_poller(self):
+        """
+        Return a poller watching every socket that can wake the program up.
+        The poller is rebuilt only when the set of sockets changes (the
+        message hub is replaced or robots are added).
+        """
+        sockets = self.service_sockets
         for robot in self._robots.values():
-            robot.step()
+            device_socket = robot.device.get_socket()
+            # shared sockets are only polled once
+            if device_socket is not None and device_socket not in sockets:
+                sockets.append(device_socket)
+        sockets = tuple(sockets)
+        if sockets != self._polled_sockets:
+            self._poller = zmq.Poller()
+            for socket in sockets:
+                self._poller.register(socket, zmq.POLLIN)
+            self._polled_sockets = sockets
+        return self._poller
+
+    def idle_timeout(self):
+        """
+        Return how long (in seconds) the program can wait before a step has
+        something to do without a socket being readable (None for ever).
+        """
+        if self._message_hub_wrapper.has_outgoing:
+            # what the engine and the robots posted is written by the next
+            # step of the message hub
+            return 0
+        timeout = self._engine.idle_timeout()
+        registration_timeout = self._registrations.idle_timeout()
+        if registration_timeout is not None and (
+                timeout is None or registration_timeout < timeout):
+            timeout = registration_timeout
+        return timeout
+
+    def wait(self, max_timeout=REACTOR_MAX_WAIT):
+        """
+        Block until a socket is readable, an engine action is due or
+        `max_timeout` (in seconds) has elapsed. Meant to be called before
+        each #step instead of sleeping.
+        """
+        timeout = self.idle_timeout()
+        if timeout is None or timeout > max_timeout:
+            timeout = max_timeout
+        poller = self._get_poller()
+        if self._polled_sockets:
+            poller.poll(int(timeout * 1000))
+        elif timeout > 0:
+            time.sleep(timeout)
 
     def start(self):
         """
@@ -122,6 +415,54 @@ class Program(object):
             self._broadcast_listener.start()
         if self._broadcast_pinger:
             self._broadcast_pinger.start()
+        if self._writer is not None:
+            self._writer.start()
+
+    def stop(self):
+        """
+        To be called once the program is no longer stepped: what is left to
+        the writer thread and the end of the capture (if any) are written.
+        """
+        if self._writer is not None:
+            self._writer.stop()
+        if self._capture is not None:
+            self._capture.close()
+
+
+def run(program, reactor, use_asyncio=False):
+    """
+    Step #program forever, waiting for activity if #reactor is True and
+    sleeping between two steps otherwise. With #use_asyncio, the program
+    is run by an asyncio event loop (see #AsyncProgram).
+    """
+    try:
+        if use_asyncio:
+            asyncio.run(AsyncProgram(program, REACTOR_MAX_WAIT).run())
+            return
+        program.start()
+        if reactor:
+            while True:
+                program.wait()
+                program.step()
+        else:
+            while True:
+                program.step()
+                time.sleep(LOOP_SLEEP)
+    finally:
+        program.stop()
+
+
+def _take_port(sockets_lister):
+    """
+    Return the port of the next socket of #sockets_lister (None if there is
+    none left) and close the socket so that a worker can bind the port.
+    """
+    socket = sockets_lister.pop_available_socket()
+    if socket is None:
+        return None
+    port = socket.getsockname()[1]
+    socket.close()
+    return port
 
 
 def main():
@@ -168,17 +509,175 @@ def main():
         help='Verbose mode',
         default=False,
         action="store_true")
+    parser.add_argument(
+        "--debug-sampling",
+        help="Log one debug record in N of the code run for each message "
+        "(0 to only follow --verbose).",
+        default=0,
+        type=int)
+    parser.add_argument(
+        "--admin-stream-port",
+        help="The port the changes of the state of the robots are published "
+        "on (0 to disable ; the workers use the following ports).",
+        default=0,
+        type=int)
+    parser.add_argument(
+        "--stream-rate",
+        help="Maximum number of state updates published per second for a "
+        "robot.",
+        default=10.0,
+        type=float)
+    parser.add_argument(
+        "--keyframe-interval",
+        help="Time (in seconds) between two publications of the full state "
+        "of the robots.",
+        default=5.0,
+        type=float)
+    parser.add_argument(
+        "--config",
+        help="JSON or YAML file describing the robots (see provisioning) "
+        "instead of the default robot (shared robots need a single worker).",
+        default=None,
+        type=str)
     parser.add_argument(
         "--ports-count",
         help="The number of ports available for robots",
         default=1,
         type=int)
+    parser.add_argument(
+        "--shared-socket",
+        help="Use a single port for all the robots (they give their id in "
+        "their first message).",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--workers",
+        dest="worker_count",
+        help="Number of worker processes the robots are spread over (the "
+        "workers use the admin ports following --admin-port ; the robots "
+        "added by the admin without a port get a fake device).",
+        default=1,
+        type=int)
+    parser.add_argument(
+        "--max-reads-per-step",
+        help="The maximum number of messages read from the game server in "
+        "one step (0 for no limit).",
+        default=64,
+        type=int)
+    parser.add_argument(
+        "--subscription-filtering",
+        help="Only subscribe to the messages of the robots handled by the "
+        "proxy (the server or zmq filters the other messages out).",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--wire-mode",
+        help="How messages exchanged with the server are framed: single "
+        "frame, multipart or single until the server sends multipart.",
+        choices=[mode.name for mode in WireMode],
+        default=WireMode.single.name)
+    parser.add_argument(
+        "--input-coalescing",
+        help="Only use the newest input of a robot among the messages read "
+        "in one step (the older ones are dropped without being decoded).",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--reactor",
+        help="Wait for sockets and engine timers instead of sleeping "
+        "between two steps.",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--profile",
+        help="Time each phase of the steps (message hub, engine, admin, "
+        "each robot) and log the steps going over --tick-budget.",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--tick-budget",
+        help="Duration (in seconds) of a step over which its phases are "
+        "logged when profiling.",
+        default=LOOP_SLEEP,
+        type=float)
+    parser.add_argument(
+        "--writer-thread",
+        help="Write to the robots and the game server from a dedicated "
+        "thread (only the newest state of a robot is sent).",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--capture",
+        help="Append the messages exchanged with the game server to this "
+        "file (to be replayed with orwell.proxy_robots.replay ; the workers "
+        "add their index to the name).",
+        default=None,
+        type=str)
+    parser.add_argument(
+        "--asyncio",
+        dest="use_asyncio",
+        help="Run the program in an asyncio event loop (each robot is "
+        "stepped as soon as it receives an input).",
+        default=False,
+        action="store_true")
     arguments = parser.parse_args()
+    if arguments.worker_count > 1 and arguments.shared_socket:
+        parser.error("--shared-socket cannot be used with several workers")
     orwell_common.logging.configure_logging(arguments.verbose)
+    if arguments.debug_sampling:
+        enable_sampled_debug(arguments.debug_sampling)
     sockets_lister = SocketsLister(arguments.ports_count)
+    if arguments.config:
+        configuration = load_config(arguments.config)
+    else:
+        configuration = None
     robots = ['951']
+    if arguments.worker_count > 1:
+        if configuration is not None:
+            shared_ids = [
+                description.robot_id
+                for description in configuration.robots
+                if DeviceType.shared == description.device_type]
+            if shared_ids:
+                parser.error(
+                    "shared robots ({0}) cannot be used with several "
+                    "workers".format(", ".join(shared_ids)))
+            robot_ports = []
+            for description in configuration.robots:
+                port = None
+                if DeviceType.harpi == description.device_type:
+                    port = description.port
+                    if port is None:
+                        port = _take_port(sockets_lister)
+                    if port is None:
+                        LOGGER.info(
+                            "No socket for robot %s, using a fake device",
+                            description.robot_id)
+                robot_ports.append((description.robot_id, port))
+        else:
+            robot_ports = [
+                (robot, _take_port(sockets_lister)) for robot in robots]
+        supervisor = Supervisor(ZMQ_CONTEXT, arguments, robot_ports)
+        supervisor.run()
+        return
     program = Program(ZMQ_CONTEXT, arguments)
+    multiplexer = None
+    if arguments.shared_socket:
+        socket = sockets_lister.pop_available_socket()
+        if socket:
+            multiplexer = DeviceMultiplexer(socket)
+    # also used by the robots added by the admin
+    program.set_device_factory(DeviceFactory(sockets_lister, multiplexer))
+    if configuration is not None:
+        program.load_configuration(configuration)
+        run(program, arguments.reactor, arguments.use_asyncio)
+        return
     for robot in robots:
+        if multiplexer is not None:
+            device = multiplexer.create_device(robot)
+            program.add_robot(robot, device)
+            LOGGER.info('Shared device for robot ' + str(robot))
+            continue
         socket = sockets_lister.pop_available_socket()
         if socket:
             device = HarpiDevice(socket)
@@ -188,10 +687,7 @@ def main():
             LOGGER.info('Oups, no device to associate to robot ' + str(robot))
             device = FakeDevice()
             program.add_robot(robot, device)
-    program.start()
-    while True:
-        program.step()
-        time.sleep(0.01)
+    run(program, arguments.reactor, arguments.use_asyncio)
 
 
 if "__main__" == __name__:
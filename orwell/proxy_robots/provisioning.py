@@ -0,0 +1,262 @@
+"""
+Describe the robots handled by the program in a configuration file and create
+their devices, at start up or at runtime (see Admin.ADD_ROBOT).
+
+A configuration is a JSON (or YAML) document like:
+    {
+        "registration": {"batch_size": 20, "interval": 0.1},
+        "robots": [
+            {"id": "951", "device": "harpi", "port": 10951},
+            {"id": "952", "device": "harpi"},
+            {"id": "953", "device": "fake"}
+        ]
+    }
+A harpi robot without a port gets the next socket of the sockets lister and
+a shared robot uses the socket of the multiplexer (see #DeviceFactory).
+"""
+import collections
+from enum import Enum
+import json
+import logging
+import socket
+import time
+
+from orwell.proxy_robots.devices import FakeDevice
+from orwell.proxy_robots.devices import HarpiDevice
+
+LOGGER = logging.getLogger(__name__)
+# number of robots asked to register at once
+REGISTRATION_BATCH_SIZE = 20
+# time (in seconds) between two batches of registrations
+REGISTRATION_INTERVAL = 0.1
+YAML_EXTENSIONS = (".yaml", ".yml")
+
+
+class DeviceType(Enum):
+    # a UDP socket of its own
+    harpi = 0
+    # the UDP socket of the multiplexer of the program
+    shared = 1
+    # no robot behind
+    fake = 2
+
+
+class RobotDescription(object):
+    def __init__(self, robot_id, device_type=DeviceType.harpi, port=None):
+        """
+        `port`: UDP port the socket of a harpi robot is bound to (None to
+            take one from the sockets lister).
+        """
+        self.robot_id = robot_id
+        self.device_type = device_type
+        self.port = port
+
+    def __repr__(self):
+        return "RobotDescription({0!r}, {1}, {2})".format(
+            self.robot_id, self.device_type.name, self.port)
+
+
+class Configuration(object):
+    def __init__(
+            self,
+            robots,
+            batch_size=REGISTRATION_BATCH_SIZE,
+            registration_interval=REGISTRATION_INTERVAL):
+        """
+        `robots`: list of #RobotDescription.
+        `batch_size`: see #RegistrationQueue
+        `registration_interval`: see #RegistrationQueue
+        """
+        self.robots = robots
+        self.batch_size = batch_size
+        self.registration_interval = registration_interval
+
+
+def parse_robot(entry):
+    """
+    Return the #RobotDescription of a robot entry of a configuration.
+    """
+    if "id" not in entry:
+        raise ValueError("Robot without id: {0!r}".format(entry))
+    device_name = entry.get("device", DeviceType.harpi.name)
+    if device_name not in DeviceType.__members__:
+        raise ValueError("Unknown device type {0!r} for robot {1}".format(
+            device_name, entry["id"]))
+    port = entry.get("port")
+    return RobotDescription(
+        str(entry["id"]),
+        DeviceType[device_name],
+        int(port) if port is not None else None)
+
+
+def parse_config(content):
+    """
+    Return the #Configuration described by the decoded document #content.
+    """
+    robots = [parse_robot(entry) for entry in content.get("robots", ())]
+    seen = set()
+    for description in robots:
+        if description.robot_id in seen:
+            raise ValueError(
+                "Duplicate robot id: {0}".format(description.robot_id))
+        seen.add(description.robot_id)
+    registration = content.get("registration", {})
+    return Configuration(
+        robots,
+        int(registration.get("batch_size", REGISTRATION_BATCH_SIZE)),
+        float(registration.get("interval", REGISTRATION_INTERVAL)))
+
+
+def load_config(path):
+    """
+    Read the #Configuration in the JSON or YAML (if PyYAML is installed) file
+    #path.
+    """
+    with open(path) as config_file:
+        if path.endswith(YAML_EXTENSIONS):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(
+                    "PyYAML is needed to read {0} (or use JSON)".format(path))
+            content = yaml.safe_load(config_file)
+        else:
+            content = json.load(config_file)
+    return parse_config(content or {})
+
+
+class DeviceFactory(object):
+    """
+    Create the devices of the robots described in a configuration and
+    release them when the robots are removed.
+    """
+
+    def __init__(self, sockets_lister=None, multiplexer=None):
+        """
+        `sockets_lister`: gives the sockets of the harpi robots without a
+            port (they get a fake device if None or out of sockets).
+        `multiplexer`: #DeviceMultiplexer of the shared robots.
+        """
+        self._sockets_lister = sockets_lister
+        self._multiplexer = multiplexer
+
+    @property
+    def multiplexer(self):
+        return self._multiplexer
+
+    def allocate_socket(self, description):
+        """
+        Return the UDP socket of a harpi robot (or None if there is none).
+        """
+        if description.port is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind(("", description.port))
+            except OSError:
+                sock.close()
+                raise
+            return sock
+        if self._sockets_lister is None:
+            return None
+        return self._sockets_lister.pop_available_socket()
+
+    def create(self, description):
+        """
+        Return the device of the robot of #description.
+        """
+        if DeviceType.fake == description.device_type:
+            return FakeDevice()
+        if DeviceType.shared == description.device_type:
+            if self._multiplexer is None:
+                raise ValueError(
+                    "No shared socket for robot {0}".format(
+                        description.robot_id))
+            return self._multiplexer.create_device(description.robot_id)
+        sock = self.allocate_socket(description)
+        if sock is None:
+            LOGGER.info(
+                "No socket for robot %s, using a fake device",
+                description.robot_id)
+            return FakeDevice()
+        return HarpiDevice(sock)
+
+    def release(self, robot_id, device):
+        """
+        Stop the robot added as #robot_id and close its socket (a shared
+        socket only forgets the device).
+        """
+        multiplexer = getattr(device, "multiplexer", None)
+        if multiplexer is not None:
+            multiplexer.remove_device(robot_id)
+        close = getattr(device, "close", None)
+        if close is not None:
+            close()
+        else:
+            device.stop()
+
+
+class RegistrationQueue(object):
+    """
+    Robots waiting to register, let through in batches so that adding
+    hundreds of robots does not flood the game server with Register messages.
+    """
+
+    def __init__(
+            self,
+            batch_size=REGISTRATION_BATCH_SIZE,
+            interval=REGISTRATION_INTERVAL,
+            clock=time.monotonic):
+        """
+        `batch_size`: number of robots asked to register at once (0 for all
+            the robots waiting).
+        `interval`: time (in seconds) between two batches.
+        """
+        self._batch_size = batch_size
+        self._interval = interval
+        self._clock = clock
+        self._robots = collections.deque()
+        self._next_batch = None
+
+    def __len__(self):
+        return len(self._robots)
+
+    def configure(self, batch_size, interval):
+        self._batch_size = batch_size
+        self._interval = interval
+
+    def add(self, robot):
+        self._robots.append(robot)
+
+    def remove(self, robot):
+        if robot in self._robots:
+            self._robots.remove(robot)
+
+    def idle_timeout(self):
+        """
+        Return how long (in seconds) before the next batch, or None if no
+        robot is waiting.
+        """
+        if not self._robots:
+            return None
+        if self._next_batch is None:
+            return 0
+        return max(0, self._next_batch - self._clock())
+
+    def step(self):
+        """
+        Ask the next batch of robots to register if it is time to.
+        """
+        if not self._robots:
+            return
+        now = self._clock()
+        if self._next_batch is not None and now < self._next_batch:
+            return
+        count = len(self._robots)
+        if self._batch_size:
+            count = min(count, self._batch_size)
+        for _ in range(count):
+            self._robots.popleft().queue_register()
+        LOGGER.debug(
+            "%s robots asked to register, %s waiting",
+            count, len(self._robots))
+        self._next_batch = now + self._interval
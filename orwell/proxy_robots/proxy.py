@@ -18,8 +18,10 @@ class Proxy(object):
 
     def register_listener(self, action):
         if self.message_hub_wrapper.is_valid:
-            self.message_hub_wrapper.message_hub.register_listener(
+            message_hub = self.message_hub_wrapper.message_hub
+            message_hub.register_listener(
                 action, self.message_type, self.routing_id)
+            action.set_message_hub(message_hub)
         else:
             self._actions.append(action)
 
@@ -27,8 +29,76 @@ class Proxy(object):
         for action in self._actions:
             message_hub.register_listener(
                 action, self.message_type, self.routing_id)
+            action.set_message_hub(message_hub)
+        # the actions are registered once, they register again if they are
+        # cancelled and retried
+        del self._actions[:]
+
+    def notify_message_hub_dropped(self, message_hub):
+        """
+        Nothing to do, the engine cancels the actions of the message hub.
+        """
+        pass
 
     def unregister(self, action):
-        if self.message_hub_wrapper.is_valid:
-            self.message_hub_wrapper.message_hub.unregister_listener(
+        message_hub = action.message_hub
+        if message_hub is not None:
+            message_hub.unregister_listener(
                 action, self.message_type, self.routing_id)
+            action.set_message_hub(None)
+        elif action in self._actions:
+            self._actions.remove(action)
+
+
+class RequestProxy(object):
+    """
+    Proxy for an action waiting for the reply to a request sent to the
+    replier of the game server (instead of a message read by the message
+    hub). The doer of the action is #send and the reply notifies the action
+    (the callback gets None as message type and routing id).
+    """
+
+    # nothing to check when notified
+    message_type = None
+    routing_id = None
+
+    def __init__(self, message_hub_wrapper, callback, request):
+        """
+        `request`: the bytes sent. The request times out with the action
+            (see Action.timeout).
+        """
+        self.message_hub_wrapper = message_hub_wrapper
+        self.callback = callback
+        self._request = request
+        self._action = None
+        self._replier = None
+        self._request_id = None
+
+    def register_listener(self, action):
+        self._action = action
+
+    def send(self):
+        """
+        Send the request (False if there is no game server to send it to).
+        """
+        if not self.message_hub_wrapper.is_valid:
+            return False
+        message_hub = self.message_hub_wrapper.message_hub
+        self._replier = message_hub.replier
+        # the engine cancels the action if the message hub is dropped
+        self._action.set_message_hub(message_hub)
+        self._request_id = self._replier.request(
+            self._request, self._on_reply, self._action.timeout)
+        return True
+
+    def _on_reply(self, reply):
+        self._request_id = None
+        if reply is not None:
+            self._action.notify(None, None, reply)
+        # else the engine times the action out
+
+    def unregister(self, action):
+        if self._request_id is not None:
+            self._replier.cancel(self._request_id)
+            self._request_id = None
+        action.set_message_hub(None)
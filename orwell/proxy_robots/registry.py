@@ -11,8 +11,97 @@ class Messages(Enum):
     Input = 'Input'
 
 
-REGISTRY = {
-    Messages.Register.name: lambda: robot_messages.Register(),
-    Messages.Registered.name: lambda: server_game_messages.Registered(),
-    Messages.Input.name: lambda: controller_messages.Input(),
-}
+class MessageType(object):
+    """
+    A type of protobuf message and how its instances are created.
+    """
+
+    def __init__(self, name, message_class, pooled):
+        self._name = name
+        self._token = name.encode('ascii')
+        self._message_class = message_class
+        self._pooled = pooled
+        self._instance = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def token(self):
+        """
+        The message type as it is read from the wire.
+        """
+        return self._token
+
+    @property
+    def message_class(self):
+        return self._message_class
+
+    @property
+    def pooled(self):
+        return self._pooled
+
+    def acquire(self):
+        """
+        Return an empty message. The message of a pooled type is the same
+        instance each time (cleared) so it is only valid until the next call.
+        """
+        if not self._pooled:
+            return self._message_class()
+        if self._instance is None:
+            self._instance = self._message_class()
+        else:
+            self._instance.Clear()
+        return self._instance
+
+
+class MessageRegistry(object):
+    """
+    The message types that can be decoded, indexed by their name and by
+    their token on the wire.
+    """
+
+    def __init__(self):
+        self._by_token = {}  # bytes -> MessageType
+        self._factories = {}  # name -> class
+
+    @property
+    def factories(self):
+        """
+        Dictionary giving the class of each message type name.
+        """
+        return self._factories
+
+    def register(self, name, message_class, pooled=False):
+        """
+        Make messages of type #name decodable (replacing the previous
+        registration if any).
+        `pooled`: True if the listeners of the messages do not keep
+            references to them, a single instance is then reused.
+        """
+        message_type = MessageType(name, message_class, pooled)
+        self._by_token[message_type.token] = message_type
+        self._factories[name] = message_class
+        return message_type
+
+    def unregister(self, name):
+        del self._factories[name]
+        del self._by_token[name.encode('ascii')]
+
+    def get(self, token):
+        """
+        Return the #MessageType for the bytes #token (or None if unknown).
+        """
+        return self._by_token.get(token)
+
+
+MESSAGE_TYPES = MessageRegistry()
+MESSAGE_TYPES.register(Messages.Register.name, robot_messages.Register)
+MESSAGE_TYPES.register(Messages.Registered.name, server_game_messages.Registered)
+# the robots copy the content of the inputs
+MESSAGE_TYPES.register(
+    Messages.Input.name, controller_messages.Input, pooled=True)
+
+# name -> function creating a message (kept up to date by MESSAGE_TYPES)
+REGISTRY = MESSAGE_TYPES.factories
@@ -0,0 +1,217 @@
+"""
+Replay a capture (see the capture module) through the program: the inbound
+messages are given to the message hub by a #ReplaySubscriber and what the
+program writes is counted instead of being sent.
+
+Run from the root of the repository:
+    python -m orwell.proxy_robots.replay capture.log --speed 0
+"""
+import argparse
+import json
+import time
+
+import zmq
+
+from orwell.proxy_robots.capture import Direction
+from orwell.proxy_robots.capture import ReplaySubscriber
+from orwell.proxy_robots.capture import read_capture
+from orwell.proxy_robots.devices import FakeDevice
+from orwell.proxy_robots.message_hub import WireMode
+from orwell.proxy_robots.program import Program
+
+# longest time (in seconds) between two steps when waiting for a message
+MAX_WAIT = 0.5
+
+
+class ReplayArguments(object):
+    """
+    Arguments of the replayed #Program: nothing is connected to a server.
+    """
+    address = "127.0.0.1"
+    publisher_port = 0
+    puller_port = 0
+    replier_port = 0
+    # let zmq pick the port
+    admin_port = "*"
+    no_server_broadcast = True
+    no_proxy_broadcast = True
+    subscription_filtering = False
+    wire_mode = WireMode.single.name
+    max_reads_per_step = 64
+    writer_thread = False
+    input_coalescing = False
+    profile = False
+    tick_budget = 0.01
+    admin_stream_port = 0
+    capture = None
+
+
+class CountingPusher(object):
+    """
+    Pusher counting the messages the program writes.
+    """
+
+    def __init__(self, address, zmq_context):
+        self.count = 0
+
+    def write(self, message):
+        self.count += 1
+
+    def write_multipart(self, frames):
+        self.count += 1
+
+
+class NullReplier(object):
+    """
+    Replier that never gets a reply (the requests time out).
+    """
+
+    def __init__(self, address, zmq_context):
+        pass
+
+    def request(self, message, callback, timeout=None):
+        return 0
+
+    def cancel(self, request_id):
+        pass
+
+
+class Replay(object):
+    def __init__(
+            self,
+            records,
+            robot_ids,
+            speed=1.0,
+            arguments=None,
+            zmq_context=None):
+        """
+        `records`: see #ReplaySubscriber
+        `robot_ids`: ids of the robots added to the program (the ids the
+            robots had when the capture was made, so that the captured
+            Registered messages reach them).
+        `speed`: see #ReplaySubscriber
+        `arguments`: see #Program (ReplayArguments if None).
+        """
+        records = list(records)
+        self._captured_writes = sum(
+            1 for _, direction, _ in records
+            if Direction.outbound == direction)
+        self._subscriber = ReplaySubscriber(records, speed)
+        self._pusher = None
+        if arguments is None:
+            arguments = ReplayArguments()
+        self._program = Program(
+            zmq_context or zmq.Context.instance(),
+            arguments,
+            lambda address, context: self._subscriber,
+            self._create_pusher,
+            NullReplier)
+        for robot_id in robot_ids:
+            self._program.add_robot(robot_id, FakeDevice())
+
+    def _create_pusher(self, address, zmq_context):
+        self._pusher = CountingPusher(address, zmq_context)
+        return self._pusher
+
+    @property
+    def program(self):
+        return self._program
+
+    def run(self):
+        """
+        Step the program until every message of the capture has been read and
+        return the statistics of the replay.
+        """
+        subscriber = self._subscriber
+        program = self._program
+        program.start()
+        # the robots send their registration (and listen to the reply)
+        # before the captured reply is read
+        program.step()
+        subscriber.start()
+        start = time.perf_counter()
+        while not subscriber.exhausted:
+            timeout = subscriber.time_to_next()
+            if timeout:
+                program_timeout = program.idle_timeout()
+                if program_timeout is not None:
+                    timeout = min(timeout, program_timeout)
+                time.sleep(min(timeout, MAX_WAIT))
+            program.step()
+        # write what the last messages triggered
+        program.step()
+        duration = time.perf_counter() - start
+        return self._statistics(duration)
+
+    def _statistics(self, duration):
+        statistics = {
+            "duration": duration,
+            "messages": self._subscriber.read_count,
+            "messages_per_second":
+                self._subscriber.read_count / duration if duration else None,
+            "filtered": self._subscriber.filtered_count,
+            "lag": self._subscriber.lag.to_dict(),
+            "written": self._pusher.count if self._pusher else 0,
+            "captured_written": self._captured_writes,
+            "registered": sum(
+                1 for robot in self._program.robots.values()
+                if robot.registered),
+        }
+        profiler = self._program.profiler
+        if profiler is not None:
+            statistics["profile"] = profiler.to_dict()
+        return statistics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", help="Capture file to replay.")
+    parser.add_argument(
+        "--speed",
+        help="1 to replay in real time, N to go N times faster, 0 to go as "
+        "fast as possible.",
+        default=1.0,
+        type=float)
+    parser.add_argument(
+        "--robot",
+        dest="robot_ids",
+        help="Id of a robot of the capture (can be repeated).",
+        action="append",
+        default=None)
+    parser.add_argument(
+        "--wire-mode",
+        help="How the captured messages are read (see the proxy).",
+        choices=[mode.name for mode in WireMode],
+        default=WireMode.single.name)
+    parser.add_argument(
+        "--max-reads-per-step",
+        help="The maximum number of messages read in one step (0 for no "
+        "limit).",
+        default=64,
+        type=int)
+    parser.add_argument(
+        "--input-coalescing",
+        help="Only use the newest input of a robot read in one step.",
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        "--profile",
+        help="Time the phases of the steps (see the proxy).",
+        default=False,
+        action="store_true")
+    arguments = parser.parse_args()
+    replay_arguments = ReplayArguments()
+    replay_arguments.wire_mode = arguments.wire_mode
+    replay_arguments.max_reads_per_step = arguments.max_reads_per_step
+    replay_arguments.input_coalescing = arguments.input_coalescing
+    replay_arguments.profile = arguments.profile
+    replay = Replay(
+        read_capture(arguments.capture),
+        arguments.robot_ids or ['951'],
+        arguments.speed,
+        replay_arguments)
+    print(json.dumps(replay.run(), indent=2))
+
+
+if "__main__" == __name__:
+    main()
@@ -1,14 +1,27 @@
 import logging
 
 from orwell.proxy_robots.action import Action
+from orwell.proxy_robots.backoff import Backoff
+from orwell.proxy_robots.devices import MoveFireAdapter
+from orwell.proxy_robots.metrics import METRICS
 from orwell.proxy_robots.proxy import Proxy
 from orwell.proxy_robots.registry import Messages
 from orwell.proxy_robots.registry import REGISTRY
 
 LOGGER = logging.getLogger(__name__)
+INPUTS = METRICS.counter(
+    "proxy_robot_inputs_total", "Inputs received for a robot.", "robot_id")
+COMMANDS = METRICS.counter(
+    "proxy_robot_commands_total",
+    "State updates applied to the device of a robot.",
+    "robot_id")
 
 
 class Robot(object):
+    # time (in seconds) to wait for the reply to a registration before
+    # sending it again
+    REGISTER_TIMEOUT = 5.0
+
     def __init__(
             self,
             robot_id,
@@ -19,12 +32,15 @@ class Robot(object):
         `robot_id`: identifies the robot somehow.
         `message_hub_wrapper`: used to post message and get notifications.
         `engine`: object that will run the actions for the robot.
-        `device`: device used to communicate with the robot.
+        `device`: device used to communicate with the robot. Devices without
+            #apply_state are wrapped in a #MoveFireAdapter.
         """
         self._robot_id = robot_id
         # self._name = ''
         self._message_hub_wrapper = message_hub_wrapper
         self._engine = engine
+        if not hasattr(device, "apply_state"):
+            device = MoveFireAdapter(device)
         self._device = device
         self._registered = False
         self._left = 0.0
@@ -35,11 +51,36 @@ class Robot(object):
         self._previous_right = 0.0
         self._previous_fire1 = False
         self._previous_fire2 = False
+        self._input_callback = None
+        self._change_callback = None
+        # number of inputs received
+        self._input_count = 0
+        # action (and its proxy) registering the robot
+        self._register_action = None
+        self._register_proxy = None
+        # changes when what #to_dict returns changes
+        self._version = 0
+        self._address = None
+        # id the metrics are labelled with
+        self._metrics_id = None
+        self._set_metrics()
 
     @property
     def robot_id(self):
         return self._robot_id
 
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def device_state(self):
+        """
+        What the robot last told about itself (None if the device does not
+        keep track of it).
+        """
+        return getattr(self._device, "state", None)
+
     # @property
     # def name(self):
     # return self._name
@@ -60,18 +101,71 @@ class Robot(object):
     def fire2(self):
         return self._fire2
 
+    @property
+    def input_count(self):
+        """
+        Number of inputs received (changes when #left, #right, #fire1 or
+        #fire2 may have changed).
+        """
+        return self._input_count
+
+    def _set_metrics(self):
+        """
+        Get the metrics of the robot (its id changes on registration, the
+        metrics of the previous id are no longer exported).
+        """
+        if self._metrics_id is not None and self._metrics_id != self._robot_id:
+            INPUTS.remove(self._metrics_id)
+            COMMANDS.remove(self._metrics_id)
+        self._metrics_id = self._robot_id
+        self._inputs_metric = INPUTS.labels(self._robot_id)
+        self._commands_metric = COMMANDS.labels(self._robot_id)
+
+    @property
+    def version(self):
+        """
+        Incremented when the robot registers or its address changes (the
+        address is checked by #step, once the device has read its messages).
+        """
+        return self._version
+
+    def _changed(self):
+        self._version += 1
+        if self._change_callback:
+            self._change_callback()
+
     def step(self):
         if self._device.ready():
             if ((self._previous_left != self._left) or
-                    (self._previous_right != self._right)):
-                self._device.move(self._left, self._right)
+                    (self._previous_right != self._right) or
+                    (self._previous_fire1 != self._fire1) or
+                    (self._previous_fire2 != self._fire2)):
+                # one update of the device for both moves and fires
+                self._device.apply_state(
+                    self._left, self._right, self._fire1, self._fire2)
+                self._commands_metric.inc()
                 self._previous_left = self._left
                 self._previous_right = self._right
-            if ((self._previous_fire1 != self._fire1) or
-                    (self._previous_fire2 != self._fire2)):
-                self._device.fire(self._fire1, self._fire2)
                 self._previous_fire1 = self._fire1
                 self._previous_fire2 = self._fire2
+        # not all the devices know the address of their robot
+        address = getattr(self._device, "address", None)
+        if address != self._address:
+            self._address = address
+            self._changed()
+
+    def set_input_callback(self, callback):
+        """
+        `callback`: function called without arguments after each input (for
+            instance to step the robot right away).
+        """
+        self._input_callback = callback
+
+    def set_change_callback(self, callback):
+        """
+        `callback`: function called without arguments when #version changes.
+        """
+        self._change_callback = callback
 
     @property
     def registered(self):
@@ -101,9 +195,36 @@ class Robot(object):
             self.send_register,
             lambda: self.registered,
             proxy,
-            repeat=True)
+            repeat=True,
+            backoff=Backoff(initial=0.05, maximum=2.0),
+            timeout=Robot.REGISTER_TIMEOUT)
+        self._register_action = action
+        self._register_proxy = proxy
         self._engine.add_action(action)
 
+    def release(self):
+        """
+        Stop listening to the inputs of the robot (to be called when the robot
+        goes away).
+        """
+        if self._registered and self._message_hub_wrapper.is_valid:
+            self._message_hub_wrapper.message_hub.unregister_listener(
+                self, Messages.Input.name, self._robot_id)
+
+    def remove(self):
+        """
+        Stop registering and listening to the messages of the robot (to be
+        called when the robot is removed from the program).
+        """
+        if self._register_action is not None:
+            self._engine.remove_action(self._register_action)
+            self._message_hub_wrapper.unregister_waiter(self._register_proxy)
+            self._register_action = None
+            self._register_proxy = None
+        self.release()
+        INPUTS.remove(self._robot_id)
+        COMMANDS.remove(self._robot_id)
+
     def send_register(self):
         """
         Post a message to ask for the registration of the robot.
@@ -112,11 +233,8 @@ class Robot(object):
             message = REGISTRY[Messages.Register.name]()
             message.temporary_robot_id = self._robot_id
             message.image = "no image"
-            payload = '{0} {1} '.format(
-                self._robot_id,
-                Messages.Register.name).encode()
-            payload += message.SerializeToString()
-            self._message_hub_wrapper.message_hub.post(payload)
+            self._message_hub_wrapper.message_hub.post_message(
+                self._robot_id, Messages.Register.name, message)
             return True
         return False
 
@@ -128,7 +246,8 @@ class Robot(object):
         """
         Notifications dispatcher.
         """
-        LOGGER.info("notify message_type: " + str(message_type))
+        # one record per input, so not at the info level
+        LOGGER.debug("notify message_type: %s", message_type)
         assert (self._robot_id == routing_id)
         if Messages.Registered.name == message_type:
             self._notify_registered(message)
@@ -142,8 +261,12 @@ class Robot(object):
         Flag the robot as registered if the server replied with a name.
         """
         LOGGER.info("Registered")
+        # the inputs of the previous id are no longer of interest
+        self.release()
         self._registered = True
         self._robot_id = message.robot_id
+        self._set_metrics()
+        self._changed()
         if self._message_hub_wrapper.is_valid:
             # this is a hack as we should only register when the game starts
             self._message_hub_wrapper.message_hub.register_listener(
@@ -166,11 +289,15 @@ class Robot(object):
         """
         Make the robot move.
         """
-        LOGGER.debug('_notify_input({0})'.format(message))
+        LOGGER.debug('_notify_input(%s)', message)
         self._left = message.move.left
         self._right = message.move.right
         self._fire1 = message.fire.weapon1
         self._fire2 = message.fire.weapon2
+        self._input_count += 1
+        self._inputs_metric.inc()
+        if self._input_callback:
+            self._input_callback()
 
     # def move(self, left, right):
     # """
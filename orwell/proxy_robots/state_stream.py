@@ -0,0 +1,140 @@
+import json
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+# topics of the messages published (first frame)
+DELTA_TOPIC = b"delta"
+KEYFRAME_TOPIC = b"keyframe"
+# fields of the state of a robot published
+FIELDS = (
+    "robot_id",
+    "registered",
+    "address",
+    "left",
+    "right",
+    "fire1",
+    "fire2",
+    "last_seen")
+
+
+def robot_state(robot):
+    """
+    Return the values of FIELDS for #robot.
+    """
+    device_state = robot.device_state
+    address = robot.device.address
+    return (
+        robot.robot_id,
+        robot.registered,
+        list(address) if isinstance(address, tuple) else address,
+        robot.left,
+        robot.right,
+        robot.fire1,
+        robot.fire2,
+        device_state.last_seen if device_state is not None else None)
+
+
+def robot_version(robot):
+    """
+    Return a value that changes when the state of #robot (see #robot_state)
+    may have changed, cheaper to get than the state.
+    """
+    device_state = robot.device_state
+    return (
+        robot.version,
+        robot.input_count,
+        device_state.datagrams if device_state is not None else None)
+
+
+class StateStream(object):
+    """
+    Publish the changes of the state of the robots (deltas with only the
+    fields that changed) and periodically the full state of every robot
+    (keyframes) so that clients joining late can catch up.
+
+    Each message is a topic frame and a json frame with a sequence number
+    (clients missing one should wait for the next keyframe). The state of
+    a robot is only read again when its version changes (see
+    #robot_version).
+    """
+
+    def __init__(
+            self,
+            publisher,
+            program,
+            min_interval=0.1,
+            keyframe_interval=5.0,
+            clock=time.monotonic):
+        """
+        `publisher`: object with a #publish method taking a topic and a
+            payload (see AdminPublisher).
+        `program`: gives the robots (by the id they were added with).
+        `min_interval`: shortest time (in seconds) between two deltas of a
+            robot ; the changes in between are sent together.
+        `keyframe_interval`: time (in seconds) between two keyframes.
+        """
+        self._publisher = publisher
+        self._program = program
+        self._min_interval = min_interval
+        self._keyframe_interval = keyframe_interval
+        self._clock = clock
+        self._sequence = 0
+        self._next_keyframe = None
+        # robot key -> state published (as sent in keyframes and deltas)
+        self._published = {}
+        # robot key -> time of the last delta
+        self._last_sent = {}
+        # robot key -> version of the state published
+        self._versions = {}
+
+    def step(self):
+        now = self._clock()
+        robots = self._program.robots
+        if self._next_keyframe is None or now >= self._next_keyframe:
+            self._publish_keyframe(robots, now)
+            return
+        for key in [key for key in self._published if key not in robots]:
+            del self._published[key]
+            self._last_sent.pop(key, None)
+            self._versions.pop(key, None)
+            self._publish(DELTA_TOPIC, {"robot": key, "removed": True})
+        for key, robot in robots.items():
+            version = robot_version(robot)
+            if version == self._versions.get(key):
+                continue
+            if now - self._last_sent.get(key, -self._min_interval) < \
+                    self._min_interval:
+                continue
+            self._versions[key] = version
+            state = robot_state(robot)
+            published = self._published.get(key)
+            if state == published:
+                continue
+            if published is None:
+                changes = dict(zip(FIELDS, state))
+            else:
+                changes = {
+                    field: value
+                    for field, value, previous in zip(FIELDS, state, published)
+                    if value != previous}
+            self._published[key] = state
+            self._last_sent[key] = now
+            self._publish(DELTA_TOPIC, {"robot": key, "changes": changes})
+
+    def _publish_keyframe(self, robots, now):
+        self._versions = {
+            key: robot_version(robot) for key, robot in robots.items()}
+        self._published = {
+            key: robot_state(robot) for key, robot in robots.items()}
+        self._last_sent = dict.fromkeys(robots, now)
+        self._next_keyframe = now + self._keyframe_interval
+        self._publish(KEYFRAME_TOPIC, {
+            "robots": {
+                key: dict(zip(FIELDS, state))
+                for key, state in self._published.items()}})
+
+    def _publish(self, topic, payload):
+        self._sequence += 1
+        payload["sequence"] = self._sequence
+        self._publisher.publish(topic, json.dumps(payload).encode())
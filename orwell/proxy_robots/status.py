@@ -12,3 +12,7 @@ class Status(Enum):
     failed = 3
     # action successful
     successful = 4
+    # action called, but the reply did not come in time
+    timed_out = 5
+    # action called, but abandoned (for instance the message hub went away)
+    cancelled = 6
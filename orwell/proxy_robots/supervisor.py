@@ -0,0 +1,308 @@
+import ast
+import copy
+import json
+import logging
+import multiprocessing
+import signal
+import sys
+import zmq
+
+from orwell_common.broadcast_listener import BroadcastListener
+import orwell_common.logging
+
+from orwell.proxy_robots.admin import Admin
+from orwell.proxy_robots.connectors import AdminSocket
+from orwell.proxy_robots.log_sampling import enable_sampled_debug
+from orwell.proxy_robots.provisioning import DeviceFactory
+from orwell.proxy_robots.provisioning import DeviceType
+from orwell.proxy_robots.provisioning import RobotDescription
+
+LOGGER = logging.getLogger(__name__)
+# time (in milliseconds) to wait for the reply of a worker to an admin command
+WORKER_TIMEOUT = 1000
+# time (in milliseconds) to wait for admin commands before checking workers
+POLL_TIMEOUT = 500
+
+
+def split_robots(robots, worker_count):
+    """
+    Return the robots (list of (robot id, port)) each worker handles.
+    """
+    return [robots[index::worker_count] for index in range(worker_count)]
+
+
+def merge_list_robot(replies):
+    """
+    Merge the replies of the workers to Admin.LIST_ROBOT.
+    """
+    robot_ids = []
+    for reply in replies:
+        robot_ids.extend(ast.literal_eval(reply))
+    return str(robot_ids)
+
+
+def merge_json(replies):
+    """
+    Merge the replies of the workers to the json commands (dictionaries
+    indexed by robot id).
+    """
+    response = {}
+    for reply in replies:
+        response.update(json.loads(reply))
+    return json.dumps(response)
+
+
+def merge_json_list(replies):
+    """
+    Merge the replies of the workers to the json commands about the workers
+    themselves (list of the replies).
+    """
+    return json.dumps([json.loads(reply) for reply in replies])
+
+
+def merge_version(replies):
+    """
+    Merge the replies of the workers to Admin.VERSION (it changes when the
+    version of a worker changes).
+    """
+    return str(sum(int(reply) for reply in replies))
+
+
+MERGERS = {
+    Admin.LIST_ROBOT: merge_list_robot,
+    Admin.JSON_LIST_ROBOT: merge_json,
+    Admin.JSON_ROBOT_STATE: merge_json,
+    Admin.JSON_WRITER: merge_json_list,
+    Admin.JSON_PROFILE: merge_json_list,
+    Admin.VERSION: merge_version,
+}
+
+
+def _run_worker(arguments, admin_port, robots):
+    """
+    Entry point of a worker process: a Program handling #robots (list of
+    (robot id, port)) with its own message hub and an admin socket bound
+    to #admin_port. The worker is spawned: its zmq context and the sockets
+    of its robots are created here.
+    """
+    # imported here to avoid a circular import (program imports this module)
+    from orwell.proxy_robots import program as program_module
+    orwell_common.logging.configure_logging(arguments.verbose)
+    if arguments.debug_sampling:
+        enable_sampled_debug(arguments.debug_sampling)
+    worker_arguments = copy.copy(arguments)
+    worker_arguments.admin_port = admin_port
+    # the supervisor tells the robots which ports to use
+    worker_arguments.no_proxy_broadcast = True
+    # the workers are daemons terminated with the supervisor: exit normally
+    # so that the program is stopped (and its capture written)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    program = program_module.Program(zmq.Context(), worker_arguments)
+    device_factory = DeviceFactory()
+    for robot_id, port in robots:
+        if port:
+            description = RobotDescription(robot_id, DeviceType.harpi, port)
+        else:
+            description = RobotDescription(robot_id, DeviceType.fake)
+        program.add_robot(
+            robot_id, device_factory.create(description), batched=True)
+    # the program is stopped by run
+    program_module.run(program, arguments.reactor, arguments.use_asyncio)
+
+
+class Worker(object):
+    """
+    A worker process and the socket used to send it admin commands.
+    """
+
+    def __init__(self, zmq_context, arguments, admin_port, robots):
+        self._zmq_context = zmq_context
+        self._arguments = arguments
+        self._admin_port = admin_port
+        self._robots = robots
+        self._process = None
+        self._socket = None
+
+    @property
+    def robots(self):
+        return self._robots
+
+    def start(self):
+        # spawn rather than fork: the zmq context and the threads of the
+        # supervisor must not be copied (the robot sockets are bound again
+        # by the worker)
+        context = multiprocessing.get_context("spawn")
+        self._process = context.Process(
+            target=_run_worker,
+            args=(self._arguments, self._admin_port, self._robots),
+            daemon=True)
+        self._process.start()
+        if self._socket is None:
+            self._socket = self._zmq_context.socket(zmq.REQ)
+            self._socket.setsockopt(zmq.LINGER, 0)
+            self._socket.setsockopt(zmq.RCVTIMEO, WORKER_TIMEOUT)
+            # a timed out request must not prevent the next ones
+            self._socket.setsockopt(zmq.REQ_RELAXED, 1)
+            self._socket.setsockopt(zmq.REQ_CORRELATE, 1)
+            self._socket.connect(
+                "tcp://127.0.0.1:{port}".format(port=self._admin_port))
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def exchange(self, command):
+        """
+        Send an admin command and return the reply (None on timeout).
+        """
+        self._socket.send_string(command)
+        try:
+            return self._socket.recv_string()
+        except zmq.error.Again:
+            LOGGER.warning(
+                "Worker on port %s did not reply to %s",
+                self._admin_port, command)
+            return None
+
+
+class Supervisor(object):
+    """
+    Spread the robots over several worker processes (each with its own
+    message hub, engine and admin socket) and serve a single admin endpoint
+    merging the replies of the workers. A robot added by the admin goes to
+    the worker with the fewest robots and is removed by the worker it went
+    to (shared robots are not supported: there is no multiplexer).
+    """
+
+    def __init__(
+            self,
+            zmq_context,
+            arguments,
+            robots,
+            admin_socket_type=AdminSocket):
+        """
+        `arguments`: see #Program ; worker_count is the number of workers.
+            The workers bind their admin socket to the ports following
+            admin_port.
+        `robots`: list of (robot id, UDP port or None if there is no
+            device). The ports must not be bound in the supervisor.
+        """
+        self._admin_socket = admin_socket_type(arguments.admin_port, zmq_context)
+        self._workers = []
+        # robot id -> worker handling the robot
+        self._robot_workers = {}
+        for index, worker_robots in enumerate(
+                split_robots(robots, arguments.worker_count)):
+            admin_port = arguments.admin_port + 1 + index
+            worker_arguments = copy.copy(arguments)
+            if arguments.admin_stream_port:
+                # each worker publishes the state of its robots
+                worker_arguments.admin_stream_port = \
+                    arguments.admin_stream_port + index
+            if arguments.capture:
+                # each worker captures its own traffic
+                worker_arguments.capture = "{0}.{1}".format(
+                    arguments.capture, index)
+            worker = Worker(
+                zmq_context, worker_arguments, admin_port, worker_robots)
+            self._workers.append(worker)
+            for robot_id, _ in worker_robots:
+                self._robot_workers[robot_id] = worker
+        if not arguments.no_proxy_broadcast:
+            self._broadcast_listener = BroadcastListener(
+                arguments.proxy_broadcast_port,
+                arguments.admin_port)
+            for _, port in robots:
+                if port:
+                    self._broadcast_listener.add_socket_port(port)
+        else:
+            self._broadcast_listener = None
+
+    def _handle_admin_message(self, admin_message):
+        LOGGER.debug("received admin command: %s", admin_message)
+        if admin_message.startswith(Admin.ADD_ROBOT + " "):
+            self._admin_socket.write(self._add_robot(admin_message))
+            return
+        if admin_message.startswith(Admin.REMOVE_ROBOT + " "):
+            self._admin_socket.write(self._remove_robot(admin_message))
+            return
+        merge = MERGERS.get(admin_message)
+        if merge is None:
+            self._admin_socket.write(
+                Admin.UNKNOWN_COMMAND.format(command=admin_message))
+            return
+        replies = []
+        for worker in self._workers:
+            reply = worker.exchange(admin_message)
+            if reply is not None:
+                replies.append(reply)
+        self._admin_socket.write(merge(replies))
+
+    def _add_robot(self, admin_message):
+        arguments = admin_message[len(Admin.ADD_ROBOT):].split()
+        if not arguments:
+            return Admin.COMMAND_FAILED.format(error="missing robot id")
+        robot_id = arguments[0]
+        if robot_id in self._robot_workers:
+            return Admin.COMMAND_FAILED.format(
+                error="robot {0} already added".format(robot_id))
+        if len(arguments) > 1 and DeviceType.shared.name == arguments[1]:
+            return Admin.COMMAND_FAILED.format(
+                error="shared robots cannot be used with several workers")
+        worker = min(self._workers, key=self._robot_count)
+        reply = worker.exchange(admin_message)
+        if reply is None:
+            return Admin.COMMAND_FAILED.format(error="no reply from worker")
+        if Admin.ROBOT_ADDED.format(robot_id=robot_id) == reply:
+            self._robot_workers[robot_id] = worker
+        return reply
+
+    def _remove_robot(self, admin_message):
+        robot_id = admin_message[len(Admin.REMOVE_ROBOT):].strip()
+        if not robot_id:
+            return Admin.COMMAND_FAILED.format(error="missing robot id")
+        worker = self._robot_workers.get(robot_id)
+        if worker is None:
+            return Admin.COMMAND_FAILED.format(
+                error="unknown robot {0}".format(robot_id))
+        reply = worker.exchange(admin_message)
+        if reply is None:
+            return Admin.COMMAND_FAILED.format(error="no reply from worker")
+        if Admin.ROBOT_REMOVED.format(robot_id=robot_id) == reply:
+            del self._robot_workers[robot_id]
+        return reply
+
+    def _robot_count(self, worker):
+        return sum(
+            1 for robot_worker in self._robot_workers.values()
+            if robot_worker is worker)
+
+    def _check_workers(self):
+        for worker in self._workers:
+            if not worker.is_alive():
+                LOGGER.error(
+                    "Worker for robots %s died, restart it",
+                    [robot_id for robot_id, _ in worker.robots])
+                worker.start()
+                # the restarted worker only has the robots it started with
+                for robot_id, robot_worker in list(
+                        self._robot_workers.items()):
+                    if robot_worker is worker:
+                        del self._robot_workers[robot_id]
+                for robot_id, _ in worker.robots:
+                    self._robot_workers[robot_id] = worker
+
+    def run(self):
+        for worker in self._workers:
+            worker.start()
+        if self._broadcast_listener:
+            self._broadcast_listener.start()
+        poller = zmq.Poller()
+        poller.register(self._admin_socket.socket, zmq.POLLIN)
+        while True:
+            if poller.poll(POLL_TIMEOUT):
+                while True:
+                    admin_message = self._admin_socket.read()
+                    if admin_message is None:
+                        break
+                    self._handle_admin_message(admin_message)
+            self._check_workers()
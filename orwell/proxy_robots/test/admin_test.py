@@ -1,7 +1,11 @@
 from orwell.proxy_robots.admin import Admin
+from orwell.proxy_robots.metrics import METRICS
+from orwell.proxy_robots.provisioning import DeviceType
 from unittest import mock
 import json
 
+from nose.tools import assert_equals
+
 
 def test_list_robot():
     zmq_context =  mock.MagicMock()
@@ -37,3 +41,151 @@ def test_json_list_robot():
     admin._handle_admin_message("json list robot")
     merged_robots = {**robot_dict1, **robot_dict2}
     admin_socket.write.assert_called_once_with(json.dumps(merged_robots))
+
+
+def test_json_robot_state():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    robot1 = mock.MagicMock()
+    robot1.robot_id = "1"
+    robot1.device_state.to_dict.return_value = {"battery": 50.0}
+    robot2 = mock.MagicMock()
+    robot2.robot_id = "2"
+    robot2.device_state = None
+    program.robots = {robot1.robot_id: robot1, robot2.robot_id: robot2}
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("json robot state")
+    expected = {"1": {"battery": 50.0}, "2": None}
+    admin_socket.write.assert_called_once_with(json.dumps(expected))
+
+
+def test_json_writer():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    program.writer = None
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("json writer")
+    admin_socket.write.assert_called_once_with("null")
+
+
+def test_metrics():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("metrics")
+    admin_socket.write.assert_called_once_with(METRICS.export())
+    exported = admin_socket.write.call_args[0][0]
+    assert "# TYPE proxy_device_datagrams_sent_total counter" in exported
+
+
+def test_unknown_command():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("dance")
+    admin_socket.write.assert_called_once_with("unknown command: dance")
+
+
+def test_step_handles_all_requests():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    program.robots = {}
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin_socket.read.side_effect = ["list robot", "version", None]
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin.step()
+    assert_equals(
+        [mock.call("[]"), mock.call("1")],
+        admin_socket.write.call_args_list)
+
+
+def test_step_caps_requests():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    program.robots = {}
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin_socket.read.side_effect = ["list robot"] * 3 + [None]
+    admin = Admin(
+        zmq_context, program, 9082, admin_socket, max_requests_per_step=2)
+    admin.step()
+    assert_equals(2, admin_socket.write.call_count)
+    # the next step handles what is left
+    admin.step()
+    assert_equals(3, admin_socket.write.call_count)
+
+
+def test_snapshot_rebuilt_on_change():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    robot = mock.MagicMock()
+    robot.robot_id = "1"
+    robot.to_dict.return_value = {"1": {"address": ""}}
+    program.robots = {"1": robot}
+    program.state_version = 1
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("json list robot")
+    admin._handle_admin_message("json list robot")
+    assert_equals(1, robot.to_dict.call_count)
+    robot.to_dict.return_value = {"1": {"address": "1.2.3.4"}}
+    program.state_version = 2
+    admin._handle_admin_message("json list robot")
+    admin_socket.write.assert_called_with(
+        json.dumps({"1": {"address": "1.2.3.4"}}))
+    admin._handle_admin_message("version")
+    admin_socket.write.assert_called_with("2")
+
+
+def test_add_robot():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("add robot 952 harpi 10952")
+    description = program.provision_robot.call_args[0][0]
+    assert_equals(
+        ("952", DeviceType.harpi, 10952),
+        (description.robot_id, description.device_type, description.port))
+    admin_socket.write.assert_called_once_with("robot added: 952")
+    admin_socket.reset_mock()
+    admin._handle_admin_message("add robot ")
+    admin_socket.write.assert_called_once_with("error: missing robot id")
+    admin_socket.reset_mock()
+    admin._handle_admin_message("add robot 953 unknown")
+    admin_socket.write.assert_called_once_with(
+        "error: invalid argument 'unknown'")
+    admin_socket.reset_mock()
+    program.provision_robot.side_effect = ValueError("Robot 952 already exists")
+    admin._handle_admin_message("add robot 952")
+    admin_socket.write.assert_called_once_with(
+        "error: Robot 952 already exists")
+
+
+def test_remove_robot():
+    zmq_context = mock.MagicMock()
+    program = mock.MagicMock()
+    program.robots = {"951": mock.MagicMock()}
+    admin_socket = mock.MagicMock()
+    admin_socket.return_value = admin_socket
+    admin = Admin(zmq_context, program, 9082, admin_socket)
+    admin._handle_admin_message("remove robot 951")
+    program.remove_robot.assert_called_once_with("951")
+    admin_socket.write.assert_called_once_with("robot removed: 951")
+    admin_socket.reset_mock()
+    admin._handle_admin_message("remove robot 952")
+    admin_socket.write.assert_called_once_with("error: unknown robot 952")
+    admin_socket.reset_mock()
+    admin._handle_admin_message("remove robot  ")
+    admin_socket.write.assert_called_once_with("error: missing robot id")
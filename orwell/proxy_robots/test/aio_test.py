@@ -0,0 +1,59 @@
+import asyncio
+from unittest import mock
+
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+from orwell.proxy_robots.action import Action
+from orwell.proxy_robots.aio import DeviceProtocol
+from orwell.proxy_robots.aio import wait_for_action
+from orwell.proxy_robots.engine import Engine
+from orwell.proxy_robots.status import Status
+
+
+async def _step_engine(engine):
+    while True:
+        engine.step()
+        await asyncio.sleep(0)
+
+
+def test_wait_for_action():
+    async def scenario():
+        engine = Engine()
+        stepper = asyncio.ensure_future(_step_engine(engine))
+        proxy = mock.MagicMock()
+        proxy.message_type = "Registered"
+        proxy.routing_id = "1"
+        action = Action(lambda: True, lambda: True, proxy)
+        waiter = asyncio.ensure_future(wait_for_action(engine, action, 1.0))
+        while Status.pending != action.status:
+            await asyncio.sleep(0)
+        assert_true(not waiter.done())
+        action.notify("Registered", "1", None)
+        status = await waiter
+        stepper.cancel()
+        return status
+
+    # the status of an action with a proxy stays waiting once notified
+    assert_equals(Status.waiting, asyncio.run(scenario()))
+
+
+def test_wait_for_failed_action():
+    async def scenario():
+        engine = Engine()
+        stepper = asyncio.ensure_future(_step_engine(engine))
+        status = await wait_for_action(
+            engine, Action(lambda: False, lambda: True), 1.0)
+        stepper.cancel()
+        return status
+
+    assert_equals(Status.failed, asyncio.run(scenario()))
+
+
+def test_device_protocol():
+    device = mock.MagicMock()
+    wake_up = mock.MagicMock()
+    protocol = DeviceProtocol(device, wake_up)
+    protocol.datagram_received(b"robot", ("127.0.0.1", 1))
+    device.receive.assert_called_once_with(b"robot", ("127.0.0.1", 1))
+    wake_up.assert_called_once_with()
@@ -0,0 +1,121 @@
+import os
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equals
+from nose.tools import assert_false
+from nose.tools import assert_is_none
+from nose.tools import assert_true
+
+from orwell.proxy_robots.capture import CaptureWriter
+from orwell.proxy_robots.capture import Direction
+from orwell.proxy_robots.capture import ReplaySubscriber
+from orwell.proxy_robots.capture import read_capture
+from orwell.proxy_robots.test.fake_clock import FakeClock
+
+
+class FakeFrame(object):
+    def __init__(self, data):
+        self.buffer = memoryview(data)
+
+
+def _capture_path():
+    capture_file = tempfile.NamedTemporaryFile(suffix=".cap", delete=False)
+    capture_file.close()
+    os.remove(capture_file.name)
+    return capture_file.name
+
+
+def test_capture_and_read():
+    path = _capture_path()
+    clock = FakeClock()
+    try:
+        capture = CaptureWriter(path, clock)
+        subscriber = mock.MagicMock()
+        subscriber.read.side_effect = [b"951 Input abc", None]
+        subscriber.read_multipart.return_value = [
+            FakeFrame(b"951"), FakeFrame(b"Input"), FakeFrame(b"")]
+        pusher = mock.MagicMock()
+        capturing_subscriber = capture.wrap_subscriber_type(
+            lambda address, context: subscriber)(None, None)
+        capturing_pusher = capture.wrap_pusher_type(
+            lambda address, context: pusher)(None, None)
+        assert_equals(b"951 Input abc", capturing_subscriber.read())
+        assert_is_none(capturing_subscriber.read())
+        clock.now += 0.5
+        capturing_pusher.write(b"951 Register xyz")
+        capturing_subscriber.read_multipart()
+        # forwarded
+        capturing_subscriber.subscribe(b"951 ")
+        subscriber.subscribe.assert_called_once_with(b"951 ")
+        pusher.write.assert_called_once_with(b"951 Register xyz")
+        capture.close()
+        # appended to
+        capture = CaptureWriter(path, clock)
+        capture.record(Direction.outbound.value, (b"a", b"b"))
+        capture.close()
+        assert_equals(
+            [(100.0, Direction.inbound, [b"951 Input abc"]),
+             (100.5, Direction.outbound, [b"951 Register xyz"]),
+             (100.5, Direction.inbound, [b"951", b"Input", b""]),
+             (100.5, Direction.outbound, [b"a", b"b"])],
+            list(read_capture(path)))
+    finally:
+        os.remove(path)
+
+
+def test_truncated_capture():
+    path = _capture_path()
+    try:
+        capture = CaptureWriter(path, FakeClock())
+        capture.record(Direction.inbound.value, (b"complete",))
+        capture.record(Direction.inbound.value, (b"cut",))
+        capture.close()
+        with open(path, "r+b") as capture_file:
+            capture_file.truncate(os.path.getsize(path) - 2)
+        assert_equals(
+            [(100.0, Direction.inbound, [b"complete"])],
+            list(read_capture(path)))
+    finally:
+        os.remove(path)
+
+
+def test_replay_pace():
+    clock = FakeClock()
+    records = [
+        (10.0, Direction.inbound, [b"951 Input a"]),
+        (10.5, Direction.outbound, [b"951 Register b"]),
+        (11.0, Direction.inbound, [b"951 Input c"]),
+    ]
+    subscriber = ReplaySubscriber(records, speed=2.0, clock=clock)
+    assert_is_none(subscriber.read())
+    subscriber.start()
+    assert_equals(0, subscriber.time_to_next())
+    assert_equals(b"951 Input a", subscriber.read())
+    assert_is_none(subscriber.read())
+    assert_false(subscriber.has_pending())
+    assert_equals(0.5, subscriber.time_to_next())
+    clock.now += 0.6
+    assert_true(subscriber.has_pending())
+    assert_equals(b"951 Input c", subscriber.read())
+    assert_true(subscriber.exhausted)
+    assert_is_none(subscriber.time_to_next())
+    assert_equals(2, subscriber.read_count)
+    assert_equals(0.1, round(subscriber.lag.to_dict()["max"], 6))
+
+
+def test_replay_max_speed_and_subscriptions():
+    records = [
+        (10.0, Direction.inbound, [b"951", b"Input", b"a"]),
+        (20.0, Direction.inbound, [b"952", b"Input", b"b"]),
+        (30.0, Direction.inbound, [b"951", b"Input", b"c"]),
+    ]
+    subscriber = ReplaySubscriber(records, speed=0, clock=FakeClock())
+    subscriber.start()
+    subscriber.unsubscribe(b"")
+    subscriber.subscribe(b"951")
+    frames = subscriber.read_multipart()
+    assert_equals([b"951", b"Input", b"a"], [frame.bytes for frame in frames])
+    assert_equals(b"951 Input c", subscriber.read())
+    assert_equals(1, subscriber.filtered_count)
+    assert_is_none(subscriber.read())
@@ -0,0 +1,61 @@
+import time
+
+import zmq
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+
+from orwell.proxy_robots.connectors import Replier
+from orwell.proxy_robots.test.fake_clock import FakeClock
+
+
+def _wait_for_requests(server, count):
+    requests = []
+    deadline = time.monotonic() + 2
+    while len(requests) < count and time.monotonic() < deadline:
+        if server.poll(100):
+            requests.append(server.recv_multipart())
+    return requests
+
+
+def _step_until(replier, done):
+    deadline = time.monotonic() + 2
+    while not done() and time.monotonic() < deadline:
+        replier.socket.poll(10)
+        replier.step()
+
+
+def test_replies_out_of_order():
+    context = zmq.Context()
+    server = context.socket(zmq.ROUTER)
+    server.bind("inproc://replier_test")
+    replier = Replier("inproc://replier_test", context)
+    replies = {}
+    replier.request(b"first", lambda reply: replies.update(first=reply))
+    future = replier.request_future(b"second")
+    assert_equals(2, replier.pending_count)
+    requests = _wait_for_requests(server, 2)
+    assert_equals([b"first", b"second"], [frames[-1] for frames in requests])
+    # the server answers the second request first
+    for frames in reversed(requests):
+        server.send_multipart(frames[:-1] + [frames[-1].upper()])
+    _step_until(replier, lambda: 0 == replier.pending_count)
+    assert_equals({"first": b"FIRST"}, replies)
+    assert_equals(b"SECOND", future.result(0))
+    replier.socket.close()
+    server.close()
+    context.term()
+
+
+def test_request_timeout():
+    context = zmq.Context()
+    clock = FakeClock(10.0)
+    replier = Replier("inproc://replier_timeout_test", context, clock)
+    future = replier.request_future(b"lost", timeout=1.0)
+    replier.step()
+    assert_equals(1, replier.pending_count)
+    clock.now += 1.0
+    replier.step()
+    assert_is_none(future.result(0))
+    assert_equals(0, replier.pending_count)
+    replier.socket.close()
+    context.term()
@@ -0,0 +1,136 @@
+from unittest import mock
+
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+from orwell.proxy_robots.devices import BINARY_COMMAND
+from orwell.proxy_robots.devices import BINARY_MAGIC
+from orwell.proxy_robots.devices import DeviceMultiplexer
+from orwell.proxy_robots.devices import HarpiDevice
+from orwell.proxy_robots.devices import MoveFireAdapter
+from orwell.proxy_robots.devices import Protocol
+
+ADDRESS = ("127.0.0.1", 4242)
+
+
+class DatagramSocket(object):
+    """
+    Fake socket returning the datagrams it is given then raising
+    BlockingIOError ; records what is sent.
+    """
+
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+        self.sendto = mock.MagicMock()
+
+    def recvfrom_into(self, buffer, size, flags):
+        if not self.datagrams:
+            raise BlockingIOError()
+        message, address = self.datagrams.pop(0)
+        buffer[:len(message)] = message
+        return len(message), address
+
+
+def create_device(first_message):
+    sock = DatagramSocket([(first_message, ADDRESS)])
+    device = HarpiDevice(sock)
+    assert_true(device.ready())
+    return device, sock
+
+
+def test_ascii_protocol():
+    device, sock = create_device(b"robot")
+    assert_equals(Protocol.ascii, device.protocol)
+    device.move(1.0, -0.5)
+    sock.sendto.assert_called_with(bytearray(b"move 255 -127"), ADDRESS)
+    device.fire(True, False)
+    sock.sendto.assert_called_with(bytearray(b"fire 1 0"), ADDRESS)
+
+
+def test_binary_protocol():
+    device, sock = create_device(b"robot binary")
+    assert_equals(Protocol.binary, device.protocol)
+    device.move(1.0, -0.5)
+    command = bytes(sock.sendto.call_args[0][0])
+    assert_equals((BINARY_MAGIC, 1, 127, -63, 0), BINARY_COMMAND.unpack(command))
+    device.fire(False, True)
+    command = bytes(sock.sendto.call_args[0][0])
+    assert_equals((BINARY_MAGIC, 2, 127, -63, 2), BINARY_COMMAND.unpack(command))
+
+
+def test_apply_state_binary():
+    device, sock = create_device(b"robot binary")
+    device.apply_state(0.5, 1.0, True, True)
+    assert_equals(1, sock.sendto.call_count)
+    command = bytes(sock.sendto.call_args[0][0])
+    assert_equals((BINARY_MAGIC, 1, 63, 127, 3), BINARY_COMMAND.unpack(command))
+
+
+def test_binary_speeds_clamped():
+    device, sock = create_device(b"robot binary")
+    device.apply_state(1.5, -3.0, False, False)
+    command = bytes(sock.sendto.call_args[0][0])
+    assert_equals((BINARY_MAGIC, 1, 127, -127, 0), BINARY_COMMAND.unpack(command))
+    device.move(-2.0, 2.0)
+    command = bytes(sock.sendto.call_args[0][0])
+    assert_equals((BINARY_MAGIC, 2, -127, 127, 0), BINARY_COMMAND.unpack(command))
+
+
+def test_apply_state_ascii():
+    device, sock = create_device(b"robot")
+    device.apply_state(0.5, 1.0, False, False)
+    sock.sendto.assert_called_once_with(bytearray(b"move 127 255"), ADDRESS)
+    sock.sendto.reset_mock()
+    device.apply_state(0.5, 1.0, True, False)
+    sock.sendto.assert_called_once_with(bytearray(b"fire 1 0"), ADDRESS)
+
+
+def test_move_fire_adapter():
+    device = mock.MagicMock(spec=["move", "fire", "ready"])
+    adapter = MoveFireAdapter(device)
+    adapter.apply_state(0.5, 1.0, False, False)
+    device.move.assert_called_once_with(0.5, 1.0)
+    device.fire.assert_not_called()
+    adapter.apply_state(0.5, 1.0, False, True)
+    device.fire.assert_called_once_with(False, True)
+    assert_equals(1, device.move.call_count)
+    assert_true(adapter.ready())
+
+
+def test_ready_reads_all_datagrams():
+    device, sock = create_device(b"robot")
+    sock.datagrams = [
+        (b"status battery=87 front=12.5", ADDRESS),
+        (b"status battery=oops", ADDRESS),
+        (b"status battery=86", ADDRESS),
+        (b"status battery=1", ("1.2.3.4", 1))]
+    assert_true(device.ready())
+    assert_equals([], sock.datagrams)
+    state = device.state
+    assert_equals(86.0, state.battery)
+    assert_equals({"front": 12.5}, state.sensors)
+    # the first message and the three from the robot
+    assert_equals(4, state.datagrams)
+
+
+def test_multiplexer():
+    sock = DatagramSocket([])
+    multiplexer = DeviceMultiplexer(sock)
+    device1 = multiplexer.create_device("1")
+    device2 = multiplexer.create_device("2")
+    address1 = ("127.0.0.1", 1001)
+    address2 = ("127.0.0.1", 1002)
+    sock.datagrams = [
+        (b"robot robot_id=2", address2),
+        (b"robot robot_id=3", ("127.0.0.1", 1003)),
+        (b"robot robot_id=1 binary", address1),
+        (b"status battery=10", address2)]
+    multiplexer.step()
+    assert_equals([], sock.datagrams)
+    assert_true(device1.ready())
+    assert_true(device2.ready())
+    assert_equals(address1, device1.address)
+    assert_equals(address2, device2.address)
+    assert_equals(Protocol.binary, device1.protocol)
+    assert_equals(10.0, device2.state.battery)
+    assert_equals(1, device1.state.datagrams)
@@ -0,0 +1,230 @@
+from unittest import mock
+
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+
+from orwell.proxy_robots.action import Action
+from orwell.proxy_robots.backoff import Backoff
+from orwell.proxy_robots.engine import Engine
+from orwell.proxy_robots.proxy import RequestProxy
+from orwell.proxy_robots.status import Status
+from orwell.proxy_robots.test.fake_clock import FakeClock
+
+
+def test_retry_with_backoff():
+    clock = FakeClock()
+    engine = Engine(clock)
+    doer = mock.MagicMock(return_value=False)
+    backoff = Backoff(initial=1.0, factor=2.0, maximum=3.0, jitter=0)
+    action = Action(doer, lambda: True, repeat=True, backoff=backoff)
+    engine.add_action(action)
+    assert_equals(0, engine.idle_timeout())
+    engine.step()
+    assert_equals(1, doer.call_count)
+    assert_equals(1.0, engine.idle_timeout())
+    clock.now += 0.5
+    engine.step()
+    assert_equals(1, doer.call_count)
+    clock.now += 0.5
+    engine.step()
+    assert_equals(2, doer.call_count)
+    assert_equals(2.0, engine.idle_timeout())
+    clock.now += 2.0
+    engine.step()
+    assert_equals(3, doer.call_count)
+    # the delay does not grow beyond the maximum
+    assert_equals(3.0, engine.idle_timeout())
+    doer.return_value = True
+    clock.now += 3.0
+    engine.step()
+    assert_equals(4, doer.call_count)
+    assert_equals(Status.successful, action.status)
+    assert_is_none(engine.idle_timeout())
+
+
+def test_pending_action_notified():
+    engine = Engine(FakeClock())
+    proxy = mock.MagicMock()
+    proxy.message_type = "Registered"
+    proxy.routing_id = "1"
+    action = Action(lambda: True, lambda: True, proxy, repeat=True)
+    engine.add_action(action)
+    engine.step()
+    assert_equals(Status.pending, action.status)
+    assert_equals(1, engine.pending_count)
+    assert_is_none(engine.idle_timeout())
+    action.notify("Registered", "1", None)
+    proxy.callback.assert_called_once_with("Registered", "1", None)
+    proxy.unregister.assert_called_once_with(action)
+    assert_equals(0, engine.idle_timeout())
+    engine.step()
+    assert_equals(0, engine.pending_count)
+    assert_equals(0, engine.retry_count)
+
+
+def test_pending_action_timeout():
+    clock = FakeClock()
+    engine = Engine(clock)
+    proxy = mock.MagicMock()
+    doer = mock.MagicMock(return_value=True)
+    backoff = Backoff(initial=1.0, jitter=0)
+    action = Action(
+        doer, lambda: True, proxy, repeat=True, backoff=backoff, timeout=2.0)
+    engine.add_action(action)
+    engine.step()
+    assert_equals(Status.pending, action.status)
+    assert_equals(2.0, engine.idle_timeout())
+    clock.now += 2.0
+    engine.step()
+    proxy.unregister.assert_called_once_with(action)
+    assert_equals(0, engine.pending_count)
+    assert_equals(1, engine.retry_count)
+    clock.now += 1.0
+    engine.step()
+    assert_equals(2, doer.call_count)
+    # the listener is registered again for the new attempt
+    assert_equals(2, proxy.register_listener.call_count)
+    assert_equals(Status.pending, action.status)
+
+
+def test_obsolete_timeouts_ignored():
+    clock = FakeClock()
+    engine = Engine(clock)
+    proxy = mock.MagicMock()
+    proxy.message_type = "Registered"
+    proxy.routing_id = "1"
+    notified_action = Action(lambda: True, lambda: True, proxy, timeout=1.0)
+    removed_action = Action(
+        lambda: True, lambda: True, mock.MagicMock(), timeout=2.0)
+    waiting_action = Action(
+        lambda: True, lambda: True, mock.MagicMock(), timeout=3.0)
+    for action in (notified_action, removed_action, waiting_action):
+        engine.add_action(action)
+    engine.step()
+    assert_equals(1.0, engine.idle_timeout())
+    notified_action.notify("Registered", "1", None)
+    engine.step()
+    assert_equals(2.0, engine.idle_timeout())
+    engine.remove_action(removed_action)
+    # only the deadline of the action still pending is left
+    assert_equals(3.0, engine.idle_timeout())
+    engine.remove_action(waiting_action)
+    assert_is_none(engine.idle_timeout())
+
+
+def test_pending_action_timeout_without_retry():
+    clock = FakeClock()
+    engine = Engine(clock)
+    action = Action(
+        lambda: True,
+        lambda: True,
+        mock.MagicMock(),
+        repeat=True,
+        timeout=1.0,
+        retry_on_timeout=False)
+    engine.add_action(action)
+    engine.step()
+    clock.now += 1.0
+    engine.step()
+    assert_equals(Status.timed_out, action.status)
+    assert_equals(0, engine.retry_count)
+    assert_is_none(engine.idle_timeout())
+
+
+def test_cancel_actions_of_message_hub():
+    engine = Engine(FakeClock())
+    message_hub = mock.MagicMock()
+    other_message_hub = mock.MagicMock()
+    action = Action(lambda: True, lambda: True, mock.MagicMock(), repeat=True)
+    action.set_message_hub(message_hub)
+    other_action = Action(lambda: True, lambda: True, mock.MagicMock())
+    other_action.set_message_hub(other_message_hub)
+    engine.add_action(action)
+    engine.add_action(other_action)
+    engine.step()
+    assert_equals(2, engine.pending_count)
+    engine.notify_message_hub_dropped(message_hub)
+    assert_equals(1, engine.pending_count)
+    assert_equals(1, engine.retry_count)
+    assert_equals(Status.created, action.status)
+    assert_equals(Status.pending, other_action.status)
+
+
+def test_request_action_completed_by_reply():
+    clock = FakeClock()
+    engine = Engine(clock)
+    message_hub_wrapper = mock.MagicMock()
+    message_hub_wrapper.is_valid = True
+    replier = message_hub_wrapper.message_hub.replier
+    replier.request.return_value = 7
+    callback = mock.MagicMock()
+    proxy = RequestProxy(message_hub_wrapper, callback, b"query")
+    action = Action(proxy.send, lambda: True, proxy, timeout=1.0)
+    engine.add_action(action)
+    engine.step()
+    assert_equals(Status.pending, action.status)
+    message, on_reply, timeout = replier.request.call_args[0]
+    assert_equals((b"query", 1.0), (message, timeout))
+    on_reply(b"answer")
+    callback.assert_called_once_with(None, None, b"answer")
+    engine.step()
+    assert_equals(0, engine.pending_count)
+    replier.cancel.assert_not_called()
+
+
+def test_request_action_timeout_cancels_request():
+    clock = FakeClock()
+    engine = Engine(clock)
+    message_hub_wrapper = mock.MagicMock()
+    message_hub_wrapper.is_valid = True
+    replier = message_hub_wrapper.message_hub.replier
+    replier.request.return_value = 7
+    proxy = RequestProxy(message_hub_wrapper, mock.MagicMock(), b"query")
+    action = Action(
+        proxy.send, lambda: True, proxy, timeout=1.0, retry_on_timeout=False)
+    engine.add_action(action)
+    engine.step()
+    clock.now += 1.0
+    engine.step()
+    assert_equals(Status.timed_out, action.status)
+    replier.cancel.assert_called_once_with(7)
+
+
+def test_remove_pending_action():
+    clock = FakeClock()
+    engine = Engine(clock)
+    proxy = mock.MagicMock()
+    done = mock.MagicMock()
+    action = Action(
+        lambda: True, lambda: False, proxy, repeat=True, timeout=1.0)
+    action.add_done_callback(done)
+    engine.add_action(action)
+    engine.step()
+    assert_equals(1, engine.pending_count)
+    engine.remove_action(action)
+    assert_equals(0, engine.pending_count)
+    assert_equals(Status.cancelled, action.status)
+    proxy.unregister.assert_called_once_with(action)
+    done.assert_called_once_with(action)
+    # the timeout is ignored and the action is not repeated
+    clock.now += 1.0
+    engine.step()
+    assert_equals(0, engine.retry_count)
+    assert_is_none(engine.idle_timeout())
+
+
+def test_remove_action_waiting_for_retry():
+    clock = FakeClock()
+    engine = Engine(clock)
+    doer = mock.MagicMock(return_value=False)
+    action = Action(
+        doer, lambda: False, mock.MagicMock(), repeat=True,
+        backoff=Backoff(initial=1.0, jitter=0))
+    engine.add_action(action)
+    engine.step()
+    assert_equals(1, engine.retry_count)
+    engine.remove_action(action)
+    assert_equals(0, engine.retry_count)
+    clock.now += 1.0
+    engine.step()
+    assert_equals(1, doer.call_count)
@@ -0,0 +1,11 @@
+class FakeClock(object):
+    """
+    Clock of the tests (see the `clock` arguments), only moved by changing
+    #now.
+    """
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,31 @@
+import logging
+
+from nose.tools import assert_equals
+
+from orwell.proxy_robots.log_sampling import SamplingFilter
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_sampling_filter():
+    logger = logging.getLogger("orwell.proxy_robots.test.sampling")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    logger.addFilter(SamplingFilter(3))
+    for index in range(7):
+        logger.debug("input %s", index)
+        logger.debug("other %s", index)
+    logger.warning("warning")
+    assert_equals(
+        ["input 0", "other 0", "input 3", "other 3", "input 6", "other 6",
+         "warning"],
+        handler.messages)
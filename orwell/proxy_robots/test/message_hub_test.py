@@ -0,0 +1,285 @@
+from unittest import mock
+import time
+import zmq
+
+from nose.tools import assert_equals
+from nose.tools import assert_false
+from nose.tools import assert_true
+
+from orwell.proxy_robots.message_hub import BACKLOG_STEPS
+from orwell.proxy_robots.message_hub import MESSAGES_COALESCED
+from orwell.proxy_robots.message_hub import MessageHub
+from orwell.proxy_robots.message_hub import SATURATED_STEPS
+from orwell.proxy_robots.message_hub import STEP_READS
+from orwell.proxy_robots.message_hub import WireMode
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+
+
+class ListSubscriber(object):
+    def __init__(self, address, context):
+        self.messages = []
+
+    def read(self):
+        if self.messages:
+            return self.messages.pop(0)
+        return None
+
+    def has_pending(self):
+        return bool(self.messages)
+
+
+def create_message_hub(max_reads_per_step):
+    subscriber = ListSubscriber(None, None)
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        mock.MagicMock(),
+        mock.MagicMock(),
+        max_reads_per_step)
+    return message_hub, subscriber
+
+
+def test_drain_with_limit():
+    message_hub, subscriber = create_message_hub(2)
+    subscriber.messages = [b"1 Unknown a", b"1 Unknown b", b"1 Unknown c"]
+    saturated_steps = SATURATED_STEPS.value
+    step_reads = STEP_READS.sum
+    message_hub.step()
+    statistics = message_hub.statistics
+    assert_equals(2, statistics.last_step_reads)
+    assert_equals(1, statistics.saturated_steps)
+    assert_equals(1, statistics.backlog_steps)
+    # also exported as metrics
+    assert_equals(saturated_steps + 1, SATURATED_STEPS.value)
+    assert_equals(1, BACKLOG_STEPS.value)
+    message_hub.step()
+    assert_equals(0, BACKLOG_STEPS.value)
+    assert_equals(step_reads + 3, STEP_READS.sum)
+    assert_equals(1, statistics.last_step_reads)
+    assert_equals(0, statistics.backlog_steps)
+    assert_equals(3, statistics.messages_read)
+    assert_equals(2, statistics.max_step_reads)
+    assert_false(subscriber.messages)
+
+
+def test_drain_without_limit():
+    message_hub, subscriber = create_message_hub(None)
+    subscriber.messages = [b"1 Unknown x"] * 10
+    message_hub.step()
+    statistics = message_hub.statistics
+    assert_equals(10, statistics.last_step_reads)
+    assert_equals(0, statistics.saturated_steps)
+    assert_equals(1, statistics.steps)
+
+
+def input_payload(routing_id, left=0.5):
+    message = REGISTRY[Messages.Input.name]()
+    message.move.left = left
+    payload = "{0} {1} ".format(routing_id, Messages.Input.name).encode()
+    return payload + message.SerializeToString()
+
+
+def test_dispatch_by_routing_id():
+    message_hub, subscriber = create_message_hub(None)
+    listener1 = mock.MagicMock()
+    listener2 = mock.MagicMock()
+    wildcard = mock.MagicMock()
+    message_hub.register_listener(listener1, Messages.Input.name, "1")
+    # registering twice does not notify twice
+    message_hub.register_listener(listener1, Messages.Input.name, "1")
+    message_hub.register_listener(listener2, Messages.Input.name, "2")
+    message_hub.register_listener(wildcard, Messages.Input.name, "")
+    subscriber.messages = [input_payload("1")]
+    message_hub.step()
+    assert_equals(1, listener1.notify.call_count)
+    listener2.notify.assert_not_called()
+    assert_equals(1, wildcard.notify.call_count)
+    message_type, routing_id, message = listener1.notify.call_args[0]
+    assert_equals(Messages.Input.name, message_type)
+    assert_equals("1", routing_id)
+    assert_equals(0.5, message.move.left)
+
+
+def test_unregister_listener():
+    message_hub, subscriber = create_message_hub(None)
+    listener = mock.MagicMock()
+    message_hub.register_listener(listener, Messages.Input.name, "1")
+    message_hub.unregister_listener(listener, Messages.Input.name, "1")
+    subscriber.messages = [input_payload("1")]
+    message_hub.step()
+    listener.notify.assert_not_called()
+
+
+def test_skip_decoding_without_listener():
+    message_hub, subscriber = create_message_hub(None)
+    listener1 = mock.MagicMock()
+    listener2 = mock.MagicMock()
+    message_hub.register_listener(listener1, Messages.Input.name, "1")
+    message_hub.register_listener(listener2, Messages.Input.name, "1")
+    subscriber.messages = [input_payload("1"), input_payload("2")]
+    message_hub.step()
+    statistics = message_hub.statistics
+    assert_equals(1, statistics.decoded[Messages.Input.name])
+    assert_equals(1, statistics.skipped[Messages.Input.name])
+    # the message is decoded once and shared by the listeners
+    message1 = listener1.notify.call_args[0][2]
+    message2 = listener2.notify.call_args[0][2]
+    assert_true(message1 is message2)
+
+
+def test_filter_subscriptions():
+    subscriber = mock.MagicMock()
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        mock.MagicMock(),
+        mock.MagicMock(),
+        filter_subscriptions=True)
+    subscriber.unsubscribe.assert_called_once_with(b"")
+    subscriber.reset_mock()
+    listener1 = mock.MagicMock()
+    listener2 = mock.MagicMock()
+    message_hub.register_listener(listener1, Messages.Input.name, "12")
+    subscriber.subscribe.assert_called_once_with(b"12 ")
+    message_hub.register_listener(listener2, Messages.Registered.name, "12")
+    message_hub.unregister_listener(listener1, Messages.Input.name, "12")
+    subscriber.unsubscribe.assert_not_called()
+    message_hub.unregister_listener(listener2, Messages.Registered.name, "12")
+    subscriber.unsubscribe.assert_called_once_with(b"12 ")
+
+
+def test_filter_subscriptions_multipart():
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.LINGER, 0)
+    publisher.bind("inproc://filter_subscriptions_multipart")
+    message_hub = MessageHub(
+        context,
+        "inproc://filter_subscriptions_multipart",
+        "inproc://pusher",
+        "replier",
+        replier_type=mock.MagicMock(),
+        max_reads_per_step=None,
+        filter_subscriptions=True,
+        wire_mode=WireMode.multipart)
+    listener = mock.MagicMock()
+    message_hub.register_listener(listener, Messages.Input.name, "12")
+    routing_id, message_type, raw_message = input_payload("12").split(b" ", 2)
+    # the subscription reaches the publisher asynchronously
+    for _ in range(100):
+        publisher.send_multipart([b"13", message_type, raw_message])
+        publisher.send_multipart([routing_id, message_type, raw_message])
+        message_hub.step()
+        if listener.notify.called:
+            break
+        time.sleep(0.01)
+    assert_equals(0.5, listener.notify.call_args[0][2].move.left)
+    assert_equals("12", listener.notify.call_args[0][1])
+    assert_equals(0, message_hub.statistics.skipped[Messages.Input.name])
+    publisher.close()
+
+
+def test_auto_wire_mode_subscriptions():
+    subscriber = mock.MagicMock()
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        mock.MagicMock(),
+        mock.MagicMock(),
+        filter_subscriptions=True,
+        wire_mode=WireMode.auto)
+    subscriber.reset_mock()
+    listener = mock.MagicMock()
+    message_hub.register_listener(listener, Messages.Input.name, "12")
+    assert_equals(
+        [mock.call(b"12 "), mock.call(b"12")],
+        subscriber.subscribe.call_args_list)
+    message_hub.unregister_listener(listener, Messages.Input.name, "12")
+    assert_equals(
+        [mock.call(b"12 "), mock.call(b"12")],
+        subscriber.unsubscribe.call_args_list)
+
+
+def test_auto_wire_mode():
+    subscriber = mock.MagicMock()
+    subscriber.read_multipart.return_value = None
+    pusher = mock.MagicMock()
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        lambda address, context: pusher,
+        mock.MagicMock(),
+        wire_mode=WireMode.auto)
+    register = REGISTRY[Messages.Register.name]()
+    register.temporary_robot_id = "1"
+    message_hub.post_message("1", Messages.Register.name, register)
+    message_hub.step()
+    pusher.write.assert_called_once_with(
+        b"1 Register " + register.SerializeToString())
+    listener = mock.MagicMock()
+    message_hub.register_listener(listener, Messages.Input.name, "1")
+    routing_id, message_type, raw_message = input_payload("1").split(b" ", 2)
+    subscriber.read_multipart.side_effect = [
+        [zmq.Frame(routing_id), zmq.Frame(message_type), zmq.Frame(raw_message)],
+        None]
+    message_hub.step()
+    assert_equals(0.5, listener.notify.call_args[0][2].move.left)
+    assert_true(message_hub.sends_multipart)
+    message_hub.post_message("1", Messages.Register.name, register)
+    message_hub.step()
+    pusher.write_multipart.assert_called_once_with(
+        (b"1", b"Register", register.SerializeToString()))
+
+
+def test_coalesce_inputs():
+    subscriber = ListSubscriber(None, None)
+    message_hub = MessageHub(
+        mock.MagicMock(),
+        "publisher",
+        "pusher",
+        "replier",
+        lambda address, context: subscriber,
+        mock.MagicMock(),
+        mock.MagicMock(),
+        None,
+        coalesced_types=(Messages.Input.name,))
+    listener = mock.MagicMock()
+    message_hub.register_listener(listener, "", "")
+    registered = REGISTRY[Messages.Registered.name]()
+    registered_payload = b"1 Registered " + registered.SerializeToString()
+    subscriber.messages = [
+        input_payload("1", 0.1),
+        registered_payload,
+        input_payload("2", 0.2),
+        input_payload("1", 0.3),
+        registered_payload,
+        input_payload("1", 0.4)]
+    coalesced = MESSAGES_COALESCED.value
+    message_hub.step()
+    notified = [
+        (message_type, routing_id)
+        for message_type, routing_id, _ in (
+            call[0] for call in listener.notify.call_args_list)]
+    assert_equals(
+        [(Messages.Registered.name, "1"),
+         (Messages.Input.name, "2"),
+         (Messages.Registered.name, "1"),
+         (Messages.Input.name, "1")],
+        notified)
+    assert_equals(0.4, round(listener.notify.call_args[0][2].move.left, 3))
+    assert_equals(2, message_hub.statistics.coalesced)
+    assert_equals(coalesced + 2, MESSAGES_COALESCED.value)
+    assert_equals(6, message_hub.statistics.messages_read)
@@ -0,0 +1,45 @@
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+from orwell.proxy_robots.metrics import MetricsRegistry
+
+
+def test_counter_and_gauge():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("test_total", "A counter.")
+    counter.inc()
+    counter.inc(2)
+    # the same counter is returned for the same name
+    assert_true(counter is metrics.counter("test_total", "A counter."))
+    gauge = metrics.gauge("test_gauge", "A gauge.")
+    gauge.set(5)
+    gauge.dec()
+    assert_equals(
+        "# HELP test_gauge A gauge.\n"
+        "# TYPE test_gauge gauge\n"
+        "test_gauge 4\n"
+        "# HELP test_total A counter.\n"
+        "# TYPE test_total counter\n"
+        "test_total 3\n",
+        metrics.export())
+
+
+def test_labelled_histogram():
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram(
+        "test_seconds", "A histogram.", "robot_id", buckets=(0.1, 1.0))
+    child = histogram.labels("951")
+    child.observe(0.05)
+    child.observe(0.1)
+    child.observe(0.5)
+    child.observe(2.0)
+    assert_equals([2, 1, 1], child.counts)
+    assert_equals(
+        "# HELP test_seconds A histogram.\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{robot_id="951",le="0.1"} 2\n'
+        'test_seconds_bucket{robot_id="951",le="1.0"} 3\n'
+        'test_seconds_bucket{robot_id="951",le="+Inf"} 4\n'
+        'test_seconds_sum{robot_id="951"} 2.65\n'
+        'test_seconds_count{robot_id="951"} 4\n',
+        metrics.export())
@@ -0,0 +1,42 @@
+from nose.tools import assert_equals
+
+from orwell.proxy_robots.profiler import LoopProfiler
+from orwell.proxy_robots.profiler import RollingPercentiles
+from orwell.proxy_robots.test.fake_clock import FakeClock
+
+
+def test_rolling_percentiles():
+    rolling = RollingPercentiles(10)
+    for value in range(20):
+        rolling.add(float(value))
+    # only the last 10 values are kept
+    assert_equals(
+        {"p50": 15.0, "p90": 19.0, "p99": 19.0, "max": 19.0, "count": 10},
+        rolling.to_dict())
+
+
+def test_slow_tick_trace():
+    clock = FakeClock(0.0)
+    profiler = LoopProfiler(0.01, clock)
+    profiler.start_tick()
+    clock.now += 0.001
+    profiler.lap("message_hub")
+    clock.now += 0.002
+    profiler.lap("robot 1")
+    profiler.end_tick()
+    assert_equals([], profiler.slow_ticks)
+    profiler.start_tick()
+    clock.now += 0.001
+    profiler.lap("message_hub")
+    clock.now += 0.02
+    profiler.lap("robot 1")
+    profiler.end_tick()
+    trace, = profiler.slow_ticks
+    assert_equals(2, trace["tick"])
+    assert_equals("robot 1", trace["slowest"])
+    assert_equals(
+        ["message_hub", "robot 1"],
+        [phase["phase"] for phase in trace["phases"]])
+    report = profiler.to_dict()
+    assert_equals(1, report["slow_ticks"])
+    assert_equals(2, report["phases"]["robot 1"]["count"])
@@ -1,10 +1,14 @@
 from enum import Enum
 from nose.tools import assert_equals
 from nose.tools import assert_false
+from nose.tools import assert_raises
 from nose.tools import assert_true
 import datetime
+import os
 import socket
+import tempfile
 import threading
+import time
 import unittest.mock
 import zmq
 import queue
@@ -12,8 +16,11 @@ import queue
 import orwell_common.broadcast_listener
 import orwell_common.logging
 
+from orwell.proxy_robots.capture import Direction
+from orwell.proxy_robots.capture import read_capture
 from orwell.proxy_robots.message_hub import BroadcasterMessageHubWrapper
 from orwell.proxy_robots.program import Program
+from orwell.proxy_robots.program import run
 from orwell.proxy_robots.registry import Messages
 from orwell.proxy_robots.registry import REGISTRY
 
@@ -34,29 +41,17 @@ FIRES = [
 
 class FakeDevice(object):
     def __init__(self, robot_id):
-        self.expected_moves = []
-        for other_robot_id, left, right in MOVES:
+        # every input changes the move so each one is applied
+        self.expected_states = []
+        for (other_robot_id, left, right), (_, fire1, fire2) in zip(MOVES, FIRES):
             if robot_id == other_robot_id:
-                self.expected_moves.append((left, right))
-        self.expected_fires = []
-        for other_robot_id, fire1, fire2 in FIRES:
-            if robot_id == other_robot_id:
-                self.expected_fires.append((fire1, fire2))
-
-    def move(
-            self,
-            left,
-            right):
-        expected_left, expected_right = self.expected_moves.pop(0)
-        print("FakeDevice::move(%s, %s) - %s %s" % (left, right, expected_left, expected_right))
-        assert_equals(expected_left, left)
-        assert_equals(expected_right, right)
-
-    def fire(self, fire1, fire2):
-        expected_fire1, expected_fire2 = self.expected_fires.pop(0)
-        print("FakeDevice::fire(%s, %s) - %s %s" % (fire1, fire2, expected_fire1, expected_fire2))
-        assert_equals(expected_fire1, fire1)
-        assert_equals(expected_fire2, fire2)
+                self.expected_states.append((left, right, fire1, fire2))
+
+    def apply_state(self, left, right, fire1, fire2):
+        expected_state = self.expected_states.pop(0)
+        print("FakeDevice::apply_state(%s, %s, %s, %s) - %s" % (
+            left, right, fire1, fire2, expected_state))
+        assert_equals(expected_state, (left, right, fire1, fire2))
 
     def ready(self):
         return True
@@ -77,6 +72,15 @@ class FakeArguments(object):
     no_server_broadcast = True
     no_proxy_broadcast = False
     proxy_broadcast_port = 0
+    subscription_filtering = False
+    wire_mode = "single"
+    max_reads_per_step = 1
+    writer_thread = False
+    input_coalescing = False
+    profile = False
+    tick_budget = 0.01
+    admin_stream_port = 0
+    capture = None
 
 
 class MockPusher(object):
@@ -136,8 +140,11 @@ class MockReplier(object):
     def __init__(self, address, context):
         pass
 
-    def exchange(self, query):
-        return None
+    def request(self, message, callback, timeout=None):
+        return 0
+
+    def step(self):
+        pass
 
 
 class FakeRobot(threading.Thread):
@@ -200,8 +207,7 @@ def check_simple_input(program):
     # make sure all inputs have been consumed
     for robot_id, _, device in ROBOT_DESCRIPTORS:
         print('robot_id =', robot_id)
-        assert_equals(0, len(device.expected_moves))
-        assert_equals(0, len(device.expected_fires))
+        assert_equals(0, len(device.expected_states))
 
 
 INPUT_MOVE = (0.89, -0.5)
@@ -214,11 +220,8 @@ class DummyDevice(object):
     def __dell(self):
         assert_true(self._moved)
 
-    def move(
-            self,
-            left,
-            right):
-        print('move', left, right)
+    def apply_state(self, left, right, fire1, fire2):
+        print('apply_state', left, right, fire1, fire2)
         assert_equals(INPUT_MOVE[0], left)
         assert_equals(INPUT_MOVE[1], right)
         self._moved = True
@@ -419,6 +422,96 @@ def test_missing_server_game():
     assert_true(wrapper.is_valid)
 
 
+def test_capture_written_on_stop():
+    capture_file = tempfile.NamedTemporaryFile(suffix=".cap", delete=False)
+    capture_file.close()
+    os.remove(capture_file.name)
+    arguments = FakeArguments()
+    arguments.capture = capture_file.name
+    admin_mock = unittest.mock.MagicMock()
+    admin_mock.return_value = admin_mock
+    program = Program(
+        zmq.Context(1),
+        arguments,
+        MockSubscriber,
+        MockPusher,
+        MockReplier,
+        admin_mock)
+    try:
+        for robot_id, _, device in ROBOT_DESCRIPTORS:
+            program.add_robot(robot_id, device)
+        program.step()
+        program.step()
+        program.stop()
+        directions = [
+            direction for _, direction, _ in read_capture(capture_file.name)]
+        # the registration and its reply
+        assert_equals(1, directions.count(Direction.outbound))
+        assert_equals(1, directions.count(Direction.inbound))
+    finally:
+        os.remove(capture_file.name)
+
+
+def test_posted_register_sent_without_waiting():
+    admin_mock = unittest.mock.MagicMock()
+    admin_mock.return_value = admin_mock
+    admin_mock.socket = None
+    program = Program(
+        zmq.Context(1),
+        FakeArguments(),
+        MockSubscriber,
+        MockPusher,
+        MockReplier,
+        admin_mock)
+    device = unittest.mock.MagicMock()
+    device.get_socket.return_value = None
+    program.add_robot('951', device)
+    # the engine posts the Register after the message hub wrote
+    program.step()
+    pusher = program._message_hub_wrapper.message_hub._pusher
+    assert_equals(1, len(pusher.messages))
+    assert_equals(0, program.idle_timeout())
+    start = time.monotonic()
+    program.wait(max_timeout=1.0)
+    assert_true(time.monotonic() - start < 0.5)
+    program.step()
+    assert_equals([], pusher.messages)
+
+
+def test_stop_writes_what_is_left():
+    arguments = FakeArguments()
+    arguments.writer_thread = True
+    arguments.no_proxy_broadcast = True
+    admin_mock = unittest.mock.MagicMock()
+    admin_mock.return_value = admin_mock
+    program = Program(
+        zmq.Context(1),
+        arguments,
+        MockSubscriber,
+        MockPusher,
+        MockReplier,
+        admin_mock)
+    device = unittest.mock.MagicMock()
+    device.get_socket.return_value = None
+    program.add_robot('951', device)
+    program.start()
+    # the Register is given to the writer thread
+    program.step()
+    program.step()
+    writer = program.writer
+    program.stop()
+    assert_equals(0, writer.queue_depth)
+    assert_equals(1, writer.statistics.sent)
+    assert_true(writer._thread is None)
+
+
+def test_run_stops_program():
+    program = unittest.mock.MagicMock()
+    program.step.side_effect = RuntimeError("step failed")
+    assert_raises(RuntimeError, run, program, False)
+    program.stop.assert_called_once_with()
+
+
 def main():
     test_robot_registration()
     test_robot_input()
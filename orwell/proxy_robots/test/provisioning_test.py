@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_raises
+from nose.tools import assert_true
+
+from orwell.proxy_robots.devices import FakeDevice
+from orwell.proxy_robots.devices import HarpiDevice
+from orwell.proxy_robots.provisioning import DeviceFactory
+from orwell.proxy_robots.provisioning import DeviceType
+from orwell.proxy_robots.provisioning import RegistrationQueue
+from orwell.proxy_robots.provisioning import RobotDescription
+from orwell.proxy_robots.provisioning import load_config
+from orwell.proxy_robots.provisioning import parse_config
+from orwell.proxy_robots.test.fake_clock import FakeClock
+
+
+def test_load_config():
+    content = {
+        "registration": {"batch_size": 5, "interval": 0.5},
+        "robots": [
+            {"id": 951, "device": "harpi", "port": 10951},
+            {"id": "952"},
+            {"id": "953", "device": "fake"},
+        ]}
+    with tempfile.NamedTemporaryFile(
+            "w", suffix=".json", delete=False) as config_file:
+        json.dump(content, config_file)
+    try:
+        configuration = load_config(config_file.name)
+    finally:
+        os.remove(config_file.name)
+    assert_equals(5, configuration.batch_size)
+    assert_equals(0.5, configuration.registration_interval)
+    assert_equals(
+        [("951", DeviceType.harpi, 10951),
+         ("952", DeviceType.harpi, None),
+         ("953", DeviceType.fake, None)],
+        [(description.robot_id, description.device_type, description.port)
+         for description in configuration.robots])
+
+
+def test_parse_config_errors():
+    assert_raises(ValueError, parse_config, {"robots": [{"port": 1}]})
+    assert_raises(
+        ValueError, parse_config, {"robots": [{"id": "1", "device": "x"}]})
+    assert_raises(
+        ValueError, parse_config, {"robots": [{"id": "1"}, {"id": "1"}]})
+
+
+def test_device_factory():
+    sockets_lister = mock.MagicMock()
+    sockets_lister.pop_available_socket.return_value = None
+    factory = DeviceFactory(sockets_lister)
+    assert_true(isinstance(
+        factory.create(RobotDescription("1", DeviceType.fake)), FakeDevice))
+    # out of sockets
+    assert_true(isinstance(
+        factory.create(RobotDescription("2")), FakeDevice))
+    assert_raises(
+        ValueError,
+        factory.create,
+        RobotDescription("3", DeviceType.shared))
+    # any free port
+    device = factory.create(RobotDescription("4", DeviceType.harpi, 0))
+    assert_true(isinstance(device, HarpiDevice))
+    sock = device.get_socket()
+    assert_true(sock.getsockname()[1] > 0)
+    factory.release("4", device)
+    assert_equals(-1, sock.fileno())
+    assert_is_none(device.address)
+
+
+def test_release_shared_device():
+    multiplexer = mock.MagicMock()
+    device = mock.MagicMock()
+    device.multiplexer = multiplexer
+    DeviceFactory(multiplexer=multiplexer).release("1", device)
+    multiplexer.remove_device.assert_called_once_with("1")
+    device.close.assert_called_once_with()
+
+
+def test_registration_batches():
+    clock = FakeClock()
+    queue = RegistrationQueue(batch_size=2, interval=1.0, clock=clock)
+    assert_is_none(queue.idle_timeout())
+    robots = [mock.MagicMock() for _ in range(5)]
+    for robot in robots:
+        queue.add(robot)
+    queue.remove(robots[4])
+    assert_equals(0, queue.idle_timeout())
+    queue.step()
+    assert_equals(
+        [1, 1, 0, 0],
+        [robot.queue_register.call_count for robot in robots[:4]])
+    assert_equals(1.0, queue.idle_timeout())
+    clock.now += 0.5
+    queue.step()
+    assert_equals(2, len(queue))
+    clock.now += 0.5
+    queue.step()
+    assert_equals(0, len(queue))
+    assert_equals(
+        [1, 1, 1, 1, 0],
+        [robot.queue_register.call_count for robot in robots])
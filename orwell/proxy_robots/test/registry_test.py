@@ -0,0 +1,49 @@
+from nose.tools import assert_equals
+from nose.tools import assert_false
+from nose.tools import assert_is_none
+from nose.tools import assert_true
+
+from orwell.proxy_robots.registry import MESSAGE_TYPES
+from orwell.proxy_robots.registry import MessageRegistry
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+
+
+class FakeMessage(object):
+    def __init__(self):
+        self.value = None
+
+    def Clear(self):
+        self.value = None
+
+
+def test_pooled_message_type():
+    registry = MessageRegistry()
+    registry.register("Fake", FakeMessage, pooled=True)
+    message_type = registry.get(b"Fake")
+    assert_equals("Fake", message_type.name)
+    message = message_type.acquire()
+    message.value = 1
+    again = message_type.acquire()
+    assert_true(message is again)
+    assert_is_none(again.value)
+
+
+def test_not_pooled_message_type():
+    registry = MessageRegistry()
+    message_type = registry.register("Fake", FakeMessage)
+    assert_false(message_type.acquire() is message_type.acquire())
+
+
+def test_register_at_runtime():
+    assert_is_none(MESSAGE_TYPES.get(b"Fake"))
+    MESSAGE_TYPES.register("Fake", FakeMessage)
+    try:
+        assert_true(MESSAGE_TYPES.get(b"Fake") is not None)
+        assert_true(isinstance(REGISTRY["Fake"](), FakeMessage))
+    finally:
+        MESSAGE_TYPES.unregister("Fake")
+    assert_false("Fake" in REGISTRY)
+    assert_true(MESSAGE_TYPES.get(b"Input").pooled)
+    assert_false(MESSAGE_TYPES.get(
+        Messages.Registered.name.encode()).pooled)
@@ -0,0 +1,48 @@
+from nose.tools import assert_equals
+from nose.tools import assert_true
+
+from orwell.proxy_robots.capture import Direction
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
+from orwell.proxy_robots.replay import Replay
+
+
+def _payload(routing_id, message_type, message):
+    return "{0} {1} ".format(routing_id, message_type).encode() + \
+        message.SerializeToString()
+
+
+def _records():
+    register = REGISTRY[Messages.Register.name]()
+    register.temporary_robot_id = "951"
+    register.image = "no image"
+    registered = REGISTRY[Messages.Registered.name]()
+    registered.robot_id = "real_951"
+    registered.team = "BLU"
+    records = [
+        (10.0, Direction.outbound,
+         [_payload("951", Messages.Register.name, register)]),
+        (10.1, Direction.inbound,
+         [_payload("951", Messages.Registered.name, registered)]),
+    ]
+    for index in range(8):
+        message = REGISTRY[Messages.Input.name]()
+        message.move.left = index / 8.0
+        message.move.right = -0.5
+        records.append((
+            10.2 + index * 0.01,
+            Direction.inbound,
+            [_payload("real_951", Messages.Input.name, message)]))
+    return records
+
+
+def test_replay_at_max_speed():
+    replay = Replay(_records(), ["951"], speed=0)
+    statistics = replay.run()
+    assert_equals(9, statistics["messages"])
+    assert_equals(1, statistics["registered"])
+    assert_equals(1, statistics["captured_written"])
+    assert_true(statistics["written"] >= 1)
+    robot = replay.program.robots["951"]
+    assert_equals(0.875, robot.left)
+    assert_equals(-0.5, robot.right)
@@ -1,7 +1,12 @@
+from orwell.proxy_robots.metrics import METRICS
+from orwell.proxy_robots.registry import Messages
+from orwell.proxy_robots.registry import REGISTRY
 from orwell.proxy_robots.robot import Robot
 from unittest import mock
 
 from nose.tools import assert_equals
+from nose.tools import assert_false
+from nose.tools import assert_true
 
 
 def test_robot_to_dict():
@@ -19,3 +24,46 @@ def test_robot_to_dict():
     robot.step()
     expected_dict = {robot_id: {"address": address}}
     assert_equals(expected_dict, robot.to_dict())
+
+
+def test_robot_version():
+    device = mock.MagicMock()
+    device.address = None
+    robot = Robot("robot_id", mock.MagicMock(), mock.MagicMock(), device)
+    change_callback = mock.MagicMock()
+    robot.set_change_callback(change_callback)
+    version = robot.version
+    robot.step()
+    assert_equals(version, robot.version)
+    device.address = "12.34.56.78"
+    # the address is checked by the step
+    assert_equals(version, robot.version)
+    robot.step()
+    assert_equals(version + 1, robot.version)
+    robot.step()
+    assert_equals(version + 1, robot.version)
+    change_callback.assert_called_once_with()
+
+
+def test_metrics_follow_robot_id():
+    robot = Robot(
+        "temporary_id", mock.MagicMock(), mock.MagicMock(), mock.MagicMock())
+    assert_true('robot_id="temporary_id"' in METRICS.export())
+    registered = REGISTRY[Messages.Registered.name]()
+    registered.robot_id = "real_id"
+    robot.notify(Messages.Registered.name, "temporary_id", registered)
+    exported = METRICS.export()
+    assert_false('robot_id="temporary_id"' in exported)
+    assert_true('robot_id="real_id"' in exported)
+    robot.remove()
+    assert_false('robot_id="real_id"' in METRICS.export())
+
+
+def test_input_count():
+    robot = Robot("robot_id", mock.MagicMock(), mock.MagicMock(), mock.MagicMock())
+    assert_equals(0, robot.input_count)
+    message = REGISTRY[Messages.Input.name]()
+    message.move.left = 0.5
+    robot.notify(Messages.Input.name, "robot_id", message)
+    assert_equals(1, robot.input_count)
+    assert_equals(0.5, robot.left)
@@ -0,0 +1,107 @@
+import json
+from unittest import mock
+
+from nose.tools import assert_equals
+
+from orwell.proxy_robots.state_stream import DELTA_TOPIC
+from orwell.proxy_robots.state_stream import KEYFRAME_TOPIC
+from orwell.proxy_robots.state_stream import StateStream
+from orwell.proxy_robots.state_stream import robot_state
+from orwell.proxy_robots.test.fake_clock import FakeClock
+
+
+class ListPublisher(object):
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload):
+        self.messages.append((topic, json.loads(payload.decode())))
+
+
+def create_robot(robot_id):
+    robot = mock.MagicMock()
+    robot.robot_id = robot_id
+    robot.registered = False
+    robot.device.address = None
+    robot.left = robot.right = 0.0
+    robot.fire1 = robot.fire2 = False
+    robot.device_state = None
+    robot.version = 0
+    robot.input_count = 0
+    return robot
+
+
+def test_keyframe_then_throttled_deltas():
+    clock = FakeClock()
+    publisher = ListPublisher()
+    program = mock.MagicMock()
+    robot = create_robot("1")
+    program.robots = {"1": robot}
+    stream = StateStream(publisher, program, 0.5, 10.0, clock)
+    stream.step()
+    topic, keyframe = publisher.messages.pop()
+    assert_equals(KEYFRAME_TOPIC, topic)
+    assert_equals(1, keyframe["sequence"])
+    assert_equals("1", keyframe["robots"]["1"]["robot_id"])
+    robot.left = 0.5
+    robot.input_count += 1
+    clock.now += 0.1
+    stream.step()
+    # too soon after the keyframe
+    assert_equals([], publisher.messages)
+    robot.right = 0.25
+    robot.input_count += 1
+    clock.now += 0.4
+    stream.step()
+    topic, delta = publisher.messages.pop()
+    assert_equals(DELTA_TOPIC, topic)
+    assert_equals(
+        {"robot": "1", "changes": {"left": 0.5, "right": 0.25}, "sequence": 2},
+        delta)
+    clock.now += 1.0
+    stream.step()
+    # nothing changed
+    assert_equals([], publisher.messages)
+    robot.device.address = ("1.2.3.4", 10000)
+    robot.registered = True
+    robot.version += 1
+    clock.now += 1.0
+    stream.step()
+    _, delta = publisher.messages.pop()
+    assert_equals(
+        {"address": ["1.2.3.4", 10000], "registered": True},
+        delta["changes"])
+    program.robots = {}
+    stream.step()
+    _, delta = publisher.messages.pop()
+    assert_equals({"robot": "1", "removed": True, "sequence": 4}, delta)
+    clock.now += 10.0
+    stream.step()
+    topic, keyframe = publisher.messages.pop()
+    assert_equals(KEYFRAME_TOPIC, topic)
+    assert_equals({}, keyframe["robots"])
+
+
+def test_unchanged_robots_are_skipped():
+    clock = FakeClock()
+    publisher = ListPublisher()
+    program = mock.MagicMock()
+    robots = [create_robot(str(index)) for index in range(3)]
+    program.robots = {robot.robot_id: robot for robot in robots}
+    stream = StateStream(publisher, program, 0.0, 10.0, clock)
+    stream.step()
+    publisher.messages.pop()
+    robots[1].left = 1.0
+    robots[1].input_count += 1
+    with mock.patch(
+            "orwell.proxy_robots.state_stream.robot_state",
+            wraps=robot_state) as get_state:
+        clock.now += 1.0
+        stream.step()
+        get_state.assert_called_once_with(robots[1])
+        _, delta = publisher.messages.pop()
+        assert_equals({"left": 1.0}, delta["changes"])
+        clock.now += 1.0
+        stream.step()
+        get_state.assert_called_once_with(robots[1])
+    assert_equals([], publisher.messages)
@@ -0,0 +1,121 @@
+import json
+import socket
+
+from nose.tools import assert_equals
+from nose.tools import assert_true
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from orwell.proxy_robots.admin import Admin
+from orwell.proxy_robots.devices import FakeDevice
+from orwell.proxy_robots.devices import HarpiDevice
+from orwell.proxy_robots.supervisor import Supervisor
+from orwell.proxy_robots.supervisor import _run_worker
+from orwell.proxy_robots.supervisor import merge_json
+from orwell.proxy_robots.supervisor import merge_list_robot
+from orwell.proxy_robots.supervisor import merge_version
+from orwell.proxy_robots.supervisor import split_robots
+
+
+def test_split_robots():
+    robots = [(str(index), None) for index in range(5)]
+    shards = split_robots(robots, 2)
+    assert_equals(
+        [[("0", None), ("2", None), ("4", None)], [("1", None), ("3", None)]],
+        shards)
+
+
+def test_merge_list_robot():
+    replies = [str(["1", "3"]), str([]), str(["2"])]
+    assert_equals(str(["1", "3", "2"]), merge_list_robot(replies))
+
+
+def test_merge_json():
+    replies = [
+        json.dumps({"1": {"address": "1.1.1.1"}}),
+        json.dumps({"2": {"address": ""}})]
+    expected = {"1": {"address": "1.1.1.1"}, "2": {"address": ""}}
+    assert_equals(expected, json.loads(merge_json(replies)))
+
+
+def test_merge_version():
+    assert_equals("5", merge_version(["2", "3"]))
+
+
+class FakeArguments(object):
+    admin_port = 9082
+    admin_stream_port = 0
+    capture = None
+    no_proxy_broadcast = True
+    worker_count = 2
+
+    verbose = False
+    debug_sampling = 0
+    reactor = True
+    use_asyncio = False
+
+
+def _create_supervisor(robots):
+    supervisor = Supervisor(
+        MagicMock(), FakeArguments(), robots, admin_socket_type=MagicMock())
+    for worker in supervisor._workers:
+        worker.exchange = MagicMock()
+    return supervisor
+
+
+def test_add_remove_robot_routed_to_worker():
+    supervisor = _create_supervisor([("1", None), ("2", None), ("3", None)])
+    first, second = supervisor._workers
+    # the second worker has the fewest robots
+    second.exchange.return_value = Admin.ROBOT_ADDED.format(robot_id="4")
+    supervisor._handle_admin_message("add robot 4 fake")
+    second.exchange.assert_called_once_with("add robot 4 fake")
+    first.exchange.assert_not_called()
+    supervisor._admin_socket.write.assert_called_once_with(
+        Admin.ROBOT_ADDED.format(robot_id="4"))
+    second.exchange.reset_mock()
+    second.exchange.return_value = Admin.ROBOT_REMOVED.format(robot_id="4")
+    supervisor._handle_admin_message("remove robot 4")
+    second.exchange.assert_called_once_with("remove robot 4")
+    first.exchange.return_value = Admin.ROBOT_REMOVED.format(robot_id="3")
+    supervisor._handle_admin_message("remove robot 3")
+    first.exchange.assert_called_once_with("remove robot 3")
+    supervisor._admin_socket.write.reset_mock()
+    supervisor._handle_admin_message("remove robot 4")
+    supervisor._admin_socket.write.assert_called_once_with(
+        Admin.COMMAND_FAILED.format(error="unknown robot 4"))
+
+
+def test_add_robot_rejected_by_supervisor():
+    supervisor = _create_supervisor([("1", None)])
+    write = supervisor._admin_socket.write
+    supervisor._handle_admin_message("add robot 1")
+    write.assert_called_once_with(
+        Admin.COMMAND_FAILED.format(error="robot 1 already added"))
+    write.reset_mock()
+    supervisor._handle_admin_message("add robot 2 shared")
+    write.assert_called_once_with(Admin.COMMAND_FAILED.format(
+        error="shared robots cannot be used with several workers"))
+    for worker in supervisor._workers:
+        worker.exchange.assert_not_called()
+
+
+def test_worker_binds_robot_ports():
+    free_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    free_socket.bind(("", 0))
+    port = free_socket.getsockname()[1]
+    free_socket.close()
+    with patch("orwell.proxy_robots.program.Program") as program_type, \
+            patch("orwell.proxy_robots.program.run") as run, \
+            patch("orwell.proxy_robots.supervisor.signal.signal"):
+        _run_worker(FakeArguments(), 9083, [("1", port), ("2", None)])
+    program = program_type.return_value
+    assert_equals(9083, program_type.call_args[0][1].admin_port)
+    ((robot_id1, device1), _), ((robot_id2, device2), _) = \
+        program.add_robot.call_args_list
+    assert_equals(("1", "2"), (robot_id1, robot_id2))
+    assert_true(isinstance(device1, HarpiDevice))
+    assert_equals(port, device1.get_socket().getsockname()[1])
+    assert_true(isinstance(device2, FakeDevice))
+    run.assert_called_once_with(program, True, False)
+    device1.get_socket().close()
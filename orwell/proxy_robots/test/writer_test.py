@@ -0,0 +1,50 @@
+from unittest import mock
+
+from nose.tools import assert_equals
+
+from orwell.proxy_robots.test.fake_clock import FakeClock
+from orwell.proxy_robots.writer import DeviceWriter
+
+
+def test_only_newest_state_is_sent():
+    clock = FakeClock(10.0)
+    writer = DeviceWriter(clock)
+    device1 = mock.MagicMock()
+    device2 = mock.MagicMock()
+    threaded_device1 = writer.wrap_device(device1)
+    threaded_device2 = writer.wrap_device(device2)
+    threaded_device1.apply_state(0.5, 0.5, False, False)
+    threaded_device2.apply_state(1.0, 1.0, True, False)
+    threaded_device1.apply_state(-0.5, 0.5, False, True)
+    device1.apply_state.assert_not_called()
+    assert_equals(2, writer.queue_depth)
+    clock.now += 0.25
+    writer.flush()
+    device1.apply_state.assert_called_once_with(-0.5, 0.5, False, True)
+    device2.apply_state.assert_called_once_with(1.0, 1.0, True, False)
+    statistics = writer.statistics
+    assert_equals(3, statistics.posted)
+    assert_equals(2, statistics.sent)
+    assert_equals(1, statistics.coalesced)
+    assert_equals(2, statistics.max_queue_depth)
+    assert_equals(0.25, statistics.max_latency)
+    assert_equals(0, writer.queue_depth)
+
+
+def test_messages_are_all_sent_in_order():
+    writer = DeviceWriter()
+    pusher = mock.MagicMock()
+    pusher_type = mock.MagicMock(return_value=pusher)
+    threaded_pusher = writer.wrap_pusher_type(pusher_type)("address", None)
+    threaded_pusher.write(b"1")
+    threaded_pusher.write_multipart((b"2", b"3"))
+    threaded_pusher.write(b"4")
+    pusher.write.assert_not_called()
+    writer.start()
+    writer.stop()
+    assert_equals(
+        [mock.call.write(b"1"),
+         mock.call.write_multipart((b"2", b"3")),
+         mock.call.write(b"4")],
+        pusher.mock_calls)
+    assert_equals(3, writer.statistics.sent)
@@ -0,0 +1,213 @@
+import collections
+import logging
+import threading
+import time
+
+from orwell.proxy_robots.devices import MoveFireAdapter
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WriterStatistics(object):
+    """
+    Counters telling how far behind the writer thread is.
+    """
+
+    def __init__(self):
+        # number of device states and messages given to the writer
+        self.posted = 0
+        # number of device states and messages written
+        self.sent = 0
+        # number of device states replaced by a newer one before being sent
+        self.coalesced = 0
+        # largest number of entries waiting to be written
+        self.max_queue_depth = 0
+        # time (in seconds) between the post and the end of the write
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    @property
+    def mean_latency(self):
+        if not self.sent:
+            return 0.0
+        return self.total_latency / self.sent
+
+    def to_dict(self, queue_depth):
+        return {
+            "posted": self.posted,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+            "mean_latency": self.mean_latency,
+        }
+
+    def record_send(self, latency):
+        self.sent += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+
+class DeviceWriter(object):
+    """
+    Thread sending the device states and the messages to the game server so
+    that a slow write does not delay the control loop.
+
+    The control thread and the writer share deques and dicts only (their
+    operations are atomic in CPython), so neither waits for the other. Only
+    the newest state posted for a device is sent; the messages are all sent
+    in order.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        # device -> (state, post time) of the newest state not sent yet
+        self._latest = {}
+        # devices in the order of the posts (a device posted several times
+        # before the writer runs appears several times, only its first
+        # occurrence finds a state)
+        self._devices = collections.deque()
+        # (write function, message, post time)
+        self._messages = collections.deque()
+        self._wake_up = threading.Event()
+        self._running = False
+        self._thread = None
+        self._statistics = WriterStatistics()
+
+    @property
+    def statistics(self):
+        return self._statistics
+
+    @property
+    def queue_depth(self):
+        """
+        Number of device states and messages waiting to be written.
+        """
+        return len(self._latest) + len(self._messages)
+
+    def wrap_device(self, device):
+        """
+        Return a device whose updates are sent by the writer.
+        """
+        return ThreadedDevice(device, self)
+
+    def wrap_pusher_type(self, pusher_type):
+        """
+        Return a factory (see #MessageHub) of pushers whose messages are sent
+        by the writer.
+        """
+        def create_pusher(address, zmq_context):
+            return ThreadedPusher(pusher_type(address, zmq_context), self)
+        return create_pusher
+
+    def post_state(self, device, state):
+        """
+        Ask the writer to call `device.apply_state(*state)`.
+        """
+        if device in self._latest:
+            self._statistics.coalesced += 1
+        self._latest[device] = (state, self._clock())
+        self._devices.append(device)
+        self._posted()
+
+    def post_message(self, write, message):
+        """
+        Ask the writer to call `write(message)`.
+        """
+        self._messages.append((write, message, self._clock()))
+        self._posted()
+
+    def _posted(self):
+        self._statistics.posted += 1
+        depth = self.queue_depth
+        if depth > self._statistics.max_queue_depth:
+            self._statistics.max_queue_depth = depth
+        self._wake_up.set()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="DeviceWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write what is left and stop the thread.
+        """
+        self._running = False
+        self._wake_up.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            self._wake_up.wait()
+            self._wake_up.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """
+        Write everything posted so far (called by the thread).
+        """
+        while self._messages:
+            write, message, posted_at = self._messages.popleft()
+            try:
+                write(message)
+            except Exception:
+                LOGGER.exception("Failed to write %r", message)
+            self._statistics.record_send(self._clock() - posted_at)
+        while self._devices:
+            device = self._devices.popleft()
+            entry = self._latest.pop(device, None)
+            if entry is None:
+                # already sent with a newer state
+                continue
+            state, posted_at = entry
+            try:
+                device.apply_state(*state)
+            except Exception:
+                LOGGER.exception("Failed to update device %r", device)
+            self._statistics.record_send(self._clock() - posted_at)
+
+
+class ThreadedDevice(object):
+    """
+    Give the updates of a device to a #DeviceWriter (everything else is
+    forwarded to the device).
+    """
+
+    def __init__(self, device, writer):
+        if not hasattr(device, "apply_state"):
+            device = MoveFireAdapter(device)
+        self._device = device
+        self._writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def apply_state(self, left, right, fire1, fire2):
+        self._writer.post_state(self._device, (left, right, fire1, fire2))
+
+
+class ThreadedPusher(object):
+    """
+    Give the messages of a pusher to a #DeviceWriter. The zmq socket of the
+    pusher is then only used by the writer thread.
+    """
+
+    def __init__(self, pusher, writer):
+        self._pusher = pusher
+        self._writer = writer
+
+    def write(self, message):
+        self._writer.post_message(self._pusher.write, message)
+
+    def write_multipart(self, frames):
+        self._writer.post_message(self._pusher.write_multipart, frames)